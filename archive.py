@@ -0,0 +1,112 @@
+# archive.py
+import datetime
+import random
+import threading
+import time
+from pymongo.errors import BulkWriteError
+from db import HISTORY_COLLECTION
+from counters import bump_queue_counts
+from jobs import queue_of
+
+def archive_completed(db, batch_size=500, archive_after_seconds=0):
+    """
+    Move one batch of completed jobs from 'jobs' into the history collection.
+    Returns how many jobs were moved.
+
+    Copy first, delete second: if we crash in between, the next run finds
+    the same jobs again and the duplicate _id inserts are simply ignored.
+    """
+    jobs_collection = db["jobs"]
+    history_collection = db[HISTORY_COLLECTION]
+    now = datetime.datetime.utcnow()
+    cutoff = now - datetime.timedelta(seconds=archive_after_seconds)
+
+    docs = [
+        doc for doc in jobs_collection.find(
+            {"state": "completed", "updated_at": {"$lte": cutoff}}
+        ).limit(batch_size)
+    ]
+    if not docs:
+        return 0
+
+    for doc in docs:
+        doc["archived_at"] = now
+
+    try:
+        history_collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # Already archived by an earlier, interrupted run
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+    # One delete per queue, so the counters only drop by what this run
+    # removed: a concurrent compactor may have deleted some docs already
+    ids_by_queue = {}
+    for doc in docs:
+        ids_by_queue.setdefault(queue_of(doc), []).append(doc["_id"])
+    deleted = {
+        queue: jobs_collection.delete_many({"_id": {"$in": ids}, "state": "completed"}).deleted_count
+        for queue, ids in ids_by_queue.items()
+    }
+    bump_queue_counts(db, {queue: {"completed": -n} for queue, n in deleted.items()})
+    return sum(deleted.values())
+
+def trim_history(db, max_docs):
+    """Delete the oldest history entries beyond max_docs (0 = no cap)."""
+    if max_docs <= 0:
+        return 0
+
+    history_collection = db[HISTORY_COLLECTION]
+    excess = history_collection.estimated_document_count() - max_docs
+    if excess <= 0:
+        return 0
+
+    oldest = history_collection.find({}, {"_id": 1}).sort("archived_at", 1).limit(excess)
+    ids = [doc["_id"] for doc in oldest]
+    return history_collection.delete_many({"_id": {"$in": ids}}).deleted_count
+
+def compact(db, config, max_batches=None):
+    """
+    Archive completed jobs batch by batch until none are left (or
+    max_batches is reached), then enforce the history size cap.
+    Returns (archived, trimmed).
+    """
+    archived = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_completed(db, config["compact_batch_size"], config["archive_after_seconds"])
+        if moved == 0:
+            break
+        archived += moved
+        batches += 1
+
+    trimmed = trim_history(db, config["history_max_docs"])
+    return archived, trimmed
+
+def start_compactor(db, config, should_continue, label="Worker"):
+    """
+    Run compact() every 'compact_interval' seconds on a daemon thread.
+    Every worker may run one; compaction is idempotent, and the random
+    start offset keeps a pool from compacting in lockstep.
+    """
+    interval = config["compact_interval"]
+    if interval <= 0:
+        return None
+
+    def loop():
+        next_run = time.monotonic() + random.uniform(0, interval)
+        while should_continue():
+            if time.monotonic() < next_run:
+                time.sleep(1)
+                continue
+            try:
+                archived, trimmed = compact(db, config, max_batches=20)
+                if archived or trimmed:
+                    print(f"{label}: 🗄️ Archived {archived} completed job(s), trimmed {trimmed} from history.")
+            except Exception as e:
+                print(f"{label}: ❌ Compaction failed: {e}")
+            next_run = time.monotonic() + interval
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
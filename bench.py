@@ -0,0 +1,178 @@
+# bench.py
+import datetime
+import json
+import os
+import platform
+import signal
+import subprocess
+import tempfile
+import time
+import uuid
+from multiprocessing import Process
+from db import reset_client
+from storage import get_store
+from jobs import build_job, KIND_ARGV
+from worker import start_worker
+
+POLL_INTERVAL = 0.1 # Seconds between progress checks while a scenario runs
+ENQUEUE_CHUNK = 1000
+PERCENTILES = (50, 95, 99)
+MONGO_OPCOUNTERS = ("insert", "query", "update", "delete", "getmore", "command")
+
+def _run_worker(*args):
+    # Never share the bench's MongoClient across fork
+    reset_client()
+    start_worker(*args)
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list (None if empty)."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+def summarize(values):
+    """min/mean/max and the PERCENTILES of `values`, in milliseconds."""
+    values = sorted(values)
+    if not values:
+        return None
+    summary = {f"p{p}": round(percentile(values, p) * 1000, 3) for p in PERCENTILES}
+    summary["min"] = round(values[0] * 1000, 3)
+    summary["mean"] = round(sum(values) / len(values) * 1000, 3)
+    summary["max"] = round(values[-1] * 1000, 3)
+    return summary
+
+def mongo_ops(store):
+    """Server-wide operation count, or None where the store can't tell."""
+    if store.name != "mongo":
+        return None
+    counters = store.db.client.admin.command("serverStatus")["opcounters"]
+    return sum(counters.get(name, 0) for name in MONGO_OPCOUNTERS)
+
+def git_commit():
+    """The commit being measured, so reports can be compared across commits."""
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def bench_command(job, sleep_seconds):
+    """No-op or sleep jobs, run without a shell so only the queue is measured."""
+    if job == "sleep":
+        return ["sleep", str(sleep_seconds)]
+    return ["true"]
+
+def run_scenario(config, jobs, workers, concurrency, prefetch, command, warmup, timeout):
+    """
+    Start `workers` workers on a fresh queue, enqueue `jobs` jobs, wait
+    until all of them have finished and return the measurements.
+
+    The queue is private to the scenario, so workers that are already
+    running never touch bench jobs and vice versa.
+    """
+    store = get_store(config)
+    if store is None:
+        raise Exception("Database connection failed. get_store() returned None.")
+    store.setup()
+
+    queue = f"bench_{uuid.uuid4().hex[:8]}"
+    args = (config["backoff_base"], prefetch, concurrency, (config["idle_backoff_min"], config["idle_backoff_max"]), config, [queue], None)
+    processes = [Process(target=_run_worker, args=args) for _ in range(workers)]
+    for p in processes:
+        p.start()
+    # Let the workers connect before the clock starts
+    time.sleep(warmup)
+
+    ops_before = mongo_ops(store)
+    started = time.perf_counter()
+    for start in range(0, jobs, ENQUEUE_CHUNK):
+        now = datetime.datetime.utcnow()
+        chunk = [build_job(f"{queue}_{i}", command, config, now=now, queue=queue, kind=KIND_ARGV)
+                 for i in range(start, min(start + ENQUEUE_CHUNK, jobs))]
+        inserted, errors = store.enqueue(chunk)
+        if errors:
+            raise Exception(f"Enqueue failed: {errors[0][2]}")
+    enqueue_seconds = time.perf_counter() - started
+
+    finished = 0
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        counts = store.counts()["queues"].get(queue, {})
+        finished = counts.get("completed", 0) + counts.get("dead", 0)
+        if finished >= jobs:
+            break
+        time.sleep(POLL_INTERVAL)
+    total_seconds = time.perf_counter() - started
+    ops_after = mongo_ops(store)
+
+    for p in processes:
+        try: os.kill(p.pid, signal.SIGTERM)
+        except ProcessLookupError: pass
+    for p in processes:
+        p.join()
+
+    fields = ["id", "created_at", "started_at", "updated_at"]
+    done = [job for job in store.list_jobs("completed", queue, limit=0, fields=fields) if job.get("started_at")]
+    to_start = [(job["started_at"] - job["created_at"]).total_seconds() for job in done]
+    end_to_end = [(job["updated_at"] - job["created_at"]).total_seconds() for job in done]
+    claim_window = (max(job["started_at"] for job in done) - min(job["created_at"] for job in done)).total_seconds() if done else 0
+
+    return {
+        "workers": workers,
+        "concurrency": concurrency,
+        "prefetch": prefetch,
+        "jobs": jobs,
+        "completed": len(done),
+        "timed_out": finished < jobs,
+        "enqueue_seconds": round(enqueue_seconds, 4),
+        "enqueue_rate": round(jobs / enqueue_seconds, 1) if enqueue_seconds > 0 else None,
+        "total_seconds": round(total_seconds, 4),
+        "claims_per_second": round(len(done) / claim_window, 1) if claim_window > 0 else None,
+        "jobs_per_second": round(len(done) / total_seconds, 1) if total_seconds > 0 else None,
+        "enqueue_to_start_ms": summarize(to_start),
+        "end_to_end_ms": summarize(end_to_end),
+        "db_ops_per_job": round((ops_after - ops_before) / jobs, 2) if ops_before is not None else None
+    }
+
+def run_bench(config, jobs, worker_counts, concurrencies, prefetch, job="noop", sleep_seconds=0.01, warmup=1.0, timeout=300, sqlite_path=None, on_result=None):
+    """
+    Run every (worker count, concurrency) combination and return a JSON-
+    ready report. A sqlite bench without an explicit `sqlite_path` runs
+    on a temporary database so the real queue file stays untouched.
+    """
+    temp_dir = None
+    if config["backend"] == "sqlite":
+        if sqlite_path is None:
+            temp_dir = tempfile.mkdtemp(prefix="queuectl_bench_")
+            sqlite_path = os.path.join(temp_dir, "bench.db")
+        config = dict(config, sqlite_path=sqlite_path)
+
+    command = bench_command(job, sleep_seconds)
+    report = {
+        "started_at": datetime.datetime.utcnow().isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": config["backend"],
+        "job": job,
+        "command": command,
+        "scenarios": []
+    }
+    try:
+        for workers in worker_counts:
+            for concurrency in concurrencies:
+                result = run_scenario(config, jobs, workers, concurrency, prefetch, command, warmup, timeout)
+                report["scenarios"].append(result)
+                if on_result:
+                    on_result(result)
+    finally:
+        if temp_dir:
+            for name in os.listdir(temp_dir):
+                os.remove(os.path.join(temp_dir, name))
+            os.rmdir(temp_dir)
+    return report
+
+def write_report(report, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,192 @@
+# callables.py
+import importlib
+import json
+import multiprocessing
+import os
+import resource
+import signal
+import sys
+import threading
+import time
+import traceback
+from limits import tree_rss_kb, FAILURE_COMMAND, FAILURE_TIMEOUT, FAILURE_CPU, FAILURE_MEMORY
+from metrics import SPAWN_SECONDS
+
+MAX_RESULT_CHARS = 16384 # Larger return values are not stored on the job
+
+# Warm runner processes of this worker, reused until they have run
+# MAX_TASKS_PER_PROCESS jobs. Each entry is [process, connection, jobs_run].
+_idle = []
+_lock = threading.Lock()
+_context = None
+MAX_TASKS_PER_PROCESS = 100
+
+def configure_pool(max_tasks):
+    global MAX_TASKS_PER_PROCESS
+    MAX_TASKS_PER_PROCESS = max_tasks
+
+def resolve(spec):
+    """Import 'package.module:function' (or 'module:Class.method') and return the callable."""
+    module_name, _, attribute = spec.partition(":")
+    target = importlib.import_module(module_name)
+    for part in attribute.split("."):
+        target = getattr(target, part)
+    return target
+
+def _jsonable(value):
+    try:
+        text = json.dumps(value)
+    except (TypeError, ValueError):
+        text = json.dumps(repr(value))
+    return json.loads(text) if len(text) <= MAX_RESULT_CHARS else None
+
+def _call(spec, args, kwargs, out_path, err_path, cpu_seconds):
+    """Run one job inside a runner process, with fds 1 and 2 on its spool files."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = os.dup(1), os.dup(2)
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_before = before.ru_utime + before.ru_stime
+    limit = resource.getrlimit(resource.RLIMIT_CPU)
+    if cpu_seconds:
+        # Soft limit only, on top of what this warm process has used so far,
+        # so it can be lifted again for the next job
+        soft = int(cpu_before + cpu_seconds) + 1
+        if limit[1] != resource.RLIM_INFINITY:
+            soft = min(soft, limit[1])
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, limit[1]))
+    try:
+        with open(out_path, 'ab') as out, open(err_path, 'ab') as err:
+            os.dup2(out.fileno(), 1)
+            os.dup2(err.fileno(), 2)
+            try:
+                result = resolve(spec)(*args, **kwargs)
+                ok = True
+            except BaseException:
+                traceback.print_exc()
+                result, ok = None, False
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+    finally:
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        os.close(saved[0])
+        os.close(saved[1])
+        if cpu_seconds:
+            resource.setrlimit(resource.RLIMIT_CPU, limit)
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    usage = {"cpu_seconds": round(after.ru_utime + after.ru_stime - cpu_before, 3), "max_rss_mb": round(after.ru_maxrss / 1024, 1)}
+    return ok, _jsonable(result) if ok else None, usage
+
+def _serve(conn):
+    """Runner process main loop: take (spec, args, ...) tasks until told to stop."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Jobs import their modules relative to where the worker was started
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        conn.send(_call(*task))
+
+def _get_context():
+    # forkserver gives clean, fast-to-fork runners without copying the
+    # worker's threads and MongoClient; spawn where it isn't available
+    global _context
+    if _context is None:
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _context = multiprocessing.get_context(method)
+        if method == "forkserver":
+            _context.set_forkserver_preload(["callables"])
+    return _context
+
+def _acquire():
+    with _lock:
+        if _idle:
+            return _idle.pop()
+    context = _get_context()
+    parent_conn, child_conn = context.Pipe()
+    process = context.Process(target=_serve, args=(child_conn,), daemon=True)
+    process.start()
+    child_conn.close()
+    return [process, parent_conn, 0]
+
+def _release(runner):
+    runner[2] += 1
+    if runner[2] >= MAX_TASKS_PER_PROCESS:
+        _retire(runner)
+    else:
+        with _lock:
+            _idle.append(runner)
+
+def _retire(runner):
+    process, conn, _ = runner
+    try:
+        conn.send(None)
+    except (OSError, ValueError):
+        pass
+    conn.close()
+    process.join(timeout=1)
+    if process.is_alive():
+        process.kill()
+
+def _kill(runner):
+    runner[0].kill()
+    runner[0].join()
+    runner[1].close()
+
+def _death_class(process):
+    process.join(timeout=1)
+    return FAILURE_CPU if process.exitcode == -signal.SIGXCPU else FAILURE_COMMAND
+
+def run_callable(job, limits, out_path, err_path):
+    """
+    Run a 'callable' job in a warm runner process: no shell, no fresh
+    interpreter. Limits are enforced per job: a runner that times out or
+    goes over max_rss is killed and replaced, and RLIMIT_CPU is re-armed
+    before every job. Returns (returncode, usage, failure_class, result).
+    """
+    with SPAWN_SECONDS.time(kind="callable"):
+        runner = _acquire()
+    process, conn, _ = runner
+    conn.send((job["command"], job.get("args", []), job.get("kwargs", {}), out_path, err_path, limits.get("cpu_seconds")))
+
+    timeout, max_rss = limits.get("timeout"), limits.get("max_rss")
+    deadline = time.monotonic() + timeout if timeout else None
+    poll = 0.002
+    while not conn.poll(poll):
+        failure_class = None
+        if not process.is_alive():
+            failure_class = _death_class(process)
+        elif deadline is not None and time.monotonic() >= deadline:
+            failure_class = FAILURE_TIMEOUT
+        elif max_rss and tree_rss_kb(process.pid) > max_rss * 1024:
+            failure_class = FAILURE_MEMORY
+        if failure_class is not None:
+            _kill(runner)
+            return None, {"cpu_seconds": None, "max_rss_mb": None}, failure_class, None
+        poll = min(poll * 2, 0.25)
+
+    try:
+        ok, result, usage = conn.recv()
+    except EOFError:
+        # The runner died mid-job (poll() reports the closed pipe as readable)
+        failure_class = _death_class(process)
+        _kill(runner)
+        return None, {"cpu_seconds": None, "max_rss_mb": None}, failure_class, None
+    _release(runner)
+    return (0 if ok else 1), usage, (None if ok else FAILURE_COMMAND), result
+
+def shutdown_pool():
+    """Stop this worker's idle runner processes."""
+    with _lock:
+        runners = _idle[:]
+        del _idle[:]
+    for runner in runners:
+        _retire(runner)
@@ -1,14 +1,55 @@
 # config.py
 import json
 import os
+from retry import validate_policy
 
 CONFIG_FILE = ".queuectl_config.json"
 
 DEFAULT_CONFIG = {
+    "backend": "mongo",
+    "sqlite_path": "queuectl.db",
     "max_retries": 5,
-    "backoff_base": 3
+    "backoff_base": 3,
+    "prefetch": 1,
+    "idle_backoff_min": 0.05,
+    "idle_backoff_max": 5.0,
+    "archive_after_seconds": 300,
+    "compact_interval": 60,
+    "compact_batch_size": 500,
+    "history_ttl_seconds": 604800,
+    "history_max_docs": 0,
+    "lease_seconds": 60,
+    "timeout": 300,
+    "max_rss": 0,
+    "cpu_seconds": 0,
+    "callable_max_tasks": 100,
+    "output_head_bytes": 4096,
+    "output_tail_bytes": 4096,
+    "output_retention_seconds": 604800,
+    "metrics_interval": 5.0,
+    "write_behind_ms": 5,
+    "scheduler_lease_seconds": 30,
+    "scheduler_refresh": 10.0,
+    "retry_policy": {},
+    "dedup_window": 300,
+    "result_cache_max": 10000,
+    "supervisor_min_workers": 1,
+    "supervisor_max_workers": 8,
+    "supervisor_backlog_per_worker": 50,
+    "supervisor_max_wait": 30.0,
+    "supervisor_scale_down_after": 60.0,
+    "supervisor_interval": 5.0,
+    "supervisor_restart_base": 1.0,
+    "supervisor_restart_max": 60.0,
+    "queues": {}
 }
 
+# Storage engines for the 'backend' key (see storage.py)
+BACKENDS = ["mongo", "sqlite"]
+
+# Keys that may be overridden per queue with 'config set-queue'
+QUEUE_CONFIG_KEYS = ["max_retries", "backoff_base", "timeout", "max_rss", "cpu_seconds", "retry_policy"]
+
 def get_config():
     """Load config from file, or return defaults if not found."""
     if not os.path.exists(CONFIG_FILE):
@@ -33,15 +74,52 @@ def set_config_value(key, value):
     if key not in DEFAULT_CONFIG:
         raise KeyError(f"Invalid config key: {key}. Valid keys are: {list(DEFAULT_CONFIG.keys())}")
 
+    value = _convert(key, value)
+
+    if key == "backend" and value not in BACKENDS:
+        raise ValueError(f"Invalid backend: {value}. Valid backends are: {BACKENDS}")
+
+    config[key] = value
+    
+    with open(CONFIG_FILE, 'w') as f:
+        json.dump(config, f, indent=2)
+    
+    print(f"✅ Config updated: {key} = {value}")
+
+def _convert(key, value):
+    """Turn a value given as text into the type of the key's default; objects are JSON."""
+    original_type = type(DEFAULT_CONFIG[key])
     try:
-        original_type = type(DEFAULT_CONFIG[key])
-        value = original_type(value)
+        if original_type is dict:
+            value = json.loads(value)
+        else:
+            value = original_type(value)
     except ValueError:
-        raise ValueError(f"Invalid value type for {key}. Expected {original_type.__name__}.")
+        raise ValueError(f"Invalid value type for {key}. Expected {'a JSON object' if original_type is dict else original_type.__name__}.")
+    if key == "retry_policy":
+        validate_policy(value)
+    return value
 
-    config[key] = value
+def get_queue_config(config, queue):
+    """The global config with any overrides for `queue` applied."""
+    merged = dict(config)
+    merged.update(config.get("queues", {}).get(queue, {}))
+    return merged
+
+def set_queue_config_value(queue, key, value):
+    """Override a config value for a single queue."""
+    config = get_config()
+    
+    if key not in QUEUE_CONFIG_KEYS:
+        raise KeyError(f"Invalid per-queue config key: {key}. Valid keys are: {QUEUE_CONFIG_KEYS}")
+
+    value = _convert(key, value)
+
+    queues = dict(config.get("queues", {}))
+    queues[queue] = dict(queues.get(queue, {}), **{key: value})
+    config["queues"] = queues
     
     with open(CONFIG_FILE, 'w') as f:
         json.dump(config, f, indent=2)
     
-    print(f"✅ Config updated: {key} = {value}")
\ No newline at end of file
+    print(f"✅ Config updated for queue '{queue}': {key} = {value}")
\ No newline at end of file
@@ -0,0 +1,83 @@
+# counters.py
+import datetime
+from collections import Counter
+from db import STATS_COLLECTION
+from jobs import queue_of, DEFAULT_QUEUE
+
+COUNTS_ID = "counts"
+STATES = ("waiting", "pending", "processing", "completed", "dead")
+
+def bump_counts(db, queue, **deltas):
+    """
+    Apply state-count deltas for one queue, e.g.
+    bump_counts(db, "default", pending=-1, processing=1).
+    Called right after every write that moves a job between states, so
+    'status' can read all counts, overall and per queue, with a single
+    find_one.
+    """
+    bump_queue_counts(db, {queue: deltas})
+
+def bump_queue_counts(db, deltas_by_queue):
+    """bump_counts for several queues in one write: {queue: {state: delta}}."""
+    increments = Counter()
+    for queue, deltas in deltas_by_queue.items():
+        for state, delta in deltas.items():
+            if delta:
+                increments[state] += delta
+                increments[f"queues.{queue}.{state}"] = delta
+    increments = {field: delta for field, delta in increments.items() if delta}
+    if not increments:
+        return
+    db[STATS_COLLECTION].update_one(
+        {"_id": COUNTS_ID},
+        {"$inc": increments, "$set": {"updated_at": datetime.datetime.utcnow()}},
+        upsert=True
+    )
+
+def bump_counts_for_jobs(db, jobs, **deltas):
+    """bump_counts for a batch of jobs that made the same transition."""
+    for queue, n in Counter(queue_of(job) for job in jobs).items():
+        bump_counts(db, queue, **{state: delta * n for state, delta in deltas.items()})
+
+def _clean(doc):
+    return {state: max(doc.get(state, 0), 0) for state in STATES}
+
+def read_counts(db):
+    """
+    Return the live counters as {state: n, ..., "queues": {queue: {state: n}}},
+    or None if they have never been seeded.
+    """
+    doc = db[STATS_COLLECTION].find_one({"_id": COUNTS_ID})
+    if doc is None:
+        return None
+    counts = _clean(doc)
+    counts["queues"] = {queue: _clean(queue_counts) for queue, queue_counts in doc.get("queues", {}).items()}
+    return counts
+
+def recount(db):
+    """
+    Compute exact counts with one $group over 'jobs' plus one over the DLQ,
+    and reset the live counters to the result.
+    """
+    queues = {}
+    def add(queue, state, n):
+        queue = queue or DEFAULT_QUEUE
+        queues.setdefault(queue, {s: 0 for s in STATES})
+        if state in STATES:
+            queues[queue][state] += n
+
+    pipeline = [{"$group": {"_id": {"queue": "$queue", "state": "$state"}, "n": {"$sum": 1}}}]
+    for row in db["jobs"].aggregate(pipeline):
+        add(row["_id"].get("queue"), row["_id"].get("state"), row["n"])
+    for row in db["dlq"].aggregate([{"$group": {"_id": "$queue", "n": {"$sum": 1}}}]):
+        add(row["_id"], "dead", row["n"])
+
+    counts = {state: sum(q[state] for q in queues.values()) for state in STATES}
+    now = datetime.datetime.utcnow()
+    db[STATS_COLLECTION].update_one(
+        {"_id": COUNTS_ID},
+        {"$set": dict(counts, queues=queues, updated_at=now, recounted_at=now)},
+        upsert=True
+    )
+    counts["queues"] = queues
+    return counts
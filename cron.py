@@ -0,0 +1,109 @@
+# cron.py
+import datetime
+
+# (name, lowest, highest) for the five fields of a cron expression
+FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day of month", 1, 31), ("month", 1, 12), ("day of week", 0, 6))
+MONTH_NAMES = {name: number for number, name in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start=1)}
+DAY_NAMES = {name: number for number, name in enumerate(["sun", "mon", "tue", "wed", "thu", "fri", "sat"])}
+MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *"
+}
+MAX_SEARCH_DAYS = 366 * 5 # Long enough for any Feb 29; anything rarer never fires
+
+class CronExpression:
+    """
+    A standard five-field cron expression (minute hour day-of-month month
+    day-of-week), evaluated in UTC. Fields take '*', numbers, names
+    (jan-dec, sun-sat), ranges 'a-b', steps '*/n' or 'a-b/n' and comma
+    lists; day of week 7 is Sunday too. As in cron, when both day fields
+    are restricted a day matching either one fires.
+    """
+
+    def __init__(self, text):
+        self.text = text.strip()
+        fields = MACROS.get(self.text.lower(), self.text).split()
+        if len(fields) != 5:
+            raise ValueError(f"Invalid cron expression '{text}': expected 5 fields, got {len(fields)}.")
+        names = (None, None, None, MONTH_NAMES, DAY_NAMES)
+        self.minutes, self.hours, self.days, self.months, self.weekdays = [
+            _parse_field(field, spec, names[i]) for i, (field, spec) in enumerate(zip(fields, FIELDS))
+        ]
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    def _day_matches(self, day):
+        weekday = day.isoweekday() % 7 # cron counts from Sunday = 0
+        if self.any_day or self.any_weekday:
+            return day.day in self.days and weekday in self.weekdays
+        return day.day in self.days or weekday in self.weekdays
+
+    def next_after(self, moment):
+        """The first firing time strictly after `moment` (a naive UTC datetime)."""
+        t = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = t + datetime.timedelta(days=MAX_SEARCH_DAYS)
+        while t < limit:
+            if t.month not in self.months:
+                # First minute of the next month
+                t = (t.replace(day=1, hour=0, minute=0) + datetime.timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + datetime.timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += datetime.timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Cron expression '{self.text}' never fires.")
+
+    def __str__(self):
+        return self.text
+
+def _parse_value(value, spec, names):
+    name, lowest, highest = spec
+    value = value.lower()
+    if names and value in names:
+        return names[value]
+    if not value.isdigit():
+        raise ValueError(f"Invalid {name} value '{value}'.")
+    number = int(value)
+    if name == "day of week" and number == 7:
+        return 0
+    if not lowest <= number <= highest:
+        raise ValueError(f"{name.capitalize()} value {number} is out of range {lowest}-{highest}.")
+    return number
+
+def _parse_field(field, spec, names):
+    """The set of values one field allows."""
+    name, lowest, highest = spec
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            if not step_text.isdigit() or int(step_text) == 0:
+                raise ValueError(f"Invalid step '{step_text}' in the {name} field.")
+            step = int(step_text)
+        if part == "*":
+            start, end = lowest, highest
+        elif "-" in part:
+            start_text, end_text = part.split("-", 1)
+            start, end = _parse_value(start_text, spec, names), _parse_value(end_text, spec, names)
+            if end_text == "7" and name == "day of week":
+                # '5-7' is Friday to Sunday
+                end = 6
+                values.add(0)
+            if start > end:
+                raise ValueError(f"Invalid range '{part}' in the {name} field.")
+        else:
+            start = _parse_value(part, spec, names)
+            # 'a/n' means every n-th value from a to the end of the range
+            end = highest if step > 1 else start
+        values.update(range(start, end + 1, step))
+    return values
@@ -0,0 +1,193 @@
+# daemon.py
+import contextlib
+import io
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+# Only the standard library at module level: the CLI imports this before
+# anything else to hand its command to a running daemon.
+
+SOCKET_PATH = ".queuectl.sock" # In the working directory, like the PID files
+LOG_PATH = os.path.join("logs", "daemon.log")
+START_TIMEOUT = 10.0 # Seconds 'daemon start' waits for the socket to answer
+DISABLE_ENV = "QUEUECTL_NO_DAEMON" # Set to run every command in-process
+REQUEST_TIMEOUT = 5.0 # Seconds a client gets to send its request before the daemon moves on
+
+# Commands a daemon may run for a client: short, no stdin, no child
+# processes, no endless loops. Everything else always runs locally.
+# 'dlq retry' can move the whole DLQ (and sleeps under --rate), and the
+# daemon answers one request at a time, so it stays local too.
+FORWARDED_COMMANDS = {"enqueue", "status", "list", "dlq", "logs", "reap", "config",
+                      "workflow", "schedule", "explain-claim", "history", "metrics"}
+LOCAL_SUBCOMMANDS = {("schedule", "run"), ("metrics", "serve"), ("dlq", "retry")}
+LOCAL_FLAGS = {"--watch", "--loop", "--follow", "-f", "--help", "-h"}
+
+def is_forwardable(argv):
+    if not argv or argv[0] not in FORWARDED_COMMANDS:
+        return False
+    if tuple(argv[:2]) in LOCAL_SUBCOMMANDS:
+        return False
+    return not any(arg in LOCAL_FLAGS or arg.split("=", 1)[0] in LOCAL_FLAGS for arg in argv)
+
+
+# --- Client ---
+
+def _request(message, path=SOCKET_PATH, timeout=None):
+    """Send one JSON request and return the JSON reply. Raises OSError if no daemon answers."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(message).encode("utf-8"))
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b"".join(chunks).decode("utf-8"))
+
+def forward(argv, path=SOCKET_PATH):
+    """
+    Run a CLI command in the daemon and replay its output here. Returns
+    the exit code, or None when the command must (or can only) run
+    in-process: not forwardable, no daemon, or a stale socket.
+    """
+    if os.environ.get(DISABLE_ENV) or not os.path.exists(path) or not is_forwardable(argv):
+        return None
+    try:
+        reply = _request({"argv": argv}, path)
+    except (OSError, ValueError):
+        return None
+    sys.stdout.write(reply.get("stdout", ""))
+    sys.stderr.write(reply.get("stderr", ""))
+    return reply.get("exit_code", 0)
+
+def daemon_status(path=SOCKET_PATH):
+    """The running daemon's status dict, or None."""
+    if not os.path.exists(path):
+        return None
+    try:
+        return _request({"status": True}, path, timeout=5)
+    except (OSError, ValueError):
+        return None
+
+def start_daemon(script, path=SOCKET_PATH):
+    """Start 'daemon run' detached from this terminal. Returns (success, message)."""
+    if daemon_status(path):
+        return False, "❌ A daemon is already running. Use 'daemon stop' first."
+    os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
+    with open(LOG_PATH, "a") as log:
+        process = subprocess.Popen([sys.executable, script, "daemon", "run"], stdin=subprocess.DEVNULL,
+                                   stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if daemon_status(path):
+            return True, f"✅ Daemon started with PID: {process.pid}. Listening on {path}."
+        if process.poll() is not None:
+            return False, f"❌ The daemon exited right away (code {process.returncode}). See {LOG_PATH}."
+        time.sleep(0.05)
+    return False, f"❌ The daemon did not answer within {START_TIMEOUT:.0f}s. See {LOG_PATH}."
+
+def stop_daemon(path=SOCKET_PATH):
+    if not os.path.exists(path):
+        return True, "🤔 No daemon seems to be running (socket not found)."
+    try:
+        _request({"stop": True}, path, timeout=30)
+    except (OSError, ValueError):
+        os.remove(path)
+        return True, f"🤔 The daemon was not answering. Removed stale {path}."
+    return True, "✅ Daemon stopped."
+
+
+# --- Server ---
+
+class _Shutdown(BaseException):
+    """Raised by SIGTERM; a BaseException so commands' own handlers let it through."""
+
+def run_command(cli, argv):
+    """Run one CLI command in this process, capturing what it prints."""
+    import click
+    stdout, stderr = io.StringIO(), io.StringIO()
+    exit_code = 0
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            cli.main(argv, prog_name="queuectl", standalone_mode=False)
+        except click.ClickException as e:
+            e.show()
+            exit_code = e.exit_code
+        except click.exceptions.Abort:
+            exit_code = 1
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 0
+        except Exception as e:
+            print(f"❌ Unhandled daemon error: {e}", file=sys.stderr)
+            exit_code = 1
+    return {"stdout": stdout.getvalue(), "stderr": stderr.getvalue(), "exit_code": exit_code}
+
+def _read_request(conn):
+    chunks = []
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return json.loads(b"".join(chunks).decode("utf-8"))
+
+def serve(cli, path=SOCKET_PATH):
+    """
+    Answer CLI requests on a Unix socket until stopped (a 'stop' request,
+    SIGTERM or Ctrl+C). Requests run one at a time in this process, so
+    imports, the database connection and index checks are paid once.
+    """
+    if daemon_status(path):
+        raise Exception(f"Another daemon is already listening on {path}.")
+    if os.path.exists(path):
+        os.remove(path) # Left behind by a daemon that died
+
+    def handle_shutdown(sig, frame):
+        raise _Shutdown()
+    signal.signal(signal.SIGTERM, handle_shutdown)
+
+    started = time.time()
+    served = 0
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(path)
+        os.chmod(path, 0o600) # Commands run with this user's rights: keep others out
+        sock.listen(16)
+        print(f"Daemon {os.getpid()}: 🚀 Listening on {path}", flush=True)
+        running = True
+        while running:
+            conn, _ = sock.accept()
+            with conn:
+                # A client that connects and never sends must not hold up everyone else
+                conn.settimeout(REQUEST_TIMEOUT)
+                try:
+                    request = _read_request(conn)
+                except (OSError, ValueError):
+                    continue
+                if request.get("stop"):
+                    running = False
+                    reply = {"stopped": True}
+                elif request.get("status"):
+                    reply = {"pid": os.getpid(), "uptime": round(time.time() - started, 1), "served": served}
+                else:
+                    reply = run_command(cli, request.get("argv", []))
+                    served += 1
+                try:
+                    conn.sendall(json.dumps(reply).encode("utf-8"))
+                except OSError:
+                    pass # The client went away; nothing to tell it
+    except (_Shutdown, KeyboardInterrupt):
+        pass
+    finally:
+        sock.close()
+        if os.path.exists(path):
+            os.remove(path)
+        print(f"Daemon {os.getpid()}: 🛑 Stopped after {served} command(s).", flush=True)
@@ -1,15 +1,42 @@
 # db.py
 import os
 from pymongo import MongoClient
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
+from config import get_config
+from jobs import DEFAULT_QUEUE
 
 load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
 DB_NAME = "queuectl"
+HISTORY_COLLECTION = "jobs_history"
+STATS_COLLECTION = "stats"
+SCHEDULES_COLLECTION = "schedules"
+KEY_LIMITS_COLLECTION = "key_limits"
+RESULTS_COLLECTION = "results"
+DEDUP_INDEX_NAME = "dedup_active"
+MAX_TTL_SECONDS = 2147483647 # Largest TTL MongoDB accepts, i.e. "keep forever"
+
+# Workers claim the highest priority first, then oldest first (FIFO).
+CLAIM_SORT = [("priority", -1), ("created_at", 1)]
+
+# Equality (queue, state), then the sort keys, then the range (run_at):
+# every queue gets its own index path that the claim query walks in order,
+# never needing an in-memory sort.
+CLAIM_INDEX = [("queue", 1), ("state", 1), ("priority", -1), ("created_at", 1), ("run_at", 1)]
+CLAIM_INDEX_NAME = "queue_claim_order"
+LEGACY_CLAIM_INDEX_NAME = "claim_order" # Pre-queues claim index, now redundant
+
+# ensure_indexes() records what it built in the stats collection, so other
+# processes can skip the ~20 create_index round trips. Bump INDEX_VERSION
+# whenever the index set (or a one-off backfill) below changes.
+INDEX_VERSION = 2
+INDEX_MARKER_ID = "indexes"
 
 # This holds the connection *per-process*
 _client = None
+_indexes_ensured = False # Per process (and per connection)
 
 def get_db():
     """
@@ -36,21 +63,81 @@ def get_db():
     
     return db, jobs_collection, dlq_collection
 
-def ensure_indexes():
+def reset_client():
+    """
+    Forget a connection inherited from a parent process. MongoClient is
+    not fork-safe, so a forked child must open its own.
+    """
+    global _client, _indexes_ensured
+    _client = None
+    _indexes_ensured = False
+
+def ensure_indexes(force=False):
     """
     Ensures the necessary indexes exist.
-    This is safe to call multiple times.
+    This is safe to call multiple times: after the first call in a process
+    it returns at once, and when another process already built this
+    INDEX_VERSION (with the same history TTL) it costs one read.
+    `force` rebuilds regardless.
     RAISES AN EXCEPTION ON FAILURE.
     """
     # We REMOVED the try/except block.
     # Now, if create_index fails, it will raise an exception.
+    global _indexes_ensured
+    if _indexes_ensured and not force:
+        return True
     
     db, jobs_collection, _ = get_db()
     if db is not None:
+        ttl_seconds = get_config()["history_ttl_seconds"]
+        marker = {"version": INDEX_VERSION, "history_ttl_seconds": ttl_seconds}
+        if not force and db[STATS_COLLECTION].find_one(dict(marker, _id=INDEX_MARKER_ID), {"_id": 1}) is not None:
+            _indexes_ensured = True
+            return True
+        # Jobs from before named queues get the default queue once, so every
+        # queue (the default one too) is a single equality range on CLAIM_INDEX
+        for collection in (jobs_collection, db["dlq"], db[HISTORY_COLLECTION]):
+            collection.update_many({"queue": None}, {"$set": {"queue": DEFAULT_QUEUE}})
         jobs_collection.create_index("id", unique=True)
         jobs_collection.create_index("state")
         jobs_collection.create_index([("state", 1), ("run_at", 1)])
+        jobs_collection.create_index(CLAIM_INDEX, name=CLAIM_INDEX_NAME)
+        if LEGACY_CLAIM_INDEX_NAME in jobs_collection.index_information():
+            jobs_collection.drop_index(LEGACY_CLAIM_INDEX_NAME)
+        jobs_collection.create_index([("state", 1), ("lease_expires_at", 1)])
+        # Finds a finished job's waiting dependents without a scan
+        jobs_collection.create_index("deps_pending", sparse=True)
+        # At most one active job per dedup key; the result cache evicts itself
+        jobs_collection.create_index("dedup_active", name=DEDUP_INDEX_NAME, unique=True, sparse=True)
+        db[RESULTS_COLLECTION].create_index("expires_at", expireAfterSeconds=0)
+        db[RESULTS_COLLECTION].create_index("completed_at")
+        # Keyset pagination for 'list' and 'dlq list'
+        jobs_collection.create_index([("created_at", 1), ("_id", 1)])
+        jobs_collection.create_index([("state", 1), ("created_at", 1), ("_id", 1)])
+        db["dlq"].create_index([("updated_at", 1), ("_id", 1)])
+        db[SCHEDULES_COLLECTION].create_index("name", unique=True)
+        ensure_history_indexes(db, ttl_seconds)
+        db[STATS_COLLECTION].update_one({"_id": INDEX_MARKER_ID}, {"$set": marker}, upsert=True)
+        _indexes_ensured = True
         return True
     else:
         # This will be caught by the worker if get_db() fails
-        raise Exception("get_db() returned None while ensuring indexes.")
\ No newline at end of file
+        raise Exception("get_db() returned None while ensuring indexes.")
+
+def ensure_history_indexes(db, ttl_seconds):
+    """
+    Indexes for the archived-jobs collection. Retention is a TTL index on
+    'archived_at'; ttl_seconds <= 0 keeps history forever.
+    """
+    history_collection = db[HISTORY_COLLECTION]
+    history_collection.create_index("id")
+    history_collection.create_index([("archived_at", 1), ("_id", 1)])
+    
+    if ttl_seconds <= 0:
+        ttl_seconds = MAX_TTL_SECONDS
+    
+    try:
+        history_collection.create_index("archived_at", expireAfterSeconds=ttl_seconds)
+    except OperationFailure:
+        # The TTL changed since the index was built: update it in place
+        db.command("collMod", HISTORY_COLLECTION, index={"keyPattern": {"archived_at": 1}, "expireAfterSeconds": ttl_seconds})
\ No newline at end of file
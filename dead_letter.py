@@ -0,0 +1,191 @@
+# dead_letter.py
+import datetime
+import re
+import time
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from counters import bump_counts_for_jobs
+
+# Cached per process: whether the server can run multi-document transactions
+_transactions_supported = None
+
+def transactions_supported(db):
+    """Transactions need a replica set or a sharded cluster."""
+    global _transactions_supported
+    if _transactions_supported is None:
+        try:
+            hello = db.client.admin.command("hello")
+            _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+        except PyMongoError:
+            _transactions_supported = False
+    return _transactions_supported
+
+def move_to_dlq(jobs_collection, dlq_collection, job, owner_filter=None):
+    """
+    Move `job` (already updated by the caller) from 'jobs' into the DLQ.
+    `owner_filter` holds extra conditions the live job must still meet,
+    e.g. that this worker still holds its lease. Returns True if moved.
+
+    On a replica set the delete and the insert commit as one transaction.
+    On a standalone server the job is copied first and deleted second, both
+    keyed on _id: a crash in between leaves a copy that the next attempt
+    recognises (duplicate _id) instead of a lost job.
+    """
+    source_filter = dict(owner_filter or {}, _id=job["_id"])
+    # A dead job no longer holds its dedup key: an identical job may run again
+    job.pop("dedup_active", None)
+    db = jobs_collection.database
+
+    if transactions_supported(db):
+        def move(session):
+            if jobs_collection.delete_one(source_filter, session=session).deleted_count == 0:
+                return False
+            dlq_collection.insert_one(job, session=session)
+            return True
+
+        with db.client.start_session() as session:
+            return session.with_transaction(move)
+
+    try:
+        dlq_collection.insert_one(job)
+    except DuplicateKeyError:
+        pass # Copied by an earlier, interrupted attempt
+    if jobs_collection.delete_one(source_filter).deleted_count == 1:
+        return True
+    # The live job no longer matches: it is not ours to bury
+    dlq_collection.delete_one({"_id": job["_id"]})
+    return False
+
+def build_replay_query(job_id=None, error_contains=None, id_pattern=None, since=None, until=None, failure_class=None):
+    """Turn the 'dlq retry' filters into a query on the DLQ collection."""
+    query = {}
+    if job_id:
+        query["id"] = job_id
+    elif id_pattern:
+        query["id"] = {"$regex": id_pattern}
+    if error_contains:
+        query["last_error"] = {"$regex": re.escape(error_contains)}
+    if failure_class:
+        query["failure_class"] = failure_class
+    if since or until:
+        query["updated_at"] = {}
+        if since:
+            query["updated_at"]["$gte"] = since
+        if until:
+            query["updated_at"]["$lte"] = until
+    return query
+
+def _reset_for_replay(job, now):
+    job["state"] = "pending"
+    job["attempts"] = 0
+    job["updated_at"] = now
+    job["run_at"] = now
+    job["worker_id"] = None
+    job.pop("last_error", None)
+    job.pop("failure_class", None)
+    job.pop("retry_delay", None)
+    # A replayed job runs right away: its dependencies were settled (or
+    # failed) before it reached the DLQ
+    job.pop("deps_pending", None)
+    job.pop("deps_remaining", None)
+    return job
+
+def _is_id_conflict(error):
+    """True if a duplicate-key error is on the job 'id' rather than on _id."""
+    key = error.get("keyValue")
+    if key is not None:
+        return "_id" not in key
+    return "_id_" not in error.get("errmsg", "")
+
+def _move_chunk_to_jobs(db, docs, on_conflict):
+    """Move one chunk of DLQ documents into 'jobs'. Returns the moved documents."""
+    jobs_collection = db["jobs"]
+    dlq_collection = db["dlq"]
+    ids = [doc["_id"] for doc in docs]
+
+    if transactions_supported(db):
+        def move(session):
+            jobs_collection.insert_many(docs, ordered=False, session=session)
+            dlq_collection.delete_many({"_id": {"$in": ids}}, session=session)
+
+        try:
+            with db.client.start_session() as session:
+                session.with_transaction(move)
+            return docs
+        except BulkWriteError:
+            # A job with the same 'id' appeared since we checked: move the
+            # chunk one document at a time so only the clashing ones stay.
+            if len(docs) == 1:
+                on_conflict(docs[0]["id"])
+                return []
+            return [moved for doc in docs for moved in _move_chunk_to_jobs(db, [doc], on_conflict)]
+
+    movable = set(ids)
+    try:
+        jobs_collection.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            doc = docs[error["index"]]
+            if error.get("code") == 11000 and not _is_id_conflict(error):
+                continue # Copied by an earlier, interrupted replay
+            movable.discard(doc["_id"])
+            if error.get("code") == 11000:
+                on_conflict(doc["id"])
+            else:
+                raise
+    dlq_collection.delete_many({"_id": {"$in": [i for i in ids if i in movable]}})
+    return [doc for doc in docs if doc["_id"] in movable]
+
+def replay_from_dlq(db, query, chunk_size=500, rate=0, on_progress=None, on_conflict=None):
+    """
+    Move every DLQ job matching `query` back to 'pending', chunk by chunk,
+    walking the DLQ in _id order. `rate` caps jobs per second (0 = no cap).
+    Jobs whose 'id' is already taken in 'jobs' stay in the DLQ and are
+    passed to on_conflict. Returns (moved, skipped).
+    """
+    on_progress = on_progress or (lambda moved, skipped: None)
+    on_conflict = on_conflict or (lambda job_id: None)
+    if rate:
+        chunk_size = max(1, min(chunk_size, int(rate)))
+
+    moved = skipped = 0
+    last_id = None
+    started = time.monotonic()
+
+    while True:
+        page_query = query if last_id is None else {"$and": [query, {"_id": {"$gt": last_id}}]}
+        docs = [doc for doc in db["dlq"].find(page_query).sort("_id", 1).limit(chunk_size)]
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+
+        taken = {
+            doc["id"] for doc in db["jobs"].find({"id": {"$in": [doc["id"] for doc in docs]}}, {"id": 1})
+        }
+        now = datetime.datetime.utcnow()
+        ready = []
+        for doc in docs:
+            if doc["id"] in taken:
+                skipped += 1
+                on_conflict(doc["id"])
+            else:
+                ready.append(_reset_for_replay(doc, now))
+
+        if ready:
+            def conflict(job_id):
+                nonlocal skipped
+                skipped += 1
+                on_conflict(job_id)
+
+            chunk_moved = _move_chunk_to_jobs(db, ready, conflict)
+            moved += len(chunk_moved)
+            bump_counts_for_jobs(db, chunk_moved, dead=-1, pending=1)
+
+        on_progress(moved, skipped)
+
+        if rate:
+            # Stay on pace: N jobs should take at least N / rate seconds
+            ahead = (moved + skipped) / rate - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    return moved, skipped
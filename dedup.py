@@ -0,0 +1,68 @@
+# dedup.py
+import datetime
+from db import RESULTS_COLLECTION, DEDUP_INDEX_NAME
+
+def is_dedup_conflict(message):
+    """True if an insert failed on the one-active-job-per-dedup-key index, not on the job id."""
+    return DEDUP_INDEX_NAME in (message or "")
+
+def can_answer_from_cache(job):
+    # A job that waits for others must not run (or be answered) before them
+    return bool(job.get("dedup_key")) and bool(job.get("dedup_window")) and job["state"] == "pending"
+
+def is_fresh(cached, job, now):
+    """True if the cached result is no older than the new job's own window accepts."""
+    return cached["completed_at"] >= now - datetime.timedelta(seconds=job["dedup_window"])
+
+def answer_from_cache(job, cached, now):
+    """Turn a new job into a completed one that carries the cached result."""
+    job.update({
+        "state": "completed",
+        "updated_at": now,
+        "output": cached.get("output"),
+        "cached_from": cached["job_id"]
+    })
+    job.pop("dedup_active", None)
+    return job
+
+def result_entry(job, now):
+    """Cache entry for a job that just succeeded, or None if it opted out."""
+    if not job.get("dedup_key") or not job.get("dedup_window"):
+        return None
+    return {
+        "_id": job["dedup_key"],
+        "job_id": job["id"],
+        "output": job.get("output"),
+        "completed_at": now,
+        "expires_at": now + datetime.timedelta(seconds=job["dedup_window"])
+    }
+
+
+# --- MongoDB ---
+
+def cached_results(db, keys, now=None):
+    """{dedup_key: entry} for the keys with an unexpired result."""
+    if not keys:
+        return {}
+    if now is None:
+        now = datetime.datetime.utcnow()
+    query = {"_id": {"$in": list(keys)}, "expires_at": {"$gt": now}}
+    return {entry["_id"]: entry for entry in db[RESULTS_COLLECTION].find(query)}
+
+def remember_result(db, job, max_entries, now=None):
+    """
+    Cache a successful job's output under its dedup key. Entries expire via
+    the TTL index on 'expires_at'; past `max_entries` the oldest are
+    dropped, so the cache stays bounded even within the window.
+    """
+    if now is None:
+        now = datetime.datetime.utcnow()
+    entry = result_entry(job, now)
+    if entry is None:
+        return
+    results = db[RESULTS_COLLECTION]
+    results.replace_one({"_id": entry["_id"]}, entry, upsert=True)
+    excess = results.estimated_document_count() - max_entries if max_entries else 0
+    if excess > 0:
+        oldest = [doc["_id"] for doc in results.find({}, {"_id": 1}).sort("completed_at", 1).limit(excess)]
+        results.delete_many({"_id": {"$in": oldest}})
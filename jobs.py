@@ -0,0 +1,165 @@
+# jobs.py
+import datetime
+import hashlib
+import json
+import random
+import re
+import shlex
+from config import get_queue_config
+from retry import validate_policy
+
+DEFAULT_QUEUE = "default"
+QUEUE_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+# Per-job resource limits: wall-clock seconds, peak resident MB, CPU seconds
+LIMIT_KEYS = ("timeout", "max_rss", "cpu_seconds")
+
+# How a job runs: a /bin/sh command line, an argv list exec'd without a
+# shell, or an importable Python callable run in a warm runner process
+KIND_SHELL = "shell"
+KIND_ARGV = "argv"
+KIND_CALLABLE = "callable"
+KINDS = (KIND_SHELL, KIND_ARGV, KIND_CALLABLE)
+
+# What makes two jobs "the same work" for deduplication
+DEDUP_FIELDS = ("kind", "command", "argv", "args", "kwargs")
+CALLABLE_PATTERN = re.compile(r"^[A-Za-z_][\w.]*:[A-Za-z_][\w.]*$")
+
+def validate_queue_name(queue):
+    """Queue names end up in counter field paths, so keep them plain."""
+    if not QUEUE_NAME_PATTERN.match(queue):
+        raise ValueError(f"Invalid queue name '{queue}'. Use letters, digits, '-' and '_' only.")
+    return queue
+
+def queue_of(job):
+    """Jobs enqueued before named queues existed belong to the default queue."""
+    return job.get("queue") or DEFAULT_QUEUE
+
+def weighted_queue_order(queues, weights=None):
+    """
+    Order `queues` for one claim attempt: a weighted random permutation
+    (Efraimidis-Spirakis), so a queue with weight 3 is tried first three
+    times as often as one with weight 1, yet no queue is ever skipped.
+    """
+    if len(queues) <= 1:
+        return queues
+    weights = weights or [1] * len(queues)
+    keyed = [(random.random() ** (1.0 / weight), queue) for queue, weight in zip(queues, weights)]
+    return [queue for _, queue in sorted(keyed, reverse=True)]
+
+def build_job(job_id, command, config, now=None, priority=0, queue=DEFAULT_QUEUE, limits=None, kind=KIND_SHELL, args=None, after=None, run_at=None, concurrency_key=None, max_running=None, rate=None,
+              dedup_key=None, dedup_window=None, retry_policy=None):
+    """
+    Build a new 'pending' job document, or a 'waiting' one if it has to
+    wait for the jobs listed in `after`. A `run_at` in the future delays
+    the job until then. Jobs sharing a `concurrency_key` are throttled
+    together when claimed (see throttle.py): at most `max_running` at a
+    time (1 if neither limit is given) and `rate` starts per second.
+    With a `dedup_key` (True derives one from the command and arguments)
+    the job is folded into an identical active job, or answered from the
+    result of one that succeeded in the last `dedup_window` seconds.
+    A `retry_policy` (see retry.py) overrides the queue's for this job.
+    Shared by every code path that creates jobs so they all look the same.
+    Higher priority jobs are claimed first; equal priorities run FIFO.
+    Per-queue config overrides (e.g. max_retries) are applied here.
+    Resource `limits` given at enqueue time (see LIMIT_KEYS) are stored on
+    the job; any left out are looked up from its queue when it runs.
+    For kind='argv', `command` is a list (or a string to split like a
+    shell would); for kind='callable' it is 'module:function' and `args`
+    is a JSON-style list (positional) or dict (keyword arguments).
+    """
+    if now is None:
+        now = datetime.datetime.utcnow()
+
+    queue_config = get_queue_config(config, queue)
+
+    job = {
+        "id": job_id,
+        "command": command,
+        "queue": queue,
+        "state": "pending",
+        "attempts": 0,
+        "max_retries": queue_config["max_retries"],
+        "priority": priority,
+        "created_at": now,
+        "updated_at": now,
+        "run_at": run_at or now,
+    }
+    if kind != KIND_SHELL:
+        job.update(_kind_fields(kind, command, args))
+    job.update({key: value for key, value in (limits or {}).items() if key in LIMIT_KEYS and value is not None})
+    if after:
+        job.update(_dependency_fields(job_id, after))
+    if concurrency_key:
+        job.update(_throttle_fields(concurrency_key, max_running, rate))
+    elif max_running or rate:
+        raise ValueError("Concurrency and rate limits need a concurrency key.")
+    if dedup_key:
+        key = default_dedup_key(job) if dedup_key is True else str(dedup_key)
+        window = config["dedup_window"] if dedup_window is None else dedup_window
+        # 'dedup_active' only exists while the job is waiting, pending or processing;
+        # a unique index on it is what folds duplicates together
+        job.update({"dedup_key": key, "dedup_window": window, "dedup_active": key})
+    if retry_policy:
+        job["retry_policy"] = validate_policy(retry_policy)
+    return job
+
+def default_dedup_key(job):
+    """A hash of the job's command and arguments (see DEDUP_FIELDS)."""
+    work = {field: job.get(field) for field in DEDUP_FIELDS if job.get(field) is not None}
+    return hashlib.sha256(json.dumps(work, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:32]
+
+def _throttle_fields(concurrency_key, max_running, rate):
+    if max_running is not None and max_running < 1:
+        raise ValueError("max_running must be at least 1.")
+    if rate is not None and rate <= 0:
+        raise ValueError("The rate limit must be positive.")
+    if max_running is None and rate is None:
+        max_running = 1
+    return {"concurrency_key": str(concurrency_key), "max_running": max_running, "rate_limit": rate}
+
+def _dependency_fields(job_id, after):
+    """
+    'depends_on' is kept for reference; 'deps_pending' lists the parents
+    that haven't completed yet and 'deps_remaining' counts them. Both
+    shrink as parents complete (see storage.py), and the job becomes
+    'pending' when the count reaches zero.
+    """
+    depends_on = list(dict.fromkeys(after))
+    if job_id in depends_on:
+        raise ValueError(f"Job '{job_id}' can't depend on itself.")
+    return {
+        "state": "waiting",
+        "depends_on": depends_on,
+        "deps_pending": list(depends_on),
+        "deps_remaining": len(depends_on)
+    }
+
+def _kind_fields(kind, command, args):
+    if kind == KIND_ARGV:
+        if isinstance(command, str):
+            argv = shlex.split(command)
+        elif isinstance(command, (list, tuple)):
+            argv = [str(part) for part in command]
+        else:
+            raise ValueError("An argv job's command must be a string or a list.")
+        if not argv:
+            raise ValueError("An argv job needs a program to run.")
+        return {"kind": kind, "argv": argv, "command": shlex.join(argv)}
+    if kind == KIND_CALLABLE:
+        if not isinstance(command, str) or not CALLABLE_PATTERN.match(command):
+            raise ValueError(f"Invalid callable '{command}'. Use 'package.module:function'.")
+        fields = {"kind": kind}
+        if isinstance(args, dict):
+            fields["kwargs"] = args
+        elif isinstance(args, list):
+            fields["args"] = args
+        elif args is not None:
+            raise ValueError("Callable arguments must be a JSON list or object.")
+        return fields
+    raise ValueError(f"Invalid job kind '{kind}'. Valid kinds are: {', '.join(KINDS)}")
+
+def job_limits(job, config):
+    """The job's resource limits: its own, else its queue's, else the global ones (0 = none)."""
+    queue_config = get_queue_config(config, queue_of(job))
+    return {key: job.get(key, queue_config[key]) for key in LIMIT_KEYS}
@@ -0,0 +1,168 @@
+# leases.py
+import datetime
+import threading
+import time
+from db import STATS_COLLECTION
+from collections import defaultdict
+from counters import bump_counts
+from dead_letter import move_to_dlq
+from jobs import queue_of
+from limits import FAILURE_LEASE
+from metrics import LEASES_RECLAIMED, DLQ_MOVES
+from throttle import release_permits, reconcile_permits
+
+LEASE_STATS_ID = "leases"
+
+def lease_expiry(lease_seconds, now=None):
+    if now is None:
+        now = datetime.datetime.utcnow()
+    return now + datetime.timedelta(seconds=lease_seconds)
+
+def renew_leases(jobs_collection, worker_id, lease_seconds):
+    """
+    Heartbeat: push out the lease on every job this worker holds
+    (running or still waiting in its prefetch buffer) in one write.
+    """
+    result = jobs_collection.update_many(
+        {"state": "processing", "worker_id": worker_id},
+        {"$set": {"lease_expires_at": lease_expiry(lease_seconds)}}
+    )
+    return result.modified_count
+
+def lease_error(worker_id):
+    return f"Lease expired: worker {worker_id or 'unknown'} stopped heartbeating."
+
+def is_last_attempt(job):
+    """Whether the run a lost lease cut short used up the job's retries."""
+    return job.get("max_retries") is not None and (job.get("attempts") or 0) + 1 >= job["max_retries"]
+
+def reap_expired_leases(db, on_buried=None):
+    """
+    Atomically return every 'processing' job whose lease has run out to
+    'pending', counting the lost run as an attempt. A job whose lost run
+    was its last attempt goes to the DLQ instead (failure_class 'lease'),
+    so a job that keeps killing its worker doesn't take down the next one,
+    and `on_buried(job)` is called for it. Returns how many jobs were
+    reclaimed. Safe to run from any number of processes at once: each
+    document can only match the expired-lease filter once.
+    Running slots of throttled jobs (see throttle.py) are given back,
+    and permits leaked by crashed workers are reconciled.
+    """
+    now = datetime.datetime.utcnow()
+    expired = {"state": "processing", "lease_expires_at": {"$lt": now}}
+
+    # Group by queue (and concurrency key) first so the counters stay right
+    ids_by_group = defaultdict(list)
+    exhausted = []
+    for doc in db["jobs"].find(expired, {"queue": 1, "concurrency_key": 1, "attempts": 1, "max_retries": 1}):
+        if is_last_attempt(doc):
+            exhausted.append(doc["_id"])
+        else:
+            ids_by_group[(queue_of(doc), doc.get("concurrency_key"))].append(doc["_id"])
+
+    reclaimed = 0
+    for (queue, key), ids in ids_by_group.items():
+        group_reclaimed = _reap(db, dict(expired, _id={"$in": ids}), now)
+        bump_counts(db, queue, processing=-group_reclaimed, pending=group_reclaimed)
+        if key:
+            release_permits(db, key, group_reclaimed)
+        reclaimed += group_reclaimed
+
+    # Materialised first: burying deletes what the cursor walks
+    for job in list(db["jobs"].find(dict(expired, _id={"$in": exhausted}))) if exhausted else []:
+        if _bury(db, job, expired, now):
+            reclaimed += 1
+            if on_buried is not None:
+                on_buried(job)
+    reconcile_permits(db, now)
+
+    if reclaimed:
+        db[STATS_COLLECTION].update_one(
+            {"_id": LEASE_STATS_ID},
+            {"$inc": {"reclaimed": reclaimed}, "$set": {"last_reclaimed_at": now}},
+            upsert=True
+        )
+    return reclaimed
+
+def _reap(db, query, now):
+    """One pipeline update: the expiry check and the requeue are atomic per job."""
+    result = db["jobs"].update_many(
+        query,
+        [
+            {"$set": {
+                "state": "pending",
+                "attempts": {"$add": [{"$ifNull": ["$attempts", 0]}, 1]},
+                "run_at": now,
+                "updated_at": now,
+                "last_error": {"$concat": [
+                    "Lease expired: worker ",
+                    {"$ifNull": ["$worker_id", "unknown"]},
+                    " stopped heartbeating."
+                ]},
+                "worker_id": None
+            }},
+            {"$unset": ["lease_expires_at", "claim_id"]}
+        ]
+    )
+    return result.modified_count
+
+def _bury(db, job, expired, now):
+    """Move a job whose lease ran out on its last attempt into the DLQ."""
+    job.update({
+        "state": "dead",
+        "attempts": (job.get("attempts") or 0) + 1,
+        "updated_at": now,
+        "last_error": lease_error(job.get("worker_id")),
+        "failure_class": FAILURE_LEASE,
+        "worker_id": None
+    })
+    job.pop("lease_expires_at", None)
+    job.pop("claim_id", None)
+    if not move_to_dlq(db["jobs"], db["dlq"], job, expired):
+        return False
+    bump_counts(db, queue_of(job), processing=-1, dead=1)
+    if job.get("concurrency_key"):
+        release_permits(db, job["concurrency_key"], 1)
+    DLQ_MOVES.inc(queue=queue_of(job), failure_class=FAILURE_LEASE)
+    return True
+
+def reclaimed_count(db):
+    stats = db[STATS_COLLECTION].find_one({"_id": LEASE_STATS_ID})
+    return stats.get("reclaimed", 0) if stats else 0
+
+def start_lease_keeper(store, worker_id, lease_seconds, should_continue, label="Worker", renew=None):
+    """
+    Daemon thread that renews this worker's leases every third of the
+    lease period and reaps other workers' expired leases every half period.
+    `store` is the worker's job store (see storage.py). `renew(lease_seconds)`,
+    if given, replaces the direct renewal, e.g. to send the heartbeat
+    with the write-behind buffer's next flush.
+    """
+    heartbeat_every = lease_seconds / 3
+    reap_every = lease_seconds / 2
+
+    def loop():
+        next_heartbeat = time.monotonic() + heartbeat_every
+        next_reap = time.monotonic()
+        while should_continue():
+            now = time.monotonic()
+            try:
+                if now >= next_heartbeat:
+                    if renew is not None:
+                        renew(lease_seconds)
+                    else:
+                        store.renew_leases(worker_id, lease_seconds)
+                    next_heartbeat = now + heartbeat_every
+                if now >= next_reap:
+                    reclaimed = store.reap_expired()
+                    LEASES_RECLAIMED.inc(reclaimed)
+                    if reclaimed:
+                        print(f"{label}: ♻️ Reclaimed {reclaimed} job(s) with expired leases.")
+                    next_reap = now + reap_every
+            except Exception as e:
+                print(f"{label}: ❌ Lease upkeep failed: {e}")
+            time.sleep(min(1, heartbeat_every))
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,99 @@
+# limits.py
+import os
+import resource
+import signal
+
+# How a failed run is recorded on the job ('failure_class')
+FAILURE_COMMAND = "command" # Non-zero exit, or the command could not start
+FAILURE_TIMEOUT = "timeout" # Ran past its wall-clock 'timeout'
+FAILURE_CPU = "cpu"         # Used up its 'cpu_seconds'
+FAILURE_MEMORY = "memory"   # Resident memory went past 'max_rss'
+FAILURE_DEPENDENCY = "dependency" # Never ran: a job it waited for failed
+FAILURE_LEASE = "lease"     # Its worker died (or stalled) mid-run on the last attempt
+FAILURE_CLASSES = (FAILURE_COMMAND, FAILURE_TIMEOUT, FAILURE_CPU, FAILURE_MEMORY, FAILURE_DEPENDENCY, FAILURE_LEASE)
+
+def cpu_rlimit(cpu_seconds):
+    """
+    (soft, hard) RLIMIT_CPU for a job: the kernel sends SIGXCPU when it has
+    used `cpu_seconds` and SIGKILL one second later. Never above the
+    worker's own hard limit, which the job inherits.
+    """
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(cpu_seconds)
+    new_hard = soft + 1 if hard == resource.RLIM_INFINITY else min(soft + 1, hard)
+    return min(soft, new_hard), new_hard
+
+def with_cpu_limit(command, shell, cpu_seconds):
+    """
+    `command` (a shell string, or an argv list when `shell` is False) with
+    RLIMIT_CPU set by /bin/sh's ulimit builtin before the job's own
+    program starts, so everything it forks inherits the limit. An argv
+    job goes through `sh -c '...; exec "$@"'`, which leaves no extra
+    process behind. (A preexec_fn would do this in the forked child, but
+    that isn't safe in a worker that runs threads.)
+    """
+    if not cpu_seconds:
+        return command
+    soft, hard = cpu_rlimit(cpu_seconds)
+    ulimit = f"ulimit -S -t {soft} && ulimit -H -t {hard} || exit 126\n"
+    if shell:
+        return ulimit + command
+    return ["/bin/sh", "-c", ulimit + 'exec "$@"', "sh"] + list(command)
+
+def _children(pid):
+    children = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+def tree_rss_kb(pid):
+    """
+    Resident memory of `pid` and all of its descendants, in KiB, read
+    from /proc (Linux). Elsewhere this returns 0 and only the
+    after-the-fact peak from rusage is checked.
+    """
+    total, stack, seen = 0, [pid], set()
+    while stack:
+        current = stack.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        total += _rss_kb(current)
+        stack.extend(_children(current))
+    return total
+
+def kill_tree(pid):
+    """SIGKILL the job's whole process group (it runs in its own session)."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+def classify(returncode, rusage, limits):
+    """
+    Work out why a finished (not killed by us) run failed: a run that
+    hit its CPU budget is told apart from a plain command failure.
+    Memory is not judged here: ru_maxrss also counts the forked worker's
+    own pages from before exec, so only the /proc watchdog decides that.
+    Returns None on success.
+    """
+    if returncode == 0:
+        return None
+    cpu_used = rusage.ru_utime + rusage.ru_stime
+    if limits.get("cpu_seconds") and (returncode in (-signal.SIGXCPU, 128 + signal.SIGXCPU) or cpu_used >= limits["cpu_seconds"]):
+        return FAILURE_CPU
+    return FAILURE_COMMAND
@@ -0,0 +1,72 @@
+# listing.py
+import base64
+import datetime
+import json
+# bson/pymongo are imported where they are used, so the CLI can load this
+# module (for DEFAULT_FIELDS) without paying for the MongoDB driver
+
+# What the table view shows when no --fields are given.
+DEFAULT_FIELDS = ["id", "command", "state", "attempts", "updated_at", "last_error"]
+
+def encode_cursor(doc, sort_field):
+    """
+    Opaque page token: the (sort value, _id) of the last row shown.
+    _id is an ObjectId on MongoDB and an integer rowid on SQLite.
+    """
+    value = doc.get(sort_field)
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+    row_id = doc["_id"] if isinstance(doc["_id"], int) else str(doc["_id"])
+    raw = json.dumps([value, row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        value, oid = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if isinstance(value, str):
+            value = datetime.datetime.fromisoformat(value)
+        if isinstance(oid, int):
+            return value, oid
+        from bson import ObjectId
+        return value, ObjectId(oid)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {token}")
+
+def stream_jobs(collection, query, sort_field, after=None, limit=50, fields=None, error_chars=100):
+    """
+    Yield job documents newest first, one page at a time.
+
+    Pages are keyset-based: `after` is the cursor of the last row of the
+    previous page, so every page is an index range scan on (sort_field, _id)
+    no matter how deep it is. Only `fields` are fetched, 'last_error' is cut
+    to `error_chars` on the server, and reads prefer a secondary so exports
+    stay off the primary. limit=0 streams everything.
+    """
+    fields = fields or DEFAULT_FIELDS
+
+    match = dict(query)
+    if after:
+        value, oid = decode_cursor(after)
+        match = {"$and": [query, {"$or": [
+            {sort_field: {"$lt": value}},
+            {sort_field: value, "_id": {"$lt": oid}}
+        ]}]}
+
+    projection = {field: 1 for field in fields if field != "last_error"}
+    projection[sort_field] = 1
+    if "last_error" in fields:
+        projection["last_error"] = {"$cond": [
+            {"$ifNull": ["$last_error", False]},
+            {"$substrCP": ["$last_error", 0, error_chars]},
+            "$$REMOVE"
+        ]}
+
+    pipeline = [{"$match": match}, {"$sort": {sort_field: -1, "_id": -1}}]
+    if limit:
+        pipeline.append({"$limit": limit})
+    pipeline.append({"$project": projection})
+
+    from pymongo import ReadPreference
+    reader = collection.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+    yield from reader.aggregate(pipeline, batchSize=500)
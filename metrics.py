@@ -0,0 +1,340 @@
+# metrics.py
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_DIR = "metrics" # One snapshot file per worker / supervisor process
+RETIRED_FILE = "_retired.json" # Counters folded in from processes that stopped publishing
+LOCK_FILE = ".lock"
+STALE_INTERVALS = 5 # Snapshots not rewritten for this many publishing intervals belong to gone processes
+RETIRED_NAMES_MAX = 10000 # Process names remembered as retired (so a snapshot is never folded in twice)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+_lock = threading.Lock()
+_registry = {}
+
+class Metric:
+    """
+    A named family of samples, one per combination of label values.
+    Values only live in this process; `write_snapshot` publishes them and
+    `aggregate` sums the snapshots of every process.
+    """
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.samples = {}
+        _registry[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.samples[key] = self.samples.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with _lock:
+            self.samples[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            sample = self.samples.get(key)
+            if sample is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                sample = self.samples[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            index = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    index = i
+                    break
+            sample["counts"][index] += 1
+            sample["sum"] += value
+            sample["count"] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+# --- Worker metrics ---
+
+CLAIM_SECONDS = Histogram("queuectl_claim_seconds", "Time spent in one claim round trip.", ["outcome"])
+QUEUE_WAIT_SECONDS = Histogram("queuectl_queue_wait_seconds", "Time from a job becoming due (run_at) to it being claimed.", ["queue"])
+SPAWN_SECONDS = Histogram("queuectl_spawn_seconds", "Time to start a job's process or get a warm callable runner.", ["kind"])
+EXECUTION_SECONDS = Histogram("queuectl_execution_seconds", "Wall-clock duration of one job attempt.", ["queue", "outcome"])
+DB_WRITE_SECONDS = Histogram("queuectl_db_write_seconds", "Time to record a job's outcome in the store.", ["operation"])
+JOBS_COMPLETED = Counter("queuectl_jobs_completed_total", "Jobs that finished successfully.", ["queue"])
+RETRIES = Counter("queuectl_retries_total", "Failed attempts that were scheduled for a retry.", ["queue", "failure_class"])
+DLQ_MOVES = Counter("queuectl_dlq_moves_total", "Jobs moved to the dead letter queue.", ["queue", "failure_class"])
+LEASES_LOST = Counter("queuectl_leases_lost_total", "Results discarded because the job's lease had been reclaimed.", ["queue"])
+LEASES_RECLAIMED = Counter("queuectl_leases_reclaimed_total", "Expired leases returned to 'pending' by the reaper.")
+
+# --- Supervisor metrics ---
+
+SUPERVISOR_WORKERS = Gauge("queuectl_supervisor_workers", "Workers currently running under the supervisor.")
+SUPERVISOR_TARGET = Gauge("queuectl_supervisor_target_workers", "Pool size the supervisor is aiming for.")
+SUPERVISOR_PENDING = Gauge("queuectl_supervisor_pending_jobs", "Pending jobs on the supervised queues at the last check.")
+SUPERVISOR_RESTARTS = Counter("queuectl_supervisor_restarts_total", "Crashed workers restarted by the supervisor.")
+SUPERVISOR_SCALING = Counter("queuectl_supervisor_scale_events_total", "Pool resizes by the supervisor.", ["direction"])
+
+
+# --- Publishing ---
+
+def reset():
+    """Forget every value, e.g. in a worker forked from the supervisor."""
+    with _lock:
+        for metric in _registry.values():
+            metric.samples = {}
+
+def snapshot():
+    with _lock:
+        return {
+            name: {
+                "type": metric.kind,
+                "help": metric.help,
+                "labels": list(metric.labels),
+                "buckets": list(getattr(metric, "buckets", [])),
+                "samples": [[list(key), value] for key, value in metric.samples.items()]
+            }
+            for name, metric in _registry.items()
+        }
+
+def write_snapshot(process_name):
+    """Atomically replace this process's snapshot in METRICS_DIR."""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = os.path.join(METRICS_DIR, f"{process_name}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot(), f)
+    os.replace(tmp_path, path)
+
+def start_metrics_writer(process_name, interval, should_continue, label="Worker"):
+    """Daemon thread that publishes this process's metrics every `interval` seconds."""
+    def loop():
+        while should_continue():
+            try:
+                write_snapshot(process_name)
+            except Exception as e:
+                print(f"{label}: ❌ Writing metrics failed: {e}")
+            deadline = time.monotonic() + interval
+            while should_continue() and time.monotonic() < deadline:
+                time.sleep(min(1, interval))
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
+
+
+# --- Aggregation and export ---
+
+def _merge(merged, families, gauges=True):
+    """Add one snapshot's samples to `merged`, in place."""
+    for name, family in families.items():
+        if family["type"] == "gauge" and not gauges:
+            continue
+        target = merged.setdefault(name, dict(family, samples={}))
+        for key, value in family["samples"]:
+            key = tuple(key)
+            current = target["samples"].get(key)
+            if current is None:
+                target["samples"][key] = value
+            elif family["type"] == "histogram":
+                current["counts"] = [a + b for a, b in zip(current["counts"], value["counts"])]
+                current["sum"] += value["sum"]
+                current["count"] += value["count"]
+            else:
+                target["samples"][key] = current + value
+
+def _as_snapshot(merged):
+    """The inverse of _merge: families in the snapshot file format."""
+    return {
+        name: dict(family, samples=[[list(key), value] for key, value in family["samples"].items()])
+        for name, family in merged.items()
+    }
+
+def _load(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None # Half-written or removed meanwhile
+
+def _snapshot_paths(directory):
+    return [path for path in sorted(glob.glob(os.path.join(directory, "*.json")))
+            if os.path.basename(path) != RETIRED_FILE]
+
+def _process_name(path):
+    return os.path.basename(path)[:-len(".json")]
+
+def retire_stale(directory=METRICS_DIR, stale_seconds=60, now=None):
+    """
+    Fold the counters and histograms of snapshots that haven't been
+    rewritten for `stale_seconds` (their process is gone) into
+    RETIRED_FILE and delete them; their gauges are dropped. Keeps the
+    pool-wide counters monotonic without summing stale gauges forever.
+    Returns how many snapshots were retired.
+    """
+    if not os.path.isdir(directory):
+        return 0
+    cutoff = (now if now is not None else time.time()) - stale_seconds
+    retired_path = os.path.join(directory, RETIRED_FILE)
+    with open(os.path.join(directory, LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX) # One folder at a time, or a snapshot could be counted twice
+        retired = _load(retired_path) or {"processes": [], "families": {}}
+        known = set(retired["processes"])
+        folded = {}
+        _merge(folded, retired["families"])
+        stale = []
+        for path in _snapshot_paths(directory):
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+            except OSError:
+                continue
+            stale.append(path)
+            if _process_name(path) in known:
+                continue # Folded in already; only the delete was missed
+            families = _load(path)
+            if families is not None:
+                _merge(folded, families, gauges=False)
+            retired["processes"].append(_process_name(path))
+        if not stale:
+            return 0
+
+        # Write the fold before deleting, so a crash in between can't lose counts
+        retired["processes"] = retired["processes"][-RETIRED_NAMES_MAX:]
+        retired["families"] = _as_snapshot(folded)
+        tmp_path = f"{retired_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(retired, f)
+        os.replace(tmp_path, retired_path)
+        for path in stale:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return len(stale)
+
+def aggregate(directory=METRICS_DIR, stale_seconds=None):
+    """
+    Sum the snapshots of every process, sample by sample, plus the totals
+    retired from processes that are gone, so pool-wide counters never go
+    backwards when a worker is restarted. With `stale_seconds`, snapshots
+    older than that are retired first (see retire_stale).
+    """
+    retired_names = set()
+    merged = {}
+    if stale_seconds:
+        retire_stale(directory, stale_seconds)
+    retired = _load(os.path.join(directory, RETIRED_FILE))
+    if retired is not None:
+        retired_names = set(retired["processes"])
+        _merge(merged, retired["families"])
+    for path in _snapshot_paths(directory):
+        if _process_name(path) in retired_names:
+            continue # A process that fell silent long enough to be retired
+        families = _load(path)
+        if families is not None:
+            _merge(merged, families)
+    return merged
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_text(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render(families):
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name in sorted(families):
+        family = families[name]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for key in sorted(family["samples"]):
+            value = family["samples"][key]
+            if family["type"] != "histogram":
+                lines.append(f"{name}{_label_text(family['labels'], key)} {_number(value)}")
+                continue
+            cumulative = 0
+            bounds = [_number(bound) for bound in family["buckets"]] + ["+Inf"]
+            for bound, count in zip(bounds, value["counts"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_label_text(family['labels'], key, ('le', bound))} {cumulative}")
+            lines.append(f"{name}_sum{_label_text(family['labels'], key)} {_number(value['sum'])}")
+            lines.append(f"{name}_count{_label_text(family['labels'], key)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+def stale_after(config):
+    """Seconds after which a process that hasn't republished its snapshot counts as gone."""
+    return STALE_INTERVALS * max(config["metrics_interval"], config["supervisor_interval"])
+
+def export_textfile(path, directory=METRICS_DIR, stale_seconds=None):
+    """Write the pool-wide metrics for node_exporter's textfile collector."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render(aggregate(directory, stale_seconds)))
+    os.replace(tmp_path, path)
+
+def serve(host, port, directory=METRICS_DIR, stale_seconds=None):
+    """Serve the pool-wide metrics on http://host:port/metrics until interrupted."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = render(aggregate(directory, stale_seconds)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Keep scrapes out of the terminal
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
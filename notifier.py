@@ -0,0 +1,125 @@
+# notifier.py
+import threading
+import time
+from pymongo.errors import OperationFailure, PyMongoError
+
+# Only changes that can make a job claimable are worth waking up for:
+# new jobs, and updates that put a job (back) into 'pending'.
+WAKE_PIPELINE = [
+    {"$match": {
+        "$or": [
+            {"operationType": "insert"},
+            {"operationType": "replace", "fullDocument.state": "pending"},
+            {"updateDescription.updatedFields.state": "pending"}
+        ]
+    }}
+]
+
+# Upper bound on a single idle wait even when a change stream is live,
+# so a missed event can never park a worker for long.
+MAX_STREAM_IDLE = 30
+
+class JobNotifier:
+    """
+    Tells an idle worker when it is worth trying to claim again.
+
+    If the store supports change streams (MongoDB replica sets), a
+    background thread watches the jobs collection and wakes the worker
+    the moment a job is inserted or re-queued. Otherwise idle waits back off exponentially between
+    `min_backoff` and `max_backoff`. Either way, the wait never runs past
+    the earliest future `run_at`, so delayed and retried jobs start on time.
+    """
+
+    def __init__(self, store, min_backoff, max_backoff, label="Worker", queues=None):
+        self.store = store
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.label = label
+        self.queues = queues
+        self.streaming = False
+        self._backoff = min_backoff
+        self._event = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        """Open the change stream, falling back to polling if unsupported."""
+        try:
+            stream = self.store.watch(WAKE_PIPELINE)
+        except OperationFailure as e:
+            print(f"{self.label}: 💤 Change streams unavailable ({e.code}). Using adaptive idle backoff.")
+            return
+        except PyMongoError as e:
+            print(f"{self.label}: 💤 Could not open change stream ({e}). Using adaptive idle backoff.")
+            return
+        if stream is None:
+            print(f"{self.label}: 💤 The {self.store.name} backend has no change streams. Using adaptive idle backoff.")
+            return
+
+        self.streaming = True
+        self._thread = threading.Thread(target=self._watch, args=(stream,), daemon=True)
+        self._thread.start()
+        print(f"{self.label}: 📡 Watching for new jobs via change stream.")
+
+    def stop(self):
+        self._stopped = True
+        self._event.set()
+
+    def notify(self):
+        self._event.set()
+
+    def reset(self):
+        """Call after a successful claim: the next idle wait starts short again."""
+        self._backoff = self.min_backoff
+
+    def _watch(self, stream):
+        while not self._stopped:
+            try:
+                with stream:
+                    while not self._stopped and stream.alive:
+                        if stream.try_next() is not None:
+                            self._event.set()
+            except PyMongoError as e:
+                if self._stopped:
+                    break
+                print(f"{self.label}: ⚠️ Change stream interrupted ({e}). Reopening...")
+
+            if self._stopped:
+                break
+
+            # Jobs may have arrived while the stream was down.
+            self._event.set()
+            try:
+                stream = self.store.watch(WAKE_PIPELINE)
+            except PyMongoError as e:
+                print(f"{self.label}: 💤 Change stream lost ({e}). Falling back to adaptive idle backoff.")
+                self.streaming = False
+                return
+
+    def wait(self, should_continue):
+        """
+        Block until a wake-up, the next due job, or the idle timeout,
+        whichever comes first. Polls `should_continue` every second so a
+        shutdown signal is never held up by a long wait.
+        """
+        if self.streaming:
+            timeout = MAX_STREAM_IDLE
+        else:
+            timeout = self._backoff
+            self._backoff = min(self._backoff * 2, self.max_backoff)
+
+        try:
+            due_in = self.store.seconds_until_next_due(self.queues)
+        except Exception:
+            due_in = None
+        if due_in is not None:
+            timeout = min(timeout, due_in)
+
+        deadline = time.monotonic() + timeout
+        while should_continue():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self._event.wait(min(remaining, 1)):
+                break
+        self._event.clear()
@@ -0,0 +1,196 @@
+# output.py
+import codecs
+import datetime
+import os
+import random
+import subprocess
+import threading
+import time
+from urllib.parse import quote
+from limits import with_cpu_limit, tree_rss_kb, kill_tree, classify, FAILURE_TIMEOUT, FAILURE_MEMORY
+from callables import run_callable
+from jobs import KIND_SHELL, KIND_ARGV, KIND_CALLABLE
+from metrics import SPAWN_SECONDS
+
+OUTPUT_DIR = os.path.join("logs", "jobs")
+READ_CHUNK = 64 * 1024
+
+def spool_paths(job_id):
+    """Per-job stdout/stderr spool files. Job IDs are escaped so any ID is a safe file name."""
+    name = quote(job_id, safe="")
+    return os.path.join(OUTPUT_DIR, f"{name}.out"), os.path.join(OUTPUT_DIR, f"{name}.err")
+
+def prune_spool(retention_seconds, directory=OUTPUT_DIR, now=None):
+    """
+    Delete spool files nothing has written to for `retention_seconds`
+    (0 = keep forever). Jobs are archived, expire and are trimmed from
+    history without the worker that ran them knowing, so files are aged
+    out on their own clock. Returns how many files were removed.
+    """
+    if retention_seconds <= 0 or not os.path.isdir(directory):
+        return 0
+    cutoff = (now if now is not None else time.time()) - retention_seconds
+    removed = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass # Pruned by another worker on this machine
+    return removed
+
+def start_spool_pruner(config, should_continue, label="Worker"):
+    """
+    Run prune_spool() every 'compact_interval' seconds on a daemon thread,
+    with any backend: spool files live on each worker's own machine.
+    """
+    interval, retention = config["compact_interval"], config["output_retention_seconds"]
+    if interval <= 0 or retention <= 0:
+        return None
+
+    def loop():
+        next_run = time.monotonic() + random.uniform(0, interval)
+        while should_continue():
+            if time.monotonic() < next_run:
+                time.sleep(1)
+                continue
+            try:
+                removed = prune_spool(retention)
+                if removed:
+                    print(f"{label}: 🧹 Removed {removed} spool file(s) older than {retention}s.")
+            except Exception as e:
+                print(f"{label}: ❌ Pruning spool files failed: {e}")
+            next_run = time.monotonic() + interval
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
+
+def excerpt(path, start, head_bytes, tail_bytes):
+    """
+    Read at most head_bytes + tail_bytes of `path` from offset `start`:
+    the beginning and the end, with a marker for whatever was skipped.
+    """
+    size = os.path.getsize(path) - start
+    with open(path, 'rb') as f:
+        f.seek(start)
+        if size <= head_bytes + tail_bytes:
+            return f.read(size).decode('utf-8', errors='replace'), size
+        head = f.read(head_bytes)
+        f.seek(start + size - tail_bytes)
+        tail = f.read(tail_bytes)
+    skipped = size - head_bytes - tail_bytes
+    text = (head.decode('utf-8', errors='replace')
+            + f"\n... [{skipped} bytes omitted, see 'queuectl logs'] ...\n"
+            + tail.decode('utf-8', errors='replace'))
+    return text, size
+
+def run_spooled(job, limits, head_bytes, tail_bytes):
+    """
+    Run the job with stdout and stderr going straight to its spool files,
+    so the worker never holds the output in memory. Shell jobs go through
+    /bin/sh, 'argv' jobs are exec'd directly (no shell) and 'callable'
+    jobs run in a warm runner process (see callables.py).
+    Each attempt is appended under its own header line.
+    `limits` holds the job's timeout (wall clock), cpu_seconds (RLIMIT_CPU)
+    and max_rss (MiB of resident memory, watched from /proc); 0 = no limit.
+    Returns (returncode, stderr_excerpt, output, failure_class) where
+    `output` is the small summary stored on the job document and
+    failure_class is None on success.
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    out_path, err_path = spool_paths(job["id"])
+    header = f"--- attempt {job.get('attempts', 0) + 1} started {datetime.datetime.utcnow().isoformat()} ---\n".encode()
+
+    with open(out_path, 'ab') as out, open(err_path, 'ab') as err:
+        out.write(header)
+        err.write(header)
+        out.flush()
+        err.flush()
+        out_start, err_start = out.tell(), err.tell()
+        if job.get("kind") == KIND_CALLABLE:
+            returncode, usage, failure_class, result = run_callable(job, limits, out_path, err_path)
+        else:
+            argv = job.get("kind") == KIND_ARGV
+            # Own session, so a limit can kill the whole shell pipeline
+            with SPAWN_SECONDS.time(kind=KIND_ARGV if argv else KIND_SHELL):
+                command = with_cpu_limit(job['argv'] if argv else job['command'], not argv, limits.get("cpu_seconds"))
+                process = subprocess.Popen(command, shell=not argv,
+                                           stdout=out, stderr=err, stdin=subprocess.DEVNULL,
+                                           start_new_session=True)
+            returncode, usage, failure_class = _supervise(process, limits)
+            result = None
+
+    stderr_text, stderr_bytes = excerpt(err_path, err_start, head_bytes, tail_bytes)
+    stdout_text, stdout_bytes = excerpt(out_path, out_start, head_bytes, tail_bytes)
+    output = {
+        "stdout_path": out_path,
+        "stderr_path": err_path,
+        "stdout_bytes": stdout_bytes,
+        "stderr_bytes": stderr_bytes,
+        "stdout": stdout_text,
+        "usage": usage
+    }
+    if result is not None:
+        output["result"] = result
+    return returncode, stderr_text, output, failure_class
+
+def _supervise(process, limits):
+    """
+    Wait for the job with os.wait4 (which also returns its rusage), killing
+    it if it outlives its timeout or its resident memory passes max_rss.
+    Polls quickly at first so short jobs aren't held up, then backs off.
+    """
+    timeout, max_rss = limits.get("timeout"), limits.get("max_rss")
+    deadline = time.monotonic() + timeout if timeout else None
+    failure_class = None
+    poll = 0.002
+    while True:
+        pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            break
+        if failure_class is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                failure_class = FAILURE_TIMEOUT
+            elif max_rss and tree_rss_kb(process.pid) > max_rss * 1024:
+                failure_class = FAILURE_MEMORY
+            if failure_class is not None:
+                kill_tree(process.pid)
+                continue
+        time.sleep(poll)
+        poll = min(poll * 2, 0.25)
+
+    # We reaped the child ourselves; tell Popen so it doesn't try again
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if failure_class is None:
+        failure_class = classify(process.returncode, rusage, limits)
+    usage = {
+        "cpu_seconds": round(rusage.ru_utime + rusage.ru_stime, 3),
+        "max_rss_mb": round(rusage.ru_maxrss / 1024, 1)
+    }
+    return process.returncode, usage, failure_class
+
+def follow(path, write, keep_going, poll=0.5):
+    """
+    Copy `path` to `write` in chunks, then keep copying whatever is
+    appended while keep_going() is true (like 'tail -f').
+    """
+    while not os.path.exists(path):
+        if not keep_going():
+            return
+        time.sleep(poll)
+    # Incremental, so a character split across two reads stays intact
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if chunk:
+                write(decoder.decode(chunk))
+                continue
+            if not keep_going():
+                # One last read: the job may have written just before finishing
+                write(decoder.decode(f.read(), final=True))
+                return
+            time.sleep(poll)
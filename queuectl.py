@@ -1,14 +1,36 @@
 # queuectl.py
+import sys
+import daemon
+
+# A running 'daemon' already has everything below imported and connected:
+# hand it the command before paying for any of that here
+if __name__ == "__main__" and len(sys.argv) > 1:
+    exit_code = daemon.forward(sys.argv[1:])
+    if exit_code is not None:
+        sys.exit(exit_code)
+
 import click
 import uuid
 import datetime
 import os
-import sys
 import json
+import csv
+import io
+import time
+import itertools
+import glob
+import signal
 import shlex  # This is the key to handling quoted commands
-from db import get_db, ensure_indexes
-from config import get_config, set_config_value
-from worker_manager import start_workers, stop_workers # Import our new functions
+from config import get_config, set_config_value, set_queue_config_value, BACKENDS
+from jobs import build_job, validate_queue_name, DEFAULT_QUEUE, KINDS, KIND_SHELL, KIND_ARGV
+from limits import FAILURE_CLASSES
+from listing import encode_cursor, DEFAULT_FIELDS
+from output import spool_paths, follow as follow_output
+from scheduler import Scheduler, new_schedule, build_schedule_job
+import metrics as metrics_registry
+# Anything that pulls in pymongo (db, storage, throttle, ...) or the worker
+# (worker_manager, supervisor, bench) is imported inside the commands that
+# need it, so 'config show', '--help' and friends start fast.
 
 # --- Main CLI Group ---
 # We use 'context_settings' to make --help work in the shell
@@ -22,12 +44,64 @@ def cli():
     """
     pass
 
+# --- Storage Helpers ---
+
+def _open_store(setup=False):
+    """The configured job store (see 'backend' in config), or None after printing an error."""
+    from storage import get_store
+    store = get_store()
+    if store is None:
+        click.echo("❌ Error: Could not connect to DB.", err=True)
+        return None
+    if setup:
+        store.setup()
+    return store
+
+def _require_mongo(store, feature):
+    """History, the supervisor and explain plans only exist on the MongoDB backend."""
+    if store.name != "mongo":
+        click.echo(f"❌ Error: {feature} needs the mongo backend (current backend: {store.name}).", err=True)
+        return False
+    return True
+
 # --- Enqueue Command (New User-Friendly Version) ---
 
+# Shared by 'enqueue' and 'enqueue-batch'; unset limits fall back to the queue's config
+def limit_options(f):
+    f = click.option('--timeout', default=None, type=click.IntRange(min=0), help="Wall-clock limit in seconds (0 = none).")(f)
+    f = click.option('--max-rss', default=None, type=click.IntRange(min=0), help="Resident memory limit in MB (0 = none).")(f)
+    f = click.option('--cpu-seconds', default=None, type=click.IntRange(min=0), help="CPU time limit in seconds (0 = none).")(f)
+    return f
+
+# Shared by 'enqueue' and 'enqueue-batch'; enforced at claim time across all workers
+def throttle_options(f):
+    f = click.option('--concurrency-key', default=None, help="Jobs with the same key share the limits below (e.g. a tenant or an API).")(f)
+    f = click.option('--max-running', default=None, type=click.IntRange(min=1), help="Most jobs with this key running at once (default 1 unless --rate is given).")(f)
+    f = click.option('--rate', default=None, help="Most job starts with this key per second, minute or hour, e.g. 10/s or 600/m.")(f)
+    return f
+
+# Shared by 'enqueue' and 'enqueue-batch'; the dedup key is a hash of the command and arguments
+def dedup_options(f):
+    f = click.option('--dedup', is_flag=True, help="Fold into an identical active job, or reuse the result of one that succeeded recently.")(f)
+    f = click.option('--dedup-window', default=None, type=click.IntRange(min=0), help="Seconds a successful result is reused (default: config 'dedup_window'; 0 = fold only).")(f)
+    return f
+
 @cli.command()
 @click.argument('job_id', type=str)
 @click.argument('command', nargs=-1) # This takes all remaining arguments
-def enqueue(job_id, command):
+@click.option('--priority', default=0, type=int, help="Higher runs first (default 0). Equal priorities run in FIFO order.")
+@click.option('--queue', default=DEFAULT_QUEUE, help="Named queue to put the job on.")
+@click.option('--kind', type=click.Choice(KINDS), default=KIND_SHELL, help="shell (default), argv (run without a shell) or callable (module:function).")
+@click.option('--args', 'call_args', default=None, help="JSON list or object of arguments for a callable job.")
+@click.option('--after', default=None, help="Comma-separated IDs of jobs that must complete first.")
+@click.option('--delay', default=None, type=click.FloatRange(min=0), help="Seconds to wait before the job may run.")
+@click.option('--at', 'run_at', default=None, type=click.DateTime(), help="Earliest time (UTC) the job may run.")
+@click.option('--dedup-key', default=None, help="Explicit dedup key (implies --dedup), e.g. 'invoice-1042'.")
+@click.option('--retry-policy', default=None, help="JSON retry policy for this job (overrides the queue's 'retry_policy').")
+@limit_options
+@throttle_options
+@dedup_options
+def enqueue(job_id, command, priority, queue, kind, call_args, after, delay, run_at, dedup_key, retry_policy, timeout, max_rss, cpu_seconds, concurrency_key, max_running, rate, dedup, dedup_window):
     """
     Add a new job to the queue.
     
@@ -36,44 +110,368 @@ def enqueue(job_id, command):
     
     Example:
     enqueue my-job "sleep 5 && echo 'hello world'"
+    enqueue resize --kind callable images.tasks:resize --args '{"size": 128}'
+    enqueue report "python report.py" --after extract,transform
+    enqueue reminder "echo stand-up" --delay 900
+    enqueue sync-acme "python sync.py acme" --concurrency-key tenant-acme
+    enqueue fetch-42 "python fetch.py 42" --dedup --dedup-window 600
+    enqueue push "python push.py" --retry-policy '{"strategy": "fixed", "delay": 30}'
     """
     try:
-        db, jobs_collection, _ = get_db()
-        if db is None:
-            click.echo("❌ Error: Could not connect to DB.", err=True)
+        store = _open_store(setup=True)
+        if store is None:
             return
             
-        ensure_indexes()
-            
         if not command:
             click.echo("❌ Error: COMMAND cannot be empty.", err=True)
             return
+        if delay is not None and run_at is not None:
+            click.echo("❌ Error: Use either --delay or --at, not both.", err=True)
+            return
 
         # Join the tuple of command parts back into a single string
         full_command = " ".join(command)
+        if kind == KIND_ARGV and len(command) > 1:
+            # Already split (by the shell or the REPL): keep the words as given
+            full_command = [part for part in command]
+        validate_queue_name(queue)
         
+        from throttle import parse_rate
         config = get_config()
+        limits = {"timeout": timeout, "max_rss": max_rss, "cpu_seconds": cpu_seconds}
+        args = json.loads(call_args) if call_args else None
+        parents = _parse_ids(after)
+        if parents:
+            missing = _missing_jobs(store, parents)
+            if missing:
+                click.echo(f"❌ Error: Unknown dependency ID(s): {', '.join(missing)}", err=True)
+                return
         now = datetime.datetime.utcnow()
+        if delay is not None:
+            run_at = now + datetime.timedelta(seconds=delay)
+        job = build_job(job_id, full_command, config, now=now, priority=priority, queue=queue, limits=limits, kind=kind, args=args, after=parents, run_at=run_at,
+                        concurrency_key=concurrency_key, max_running=max_running, rate=parse_rate(rate),
+                        dedup_key=dedup_key or dedup, dedup_window=dedup_window,
+                        retry_policy=json.loads(retry_policy) if retry_policy else None)
         
-        job = {
-            "id": job_id,
-            "command": full_command,
-            "state": "pending",
-            "attempts": 0,
-            "max_retries": config["max_retries"],
-            "created_at": now,
-            "updated_at": now,
-            "run_at": now,
-        }
-        
-        jobs_collection.insert_one(job)
-        click.echo(f"✅ Job enqueued with ID: {job_id}")
+        inserted, errors = store.enqueue([job])
+        if job.get("folded_into"):
+            click.echo(f"🔁 Identical job '{job['folded_into']}' is already queued; '{job_id}' was not added.")
+        elif inserted and job.get("cached_from"):
+            click.echo(f"✅ Job {job_id} answered from cache (result of '{job['cached_from']}').")
+        elif inserted and parents and store.job_states([job_id]).get(job_id) == "waiting":
+            click.echo(f"✅ Job enqueued with ID: {job_id} (waiting for {len(parents)} job(s))")
+        elif inserted and job["run_at"] > now:
+            click.echo(f"✅ Job enqueued with ID: {job_id} (runs at {job['run_at'].isoformat(timespec='seconds')} UTC)")
+        elif inserted:
+            click.echo(f"✅ Job enqueued with ID: {job_id}")
+        elif errors[0][1]:
+            click.echo(f"❌ Error: A job with ID '{job_id}' already exists.", err=True)
+        else:
+            click.echo(f"❌ Error adding job: {errors[0][2]}", err=True)
         
     except Exception as e:
-        if "E11000" in str(e):
-            click.echo(f"❌ Error: A job with ID '{job_id}' already exists.", err=True)
+        click.echo(f"❌ Error adding job: {e}", err=True)
+
+
+def _parse_ids(text):
+    if not text:
+        return []
+    return [job_id.strip() for job_id in text.split(",") if job_id.strip()]
+
+def _missing_jobs(store, job_ids):
+    """The ids among `job_ids` that no job (live, dead or archived) has."""
+    states = store.job_states(job_ids)
+    return [job_id for job_id in job_ids if job_id not in states]
+
+
+# --- Bulk Enqueue Command ---
+
+def _read_batch_rows(source, fmt, id_field, command_field, args_field="args"):
+    """
+    Yield (line_number, job_id, command, args) from a JSONL or CSV stream,
+    one row at a time, so input of any size is read in constant memory.
+    Rows that can't be turned into a job yield command=None.
+    In CSV input the args column holds JSON text.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(source)
+        for row in reader:
+            try:
+                args = json.loads(row[args_field]) if row.get(args_field) else None
+            except json.JSONDecodeError:
+                yield reader.line_num, None, None, None
+                continue
+            yield reader.line_num, row.get(id_field) or None, row.get(command_field) or None, args
+        return
+
+    for line_number, line in enumerate(source, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            yield line_number, None, None, None
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, None, None
+            continue
+        job_id = row.get(id_field)
+        yield line_number, str(job_id) if job_id is not None else None, row.get(command_field) or None, row.get(args_field)
+
+@cli.command(name="enqueue-batch")
+@click.argument('source', type=click.File('r', encoding='utf-8'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv'], case_sensitive=False), default=None, help="Input format (default: guessed from the file name, else jsonl).")
+@click.option('--chunk-size', default=1000, type=click.IntRange(min=1), help="Jobs written per batch (one insert_many or one transaction).")
+@click.option('--id-field', default='id', help="Field holding the job ID (a UUID is generated when missing).")
+@click.option('--command-field', default='command', help="Field holding the command to run.")
+@click.option('--priority', default=0, type=int, help="Priority given to every job in the batch.")
+@click.option('--queue', default=DEFAULT_QUEUE, help="Named queue for every job in the batch.")
+@click.option('--kind', type=click.Choice(KINDS), default=KIND_SHELL, help="Kind of every job in the batch (see 'enqueue').")
+@click.option('--args-field', default='args', help="Field holding a callable job's JSON arguments.")
+@limit_options
+@throttle_options
+@dedup_options
+def enqueue_batch(source, fmt, chunk_size, id_field, command_field, priority, queue, kind, args_field, timeout, max_rss, cpu_seconds, concurrency_key, max_running, rate, dedup, dedup_window):
+    """
+    Add many jobs at once from a JSONL/CSV file or stdin.
+    
+    SOURCE: Path to the input file, or '-' for stdin (the default).
+    
+    Example:
+    enqueue-batch jobs.jsonl --chunk-size 5000
+    """
+    try:
+        store = _open_store(setup=True)
+        if store is None:
+            return
+
+        validate_queue_name(queue)
+
+        if fmt is None:
+            fmt = "csv" if source.name.lower().endswith(".csv") else "jsonl"
+        fmt = fmt.lower()
+
+        from throttle import parse_rate
+        config = get_config()
+        limits = {"timeout": timeout, "max_rss": max_rss, "cpu_seconds": cpu_seconds}
+        throttle = {"concurrency_key": concurrency_key, "max_running": max_running, "rate": parse_rate(rate)}
+        inserted = duplicates = invalid = failed = folded = cached = 0
+        started = time.perf_counter()
+        rows = _read_batch_rows(source, fmt, id_field, command_field, args_field)
+
+        while True:
+            batch = [row for row in itertools.islice(rows, chunk_size)]
+            if not batch:
+                break
+
+            chunk = []
+            lines = []
+            for line_number, job_id, command, args in batch:
+                if command is None:
+                    invalid += 1
+                    click.echo(f"⚠️ Line {line_number}: no usable '{command_field}' field, skipped.", err=True)
+                    continue
+                if kind != KIND_ARGV:
+                    command = str(command)
+                try:
+                    chunk.append(build_job(job_id or str(uuid.uuid4()), command, config, priority=priority, queue=queue, limits=limits, kind=kind, args=args, **throttle,
+                                           dedup_key=dedup, dedup_window=dedup_window))
+                except ValueError as e:
+                    invalid += 1
+                    click.echo(f"⚠️ Line {line_number}: {e} Skipped.", err=True)
+                    continue
+                lines.append(line_number)
+
+            if chunk:
+                chunk_inserted, errors = store.enqueue(chunk)
+                for index, duplicate, message in errors:
+                    if duplicate:
+                        duplicates += 1
+                        click.echo(f"⚠️ Line {lines[index]}: a job with ID '{chunk[index]['id']}' already exists, skipped.", err=True)
+                    else:
+                        failed += 1
+                        click.echo(f"❌ Line {lines[index]}: could not insert job '{chunk[index]['id']}': {message}", err=True)
+                inserted += chunk_inserted
+                folded += sum(1 for job in chunk if job.get("folded_into"))
+                cached += sum(1 for job in chunk if job.get("cached_from"))
+
+        elapsed = time.perf_counter() - started
+        rate = inserted / elapsed if elapsed > 0 else 0
+        click.echo(f"✅ Enqueued {inserted} job(s) in {elapsed:.2f}s ({rate:,.0f} jobs/s).")
+        if folded or cached:
+            click.echo(f"   Deduplicated: {folded} folded into identical active job(s), {cached} answered from cache.")
+        if duplicates or invalid or failed:
+            click.echo(f"   Skipped: {duplicates} duplicate ID(s), {invalid} invalid row(s), {failed} other error(s).")
+
+    except Exception as e:
+        click.echo(f"❌ Error enqueuing batch: {e}", err=True)
+
+
+# --- Workflow Command Group ---
+
+@cli.group()
+def workflow():
+    """Submit DAGs of jobs that wait for each other."""
+    pass
+
+@workflow.command(name="submit")
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--id-prefix', default="", help="Added to every job ID defined in the file, e.g. to submit it again as a new run.")
+@click.option('--queue', default=DEFAULT_QUEUE, help="Queue for jobs that don't name one.")
+def workflow_submit(source, id_prefix, queue):
+    """
+    Enqueue every job of a workflow file (JSON) in dependency order.
+    
+    Jobs start as 'waiting' and become 'pending' once every job in their
+    'after' list has completed. If one fails for good, the jobs waiting
+    on it go to the DLQ with failure class 'dependency'.
+    
+    Example:
+    workflow submit etl.json --id-prefix 2024-06-01-
+    """
+    try:
+        store = _open_store(setup=True)
+        if store is None:
+            return
+
+        from workflow import load_workflow, build_workflow_jobs
+        jobs, external = build_workflow_jobs(load_workflow(source), get_config(), id_prefix, queue)
+        taken = store.job_states([job["id"] for job in jobs])
+        if taken:
+            click.echo(f"❌ Error: Job ID(s) already in use: {', '.join(sorted(taken))}. Try --id-prefix.", err=True)
+            return
+        missing = _missing_jobs(store, external)
+        if missing:
+            click.echo(f"❌ Error: Unknown dependency ID(s): {', '.join(missing)}", err=True)
+            return
+
+        inserted, errors = store.enqueue(jobs)
+        for index, duplicate, message in errors:
+            click.echo(f"❌ Could not insert job '{jobs[index]['id']}': {message}", err=True)
+        states = store.job_states([job["id"] for job in jobs])
+        waiting = sum(1 for state in states.values() if state == "waiting")
+        click.echo(f"✅ Submitted {inserted} job(s): {inserted - waiting} ready, {waiting} waiting on dependencies.")
+    except ValueError as e:
+        click.echo(f"❌ Error: {e}", err=True)
+    except Exception as e:
+        click.echo(f"❌ Error submitting workflow: {e}", err=True)
+
+
+# --- Schedule Command Group ---
+
+@cli.group()
+def schedule():
+    """Recurring (cron) jobs."""
+    pass
+
+@schedule.command(name="add")
+@click.argument('cron_expression')
+@click.argument('command', nargs=-1)
+@click.option('--name', default=None, help="Unique schedule name (default: generated). Its jobs get IDs like NAME@20240601T0900.")
+@click.option('--priority', default=0, type=int, help="Priority of every job it enqueues.")
+@click.option('--queue', default=DEFAULT_QUEUE, help="Queue its jobs go to.")
+@click.option('--kind', type=click.Choice(KINDS), default=KIND_SHELL, help="Kind of its jobs (see 'enqueue').")
+@click.option('--args', 'call_args', default=None, help="JSON arguments for a callable job.")
+@limit_options
+def schedule_add(cron_expression, command, name, priority, queue, kind, call_args, timeout, max_rss, cpu_seconds):
+    """
+    Enqueue COMMAND every time CRON_EXPRESSION (UTC) fires.
+    
+    The expression has five fields (minute hour day month weekday) or is
+    one of @hourly, @daily, @weekly, @monthly, @yearly. Jobs are created
+    by 'schedule run', which must be running somewhere.
+    
+    Example:
+    schedule add "*/15 * * * *" "python sync.py" --name sync
+    schedule add "0 9 * * mon-fri" "python report.py" --queue batch
+    """
+    try:
+        store = _open_store(setup=True)
+        if store is None:
+            return
+        if not command:
+            click.echo("❌ Error: COMMAND cannot be empty.", err=True)
+            return
+
+        full_command = " ".join(command)
+        if kind == KIND_ARGV and len(command) > 1:
+            full_command = [part for part in command]
+        validate_queue_name(queue)
+        name = name or f"schedule-{uuid.uuid4().hex[:8]}"
+        limits = {"timeout": timeout, "max_rss": max_rss, "cpu_seconds": cpu_seconds}
+        args = json.loads(call_args) if call_args else None
+        entry = new_schedule(name, cron_expression, full_command, queue=queue, priority=priority, kind=kind, args=args, limits=limits)
+        # Fail now, not at every run, if the job itself can't be built
+        build_schedule_job(entry, entry["next_run"], get_config())
+
+        if not store.add_schedule(entry):
+            click.echo(f"❌ Error: A schedule named '{name}' already exists.", err=True)
+            return
+        click.echo(f"✅ Schedule '{name}' added. Next run: {entry['next_run'].isoformat()} UTC")
+    except ValueError as e:
+        click.echo(f"❌ Error: {e}", err=True)
+    except Exception as e:
+        click.echo(f"❌ Error adding schedule: {e}", err=True)
+
+@schedule.command(name="list")
+def schedule_list():
+    """List schedules and their next run times."""
+    try:
+        store = _open_store()
+        if store is None:
+            return
+
+        schedules = store.list_schedules()
+        click.echo("--- Schedules ---")
+        if not schedules:
+            click.echo("No schedules.")
+        for entry in schedules:
+            click.echo(f"- {entry['name']}: {entry['cron']} (queue {entry.get('queue') or DEFAULT_QUEUE})")
+            click.echo(f"  Cmd: {entry['command']}")
+            click.echo(f"  Next run: {_format_value(entry['next_run'])}  Last run: {_format_value(entry.get('last_run')) or 'never'}")
+    except Exception as e:
+        click.echo(f"❌ Error listing schedules: {e}", err=True)
+
+@schedule.command(name="remove")
+@click.argument('name')
+def schedule_remove(name):
+    """Delete a schedule. Jobs it already enqueued are kept."""
+    try:
+        store = _open_store()
+        if store is None:
+            return
+
+        if store.remove_schedule(name):
+            click.echo(f"✅ Schedule '{name}' removed.")
         else:
-            click.echo(f"❌ Error adding job: {e}", err=True)
+            click.echo(f"❌ Error: Schedule '{name}' not found.", err=True)
+    except Exception as e:
+        click.echo(f"❌ Error removing schedule: {e}", err=True)
+
+@schedule.command(name="run")
+def schedule_run():
+    """
+    Run the scheduler in the foreground until interrupted.
+    
+    Start one on as many machines as you like: they elect a leader and
+    only the leader enqueues, so each run happens once.
+    """
+    try:
+        store = _open_store(setup=True)
+        if store is None:
+            return
+
+        running = [True]
+        signal.signal(signal.SIGTERM, lambda signum, frame: running.__setitem__(0, False))
+        click.echo("⏰ Scheduler started. Press Ctrl+C to stop.")
+        Scheduler(store, get_config()).run(lambda: running[0])
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        click.echo(f"❌ Error running scheduler: {e}", err=True)
+    click.echo("Scheduler stopped.")
 
 
 # --- Worker Command Group (Refactored) ---
@@ -85,83 +483,259 @@ def worker():
 
 @worker.command()
 @click.option('--count', default=1, type=int, help="Number of workers to start.")
-def start(count):
+@click.option('--prefetch', default=None, type=click.IntRange(min=1), help="Jobs each worker claims per round trip (defaults to config 'prefetch').")
+@click.option('--concurrency', default=1, type=click.IntRange(min=1), help="Jobs each worker runs at the same time.")
+@click.option('--queues', default=DEFAULT_QUEUE, help="Comma-separated queues these workers serve (e.g. fast,batch).")
+@click.option('--weights', default=None, help="Comma-separated weights matching --queues (e.g. 3,1).")
+@click.option('--add', is_flag=True, help="Start this pool alongside workers that are already running.")
+def start(count, prefetch, concurrency, queues, weights, add):
     """Start one or more worker processes in the background."""
-    success, message = start_workers(count)
+    try:
+        queue_names, queue_weights = _parse_queues(queues, weights)
+    except ValueError as e:
+        click.echo(f"❌ Error: {e}", err=True)
+        return
+    
+    from worker_manager import start_workers
+    success, message = start_workers(count, prefetch, concurrency, queue_names, queue_weights, add)
     click.echo(message)
 
 @worker.command()
 def stop():
     """Stop all running worker processes gracefully."""
+    from worker_manager import stop_workers
     success, message = stop_workers()
     click.echo(message)
 
+def _parse_queues(queues, weights):
+    queue_names = [validate_queue_name(q.strip()) for q in queues.split(",") if q.strip()]
+    queue_weights = None
+    if weights:
+        queue_weights = [float(w) for w in weights.split(",")]
+        if len(queue_weights) != len(queue_names) or any(w <= 0 for w in queue_weights):
+            raise ValueError("--weights needs one positive number per queue in --queues.")
+    return queue_names, queue_weights
+
+
+# --- Supervisor Commands ---
+
+@cli.group()
+def supervisor():
+    """Run an autoscaling, self-healing worker pool."""
+    pass
+
+@supervisor.command(name="start")
+@click.option('--prefetch', default=None, type=click.IntRange(min=1), help="Jobs each worker claims per round trip (defaults to config 'prefetch').")
+@click.option('--concurrency', default=1, type=click.IntRange(min=1), help="Jobs each worker runs at the same time.")
+@click.option('--queues', default=DEFAULT_QUEUE, help="Comma-separated queues the pool serves (e.g. fast,batch).")
+@click.option('--weights', default=None, help="Comma-separated weights matching --queues (e.g. 3,1).")
+def supervisor_start(prefetch, concurrency, queues, weights):
+    """
+    Start the supervisor in the background. It keeps between
+    supervisor_min_workers and supervisor_max_workers workers running,
+    scaling on backlog and wait time, and restarts crashed workers.
+    """
+    try:
+        queue_names, queue_weights = _parse_queues(queues, weights)
+    except ValueError as e:
+        click.echo(f"❌ Error: {e}", err=True)
+        return
+    
+    from worker_manager import start_supervisor
+    success, message = start_supervisor(prefetch, concurrency, queue_names, queue_weights)
+    click.echo(message)
+
+@supervisor.command(name="stop")
+def supervisor_stop():
+    """Stop the supervisor and its workers gracefully."""
+    from worker_manager import stop_supervisor
+    success, message = stop_supervisor()
+    click.echo(message)
+
 
-# --- Status Command (Unchanged) ---
+# --- Status Command ---
+
+def _print_status(store, history, exact):
+    # Live counters cost one read; --exact recounts (and resyncs) them.
+    counts = store.counts(exact)
+    
+    click.echo("--- Job Queue Status ---")
+    click.echo(f"Waiting:    {counts['waiting']}")
+    click.echo(f"Pending:    {counts['pending']}")
+    click.echo(f"Processing: {counts['processing']}")
+    click.echo(f"Completed:  {counts['completed']}")
+    click.echo(f"Dead (DLQ): {counts['dead']}")
+    queues = counts.get("queues", {})
+    if len(queues) > 1 or any(queue != DEFAULT_QUEUE for queue in queues):
+        click.echo("\n--- Queues ---")
+        for queue in sorted(queues):
+            c = queues[queue]
+            click.echo(f"{queue}: waiting {c['waiting']}, pending {c['pending']}, processing {c['processing']}, completed {c['completed']}, dead {c['dead']}")
+    if history and store.name == "mongo":
+        from db import HISTORY_COLLECTION
+        archived = store.db[HISTORY_COLLECTION].estimated_document_count()
+        click.echo(f"Archived:   {archived}")
+    click.echo(f"Reclaimed leases: {store.reclaimed()}")
+    
+    click.echo("\n--- Worker Status ---")
+    if os.path.exists(".queuectl.pids"):
+        try:
+            with open(".queuectl.pids", 'r') as f:
+                pids = f.read().splitlines()
+            click.echo(f"Running: {len(pids)} worker(s)")
+            for pid in pids:
+                click.echo(f"  - PID: {pid}")
+        except Exception:
+            click.echo("Error reading PID file.")
+    else:
+        click.echo("Stopped")
+    
+    state = None
+    if store.name == "mongo":
+        from supervisor import read_supervisor
+        state = read_supervisor(store.db)
+    if state and state.get("pid"):
+        click.echo("\n--- Supervisor ---")
+        click.echo(f"PID: {state['pid']} (last report {_format_value(state.get('updated_at'))})")
+        click.echo(f"Workers: {len(state.get('workers', []))} running, target {state.get('target')}, {state.get('restarts_waiting', 0)} waiting to restart")
+        click.echo(f"Backlog: {state.get('pending', 0)} pending, oldest waiting {state.get('oldest_wait', 0):.0f}s")
+        for decision in state.get("decisions", [])[-5:]:
+            click.echo(f"  [{_format_value(decision['at'])}] {decision['message']}")
 
 @cli.command()
-def status():
+@click.option('--history', is_flag=True, help="Also count archived jobs in the history collection.")
+@click.option('--exact', is_flag=True, help="Recount every state from the collections (and resync the live counters).")
+@click.option('--watch', 'interval', default=0, type=click.FloatRange(min=0), help="Refresh every N seconds until interrupted.")
+def status(history, exact, interval):
     """Show summary of all job states & active workers."""
     try:
-        db, jobs_collection, dlq_collection = get_db()
-        if db is None:
-            click.echo("❌ Error: Could not connect to DB.", err=True)
+        store = _open_store()
+        if store is None:
             return
 
-        pending = jobs_collection.count_documents({"state": "pending"})
-        processing = jobs_collection.count_documents({"state": "processing"})
-        completed = jobs_collection.count_documents({"state": "completed"})
-        dead = dlq_collection.count_documents({})
-        
-        click.echo("--- Job Queue Status ---")
-        click.echo(f"Pending:    {pending}")
-        click.echo(f"Processing: {processing}")
-        click.echo(f"Completed:  {completed}")
-        click.echo(f"Dead (DLQ): {dead}")
-        
-        click.echo("\n--- Worker Status ---")
-        if os.path.exists(".queuectl.pids"):
-            try:
-                with open(".queuectl.pids", 'r') as f:
-                    pids = f.read().splitlines()
-                click.echo(f"Running: {len(pids)} worker(s)")
-                for pid in pids:
-                    click.echo(f"  - PID: {pid}")
-            except Exception:
-                click.echo("Error reading PID file.")
-        else:
-            click.echo("Stopped")
+        _print_status(store, history, exact)
+        while interval:
+            time.sleep(interval)
+            click.clear()
+            _print_status(store, history, False)
             
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         click.echo(f"❌ Error getting status: {e}", err=True)
 
 
-# --- List Command (Unchanged) ---
+# --- List Command ---
+
+# Shared by 'list' and 'dlq list'
+def listing_options(f):
+    f = click.option('--after', default=None, help="Cursor printed at the end of the previous page.")(f)
+    f = click.option('--limit', default=50, type=click.IntRange(min=0), help="Rows per page (0 = everything).")(f)
+    f = click.option('--fields', default=None, help=f"Comma-separated fields to show (default: {','.join(DEFAULT_FIELDS)}).")(f)
+    f = click.option('--format', 'fmt', type=click.Choice(['table', 'jsonl', 'csv'], case_sensitive=False), default='table', help="Output format.")(f)
+    return f
+
+def _format_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+def _echo_jobs(docs, fmt, fields, sort_field, limit, render_row):
+    """
+    Write rows as they arrive from the cursor, then the next-page cursor.
+    For jsonl/csv only data goes to stdout, so the output can be piped.
+    """
+    fmt = fmt.lower()
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+
+    count = 0
+    last = None
+    for doc in docs:
+        count += 1
+        last = doc
+        if fmt == "jsonl":
+            click.echo(json.dumps({field: _format_value(doc.get(field)) for field in fields}, default=str))
+        elif fmt == "csv":
+            writer.writerow([_format_value(doc.get(field, "")) for field in fields])
+            click.echo(buffer.getvalue(), nl=False)
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            render_row(doc)
+
+    if fmt == "csv" and count == 0:
+        click.echo(buffer.getvalue(), nl=False)
+    if limit and count == limit:
+        click.echo(f"Next page: --after {encode_cursor(last, sort_field)}", err=(fmt != "table"))
+    return count
+
+def _echo_fields(job, fields):
+    """Table layout for a custom --fields selection."""
+    click.echo(f"- ID: {job.get('id')}")
+    for field in fields:
+        if field != "id":
+            click.echo(f"  {field}: {_format_value(job.get(field))}")
+
+def _parse_fields(fields):
+    if not fields:
+        return DEFAULT_FIELDS
+    return [field.strip() for field in fields.split(",") if field.strip()]
 
 @cli.command()
-@click.option('--state', type=click.Choice(['pending', 'processing', 'completed'], case_sensitive=False), help="Filter jobs by state.")
-def list(state):
+@click.option('--state', type=click.Choice(['waiting', 'pending', 'processing', 'completed'], case_sensitive=False), help="Filter jobs by state.")
+@click.option('--history', is_flag=True, help="List archived (completed) jobs from the history collection instead.")
+@click.option('--queue', default=None, help="Only jobs on this queue.")
+@listing_options
+def list(state, history, queue, after, limit, fields, fmt):
     """List jobs, optionally filtered by state."""
     try:
-        db, jobs_collection, _ = get_db()
-        if db is None:
-            click.echo("❌ Error: Could not connect to DB.", err=True)
+        store = _open_store()
+        if store is None:
+            return
+        if history and not _require_mongo(store, "--history"):
             return
 
-        query = {}
-        if state:
-            query = {"state": state}
-            click.echo(f"--- Showing '{state}' jobs ---")
+        table = fmt.lower() == "table"
+        sort_field = "created_at"
+        if history:
+            sort_field = "archived_at"
+            header = "--- Showing archived jobs ---"
+        elif state:
+            header = f"--- Showing '{state}' jobs ---"
         else:
-            click.echo("--- Showing all jobs ---")
+            header = "--- Showing all jobs ---"
+        if queue:
+            header = header.replace(" ---", f" in queue '{queue}' ---", 1)
+        if table:
+            click.echo(header)
 
-        for job in jobs_collection.find(query).sort("created_at", -1).limit(50):
+        fields = _parse_fields(fields)
+        custom = fields != DEFAULT_FIELDS
+
+        def render_row(job):
+            if custom:
+                _echo_fields(job, fields)
+                return
             click.echo(f"- ID: {job['id']}")
             click.echo(f"  Cmd: {job['command']}")
             click.echo(f"  State: {job['state']} (Attempts: {job['attempts']})")
             click.echo(f"  Updated: {job['updated_at']}")
             if job.get('last_error'):
-                click.echo(f"  Error: {job['last_error'][:100]}...")
+                click.echo(f"  Error: {job['last_error']}...")
+
+        if history:
+            from db import HISTORY_COLLECTION
+            from listing import stream_jobs
+            query = {"queue": queue} if queue else {}
+            docs = stream_jobs(store.db[HISTORY_COLLECTION], query, sort_field, after, limit, fields, error_chars=100)
+        else:
+            docs = store.list_jobs(state, queue, after, limit, fields, error_chars=100)
+        _echo_jobs(docs, fmt, fields, sort_field, limit, render_row)
+    except ValueError as e:
+        click.echo(f"❌ Error: {e}", err=True)
     except Exception as e:
         click.echo(f"❌ Error listing jobs: {e}", err=True)
 
@@ -174,61 +748,412 @@ def dlq():
     pass
 
 @dlq.command(name="list")
-def dlq_list():
+@listing_options
+def dlq_list(after, limit, fields, fmt):
     """List all jobs in the DLQ."""
     try:
-        db, _, dlq_collection = get_db()
-        if db is None:
-            click.echo("❌ Error: Could not connect to DB.", err=True)
+        store = _open_store()
+        if store is None:
             return
 
-        click.echo("--- Jobs in Dead Letter Queue (DLQ) ---")
-        count = dlq_collection.count_documents({})
-        if count == 0:
-            click.echo("DLQ is empty.")
-            return
+        table = fmt.lower() == "table"
+        if table:
+            click.echo("--- Jobs in Dead Letter Queue (DLQ) ---")
+
+        fields = _parse_fields(fields)
+        custom = fields != DEFAULT_FIELDS
 
-        for job in dlq_collection.find().sort("updated_at", -1).limit(50):
+        def render_row(job):
+            if custom:
+                _echo_fields(job, fields)
+                return
             click.echo(f"- ID: {job['id']}")
             click.echo(f"  Cmd: {job['command']}")
             click.echo(f"  Last Error: {job.get('last_error', 'N/A')}")
             click.echo(f"  Failed At: {job['updated_at']}")
+
+        docs = store.list_dlq(after, limit, fields, error_chars=1000)
+        shown = _echo_jobs(docs, fmt, fields, "updated_at", limit, render_row)
+        if shown == 0 and table and not after:
+            click.echo("DLQ is empty.")
+    except ValueError as e:
+        click.echo(f"❌ Error: {e}", err=True)
     except Exception as e:
         click.echo(f"❌ Error listing DLQ: {e}", err=True)
 
 @dlq.command()
-@click.argument('job_id')
-def retry(job_id):
-    """Move a job from the DLQ back to the 'pending' queue."""
+@click.argument('job_id', required=False)
+@click.option('--all', 'replay_all', is_flag=True, help="Replay every job in the DLQ.")
+@click.option('--error-contains', default=None, help="Only jobs whose last error contains this text.")
+@click.option('--id-pattern', default=None, help="Only jobs whose ID matches this regular expression.")
+@click.option('--since', type=click.DateTime(), default=None, help="Only jobs that failed at or after this time (UTC).")
+@click.option('--until', type=click.DateTime(), default=None, help="Only jobs that failed at or before this time (UTC).")
+@click.option('--failure-class', type=click.Choice(FAILURE_CLASSES), default=None, help="Only jobs that failed this way.")
+@click.option('--chunk-size', default=500, type=click.IntRange(min=1), help="Jobs moved per bulk write.")
+@click.option('--rate', default=0, type=click.FloatRange(min=0), help="Max jobs replayed per second (0 = no limit).")
+def retry(job_id, replay_all, error_contains, id_pattern, since, until, failure_class, chunk_size, rate):
+    """
+    Move jobs from the DLQ back to the 'pending' queue.
+    
+    Give a JOB_ID, one or more filters, or --all.
+    
+    Example:
+    dlq retry --error-contains "Connection refused" --since 2025-01-01 --rate 200
+    """
     try:
-        db, jobs_collection, dlq_collection = get_db()
-        if db is None:
-            click.echo("❌ Error: Could not connect to DB.", err=True)
+        store = _open_store()
+        if store is None:
             return
-            
-        job = dlq_collection.find_one({"id": job_id})
-        
-        if not job:
-            click.echo(f"❌ Job {job_id} not found in DLQ.", err=True)
+
+        filtered = error_contains or id_pattern or since or until or failure_class
+        if not (job_id or filtered or replay_all):
+            click.echo("❌ Error: Give a JOB_ID, a filter (--error-contains, --id-pattern, --since, --until, --failure-class) or --all.", err=True)
             return
 
-        job["state"] = "pending"
-        job["attempts"] = 0
-        job["updated_at"] = datetime.datetime.utcnow()
-        job["run_at"] = datetime.datetime.utcnow()
-        if "last_error" in job:
-            del job["last_error"]
-        
-        jobs_collection.insert_one(job)
-        dlq_collection.delete_one({"id": job_id})
-        
-        click.echo(f"✅ Job {job_id} moved from DLQ to 'pending' queue.")
+        filters = {"job_id": job_id, "error_contains": error_contains, "id_pattern": id_pattern,
+                   "since": since, "until": until, "failure_class": failure_class}
+        total = store.count_dlq(filters)
+        if total == 0:
+            if job_id:
+                click.echo(f"❌ Job {job_id} not found in DLQ.", err=True)
+            else:
+                click.echo("🤔 No DLQ jobs match.")
+            return
+
+        def on_conflict(conflict_id):
+            click.echo(f"❌ Error: Job {conflict_id} already exists in the main 'jobs' queue.", err=True)
+
+        def on_progress(moved, skipped):
+            if not job_id:
+                click.echo(f"   ... {moved + skipped}/{total} processed ({moved} replayed)")
+
+        moved, skipped = store.replay(filters, chunk_size, rate, on_progress, on_conflict)
+
+        if job_id:
+            if moved:
+                click.echo(f"✅ Job {job_id} moved from DLQ to 'pending' queue.")
+        else:
+            click.echo(f"✅ Replayed {moved} job(s) from DLQ to 'pending' queue. Skipped {skipped}.")
         
     except Exception as e:
-        if "E11000" in str(e):
-             click.echo(f"❌ Error: Job {job_id} already exists in the main 'jobs' queue.", err=True)
+        click.echo(f"❌ Error retrying job: {e}", err=True)
+
+
+# --- Logs Command ---
+
+@cli.command()
+@click.argument('job_id')
+@click.option('--stderr', 'show_stderr', is_flag=True, help="Show stderr instead of stdout.")
+@click.option('--follow', '-f', is_flag=True, help="Keep printing new output until the job finishes.")
+def logs(job_id, show_stderr, follow):
+    """Show a job's output, streamed from its spool file."""
+    try:
+        store = _open_store()
+        if store is None:
+            return
+
+        job = store.find(job_id)
+        if job is None:
+            click.echo(f"❌ Error: Job {job_id} not found.", err=True)
+            return
+
+        path = spool_paths(job_id)[1 if show_stderr else 0]
+        if not os.path.exists(path) and job["state"] not in ("waiting", "pending", "processing"):
+            # Spool files live on the worker's host: fall back to the stored excerpt
+            output = job.get("output") or {}
+            text = job.get("last_error") if show_stderr else output.get("stdout")
+            click.echo(text or "(no output recorded)")
+            return
+
+        last_check = [0.0, True]
+        def keep_going():
+            if not follow:
+                return False
+            # Poll the job's state at most once a second
+            if time.monotonic() - last_check[0] >= 1:
+                current = store.find(job_id)
+                last_check[:] = [time.monotonic(), bool(current) and current["state"] in ("waiting", "pending", "processing")]
+            return last_check[1]
+
+        follow_output(path, lambda text: click.echo(text, nl=False), keep_going)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        click.echo(f"❌ Error reading logs: {e}", err=True)
+
+
+# --- Lease Reaper Command ---
+
+@cli.command()
+@click.option('--loop', 'interval', default=0, type=click.FloatRange(min=0), help="Keep reaping every N seconds until interrupted (default: run once).")
+def reap(interval):
+    """Return jobs with expired leases to the 'pending' queue."""
+    try:
+        store = _open_store()
+        if store is None:
+            return
+
+        while True:
+            reclaimed = store.reap_expired()
+            click.echo(f"♻️ Reclaimed {reclaimed} job(s) with expired leases.")
+            if not interval:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        click.echo("Reaper stopped.")
+    except Exception as e:
+        click.echo(f"❌ Error reaping leases: {e}", err=True)
+
+
+# --- Claim Plan Debug Command ---
+
+def _plan_stages(plan):
+    """
+    Flatten a (classic or SBE) explain plan tree into (stage, index name)
+    pairs, top first. Stages with several inputs (OR, SORT_MERGE) are
+    walked branch by branch.
+    """
+    stages = []
+    pending = [plan]
+    while pending:
+        plan = pending.pop()
+        if not plan:
+            continue
+        plan = plan.get("queryPlan", plan)
+        stages.append((plan.get("stage", "?"), plan.get("indexName")))
+        children = [plan.get("inputStage")] + plan.get("inputStages", [])
+        pending.extend(reversed(children))
+    return stages
+
+@cli.command(name="explain-claim")
+@click.option('--queue', default=DEFAULT_QUEUE, help="Queue whose claim query to explain.")
+def explain_claim(queue):
+    """Show how MongoDB executes the worker claim query."""
+    try:
+        store = _open_store()
+        if store is None or not _require_mongo(store, "explain-claim"):
+            return
+
+        from db import ensure_indexes, CLAIM_SORT
+        ensure_indexes(force=True)
+        query = {"queue": queue, "state": "pending", "run_at": {"$lte": datetime.datetime.utcnow()}}
+        explain = store.jobs.find(query).sort(CLAIM_SORT).limit(1).explain()
+
+        stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+        stats = explain.get("executionStats", {})
+
+        click.echo("--- Claim Query Plan ---")
+        click.echo(f"Plan:          {' <- '.join(f'{stage} ({index})' if index else stage for stage, index in stages)}")
+        click.echo(f"Keys examined: {stats.get('totalKeysExamined', 'N/A')}")
+        click.echo(f"Docs examined: {stats.get('totalDocsExamined', 'N/A')}")
+        click.echo(f"Returned:      {stats.get('nReturned', 'N/A')}")
+        click.echo(f"Time (ms):     {stats.get('executionTimeMillis', 'N/A')}")
+
+        kinds = {stage for stage, _ in stages}
+        # SORT_MERGE merges already sorted index ranges: it doesn't block
+        if "SORT" in kinds:
+            click.echo("⚠️ Blocking in-memory SORT in the plan. The claim index is missing or still building.")
+        elif "COLLSCAN" in kinds:
+            click.echo("⚠️ The claim query is not using an index.")
+        else:
+            click.echo("✅ Claim query is fully index-backed (no in-memory sort).")
+    except Exception as e:
+        click.echo(f"❌ Error explaining claim query: {e}", err=True)
+
+
+# --- Benchmark Command ---
+
+def _parse_counts(value):
+    try:
+        counts = [int(part) for part in value.split(",") if part.strip()]
+    except ValueError:
+        raise click.BadParameter(f"'{value}' is not a comma-separated list of numbers.")
+    if not counts or min(counts) < 1:
+        raise click.BadParameter(f"'{value}' needs at least one number, all 1 or more.")
+    return counts
+
+def _echo_scenario(result):
+    start = result["enqueue_to_start_ms"] or {}
+    total = result["end_to_end_ms"] or {}
+    click.echo(
+        f"{result['workers']:>7} {result['concurrency']:>11} {result['enqueue_rate'] or 0:>12,.0f} {result['claims_per_second'] or 0:>10,.0f} "
+        f"{start.get('p50', 0):>9.1f} {start.get('p95', 0):>9.1f} {start.get('p99', 0):>9.1f} "
+        f"{total.get('p50', 0):>9.1f} {total.get('p99', 0):>9.1f} {result['db_ops_per_job'] if result['db_ops_per_job'] is not None else 'n/a':>8}"
+        + ("  ⚠️ timed out" if result["timed_out"] else "")
+    )
+
+@cli.command()
+@click.option('--jobs', default=1000, type=click.IntRange(min=1), help="Jobs per scenario.")
+@click.option('--workers', 'worker_counts', default="1,2,4", help="Comma-separated worker counts to try.")
+@click.option('--concurrency', 'concurrencies', default="1", help="Comma-separated per-worker concurrency settings to try.")
+@click.option('--prefetch', default=None, type=click.IntRange(min=1), help="Jobs each worker claims per round trip (defaults to config 'prefetch').")
+@click.option('--job', type=click.Choice(['noop', 'sleep']), default='noop', help="What each job runs: 'true', or 'sleep --sleep-ms'.")
+@click.option('--sleep-ms', default=10, type=click.IntRange(min=0), help="Duration of each 'sleep' job.")
+@click.option('--backend', type=click.Choice(BACKENDS), default=None, help="Store to benchmark (defaults to config 'backend').")
+@click.option('--sqlite-path', default=None, help="Database file for a sqlite bench (default: a temporary file).")
+@click.option('--warmup', default=1.0, type=click.FloatRange(min=0), help="Seconds the workers get to start before jobs are enqueued.")
+@click.option('--timeout', default=300, type=click.FloatRange(min=1), help="Give up on a scenario after this many seconds.")
+@click.option('--output', default="bench.json", help="Where to write the JSON report ('-' for stdout).")
+def bench(jobs, worker_counts, concurrencies, prefetch, job, sleep_ms, backend, sqlite_path, warmup, timeout, output):
+    """
+    Measure enqueue rate, claim rate and latency under different worker settings.
+    
+    Every combination of --workers and --concurrency runs on its own
+    throwaway queue, so running workers and real jobs are never involved.
+    
+    Example:
+    bench --jobs 5000 --workers 1,2,4,8 --concurrency 1,4 --output bench.json
+    """
+    try:
+        worker_counts = _parse_counts(worker_counts)
+        concurrencies = _parse_counts(concurrencies)
+        config = dict(get_config())
+        if backend:
+            config["backend"] = backend
+        if prefetch is None:
+            prefetch = config["prefetch"]
+
+        to_stdout = output == "-"
+        def echo(text):
+            click.echo(text, err=to_stdout)
+
+        echo(f"--- Benchmark: {jobs} '{job}' job(s) per scenario on {config['backend']} ---")
+        echo(f"{'workers':>7} {'concurrency':>11} {'enqueue/s':>12} {'claims/s':>10} {'start p50':>9} {'p95':>9} {'p99':>9} {'e2e p50':>9} {'p99':>9} {'ops/job':>8}")
+        on_result = (lambda result: None) if to_stdout else _echo_scenario
+        from bench import run_bench, write_report
+        report = run_bench(config, jobs, worker_counts, concurrencies, prefetch, job, sleep_ms / 1000, warmup, timeout, sqlite_path, on_result)
+
+        if to_stdout:
+            click.echo(json.dumps(report, indent=2))
         else:
-            click.echo(f"❌ Error retrying job: {e}", err=True)
+            write_report(report, output)
+            click.echo(f"✅ Report written to {output}. Latencies are in milliseconds.")
+    except click.BadParameter as e:
+        click.echo(f"❌ Error: {e.message}", err=True)
+    except KeyboardInterrupt:
+        click.echo("Benchmark interrupted.", err=True)
+    except Exception as e:
+        click.echo(f"❌ Error running benchmark: {e}", err=True)
+
+
+# --- Metrics Command Group ---
+
+@cli.group()
+def metrics():
+    """Export worker and supervisor metrics in Prometheus format."""
+    pass
+
+@metrics.command(name="show")
+def metrics_show():
+    """Print the metrics of the whole worker pool."""
+    stale_seconds = metrics_registry.stale_after(get_config())
+    click.echo(metrics_registry.render(metrics_registry.aggregate(stale_seconds=stale_seconds)), nl=False)
+
+@metrics.command(name="serve")
+@click.option('--host', default="127.0.0.1", help="Address to listen on.")
+@click.option('--port', default=9464, type=click.IntRange(min=1, max=65535), help="Port to listen on.")
+def metrics_serve(host, port):
+    """Serve the pool's metrics at http://HOST:PORT/metrics for Prometheus."""
+    click.echo(f"📈 Serving metrics on http://{host}:{port}/metrics (Ctrl+C to stop)")
+    try:
+        metrics_registry.serve(host, port, stale_seconds=metrics_registry.stale_after(get_config()))
+    except KeyboardInterrupt:
+        click.echo("Metrics server stopped.")
+    except OSError as e:
+        click.echo(f"❌ Error starting metrics server: {e}", err=True)
+
+@metrics.command(name="export")
+@click.argument('path')
+def metrics_export(path):
+    """
+    Write the pool's metrics to PATH, e.g. for node_exporter's textfile collector.
+    
+    Example:
+    metrics export /var/lib/node_exporter/textfile/queuectl.prom
+    """
+    try:
+        metrics_registry.export_textfile(path, stale_seconds=metrics_registry.stale_after(get_config()))
+        click.echo(f"✅ Metrics written to {path}")
+    except Exception as e:
+        click.echo(f"❌ Error exporting metrics: {e}", err=True)
+
+@metrics.command(name="reset")
+def metrics_reset():
+    """
+    Delete all metric snapshots, dropping the totals of stopped workers.
+    Running workers republish theirs within 'metrics_interval' seconds.
+    """
+    removed = 0
+    for path in glob.glob(os.path.join(metrics_registry.METRICS_DIR, "*.json")):
+        os.remove(path)
+        removed += 1
+    click.echo(f"✅ Removed {removed} snapshot(s).")
+
+
+# --- History Command Group ---
+
+@cli.group()
+def history():
+    """Manage the archive of completed jobs."""
+    pass
+
+@history.command(name="compact")
+def history_compact():
+    """Archive completed jobs now and enforce history retention."""
+    try:
+        store = _open_store()
+        if store is None or not _require_mongo(store, "History"):
+            return
+
+        from db import ensure_indexes
+        from archive import compact
+        ensure_indexes()
+        archived, trimmed = compact(store.db, get_config())
+        click.echo(f"✅ Archived {archived} completed job(s). Trimmed {trimmed} old history entr{'y' if trimmed == 1 else 'ies'}.")
+    except Exception as e:
+        click.echo(f"❌ Error compacting history: {e}", err=True)
+
+
+# --- Daemon Command Group ---
+
+@cli.group(name="daemon")
+def daemon_group():
+    """Keep a warm process that runs one-shot CLI commands quickly."""
+    pass
+
+@daemon_group.command(name="start")
+def daemon_start():
+    """
+    Start the control daemon in the background. While it runs, commands
+    like enqueue, status, list, dlq and config are sent to it over a Unix
+    socket (.queuectl.sock) instead of starting up and connecting anew.
+    Set QUEUECTL_NO_DAEMON=1 to bypass it.
+    """
+    success, message = daemon.start_daemon(os.path.abspath(__file__))
+    click.echo(message)
+
+@daemon_group.command(name="stop")
+def daemon_stop():
+    """Stop the control daemon."""
+    success, message = daemon.stop_daemon()
+    click.echo(message)
+
+@daemon_group.command(name="status")
+def daemon_status():
+    """Show whether the control daemon is running."""
+    state = daemon.daemon_status()
+    if state is None:
+        click.echo("Stopped")
+    else:
+        click.echo(f"Running: PID {state['pid']}, up {state['uptime']:.0f}s, {state['served']} command(s) served.")
+
+@daemon_group.command(name="run")
+def daemon_run():
+    """Run the control daemon in the foreground (what 'daemon start' launches)."""
+    try:
+        daemon.serve(cli)
+    except Exception as e:
+        click.echo(f"❌ Error running daemon: {e}", err=True)
 
 
 # --- Config Command Group (Unchanged) ---
@@ -248,6 +1173,17 @@ def config_set(key, value):
     except (KeyError, ValueError) as e:
         click.echo(f"❌ Error: {e}", err=True)
 
+@config.command(name="set-queue")
+@click.argument('queue')
+@click.argument('key')
+@click.argument('value')
+def config_set_queue(queue, key, value):
+    """Override a config value for one queue (max_retries, backoff_base)."""
+    try:
+        set_queue_config_value(validate_queue_name(queue), key, value)
+    except (KeyError, ValueError) as e:
+        click.echo(f"❌ Error: {e}", err=True)
+
 @config.command(name="show")
 def config_show():
     """Show the current configuration."""
@@ -267,8 +1203,12 @@ def main_loop():
             
             if command_line.strip() == "exit":
                 click.echo("Attempting graceful shutdown of workers...")
+                from worker_manager import stop_workers, stop_supervisor
                 success, message = stop_workers()
                 click.echo(message)
+                if os.path.exists(".queuectl.supervisor.pid"):
+                    success, message = stop_supervisor()
+                    click.echo(message)
                 click.echo("Exiting.")
                 break
                 
@@ -0,0 +1,134 @@
+# retry.py
+import random
+import re
+
+STRATEGIES = ("exponential", "linear", "fixed")
+JITTERS = ("none", "full", "decorrelated")
+ACTIONS = ("retry", "dead", "backoff")
+POLICY_KEYS = ("strategy", "base", "delay", "max_delay", "jitter", "rules")
+RULE_KEYS = ("exit_codes", "stderr", "failure_class", "action", "multiplier")
+
+# What a job gets when neither it, its queue nor the global config says
+# otherwise. 'base' comes from the (queue's) 'backoff_base'.
+DEFAULT_POLICY = {
+    "strategy": "exponential", # base ** attempts
+    "delay": 1.0,              # Seconds: linear step, fixed delay, decorrelated floor
+    "max_delay": 3600.0,       # No single wait is longer than this
+    "rules": []
+}
+# Jitter when the policy doesn't name one: exponential backoff spreads the
+# retries of jobs that failed together; linear and fixed waits are exact
+DEFAULT_JITTER = {"exponential": "full"}
+
+def validate_policy(policy):
+    """
+    Check a retry policy (a dict, e.g. parsed from JSON) and return it.
+    Raises ValueError naming the first thing that is wrong.
+    """
+    if not isinstance(policy, dict):
+        raise ValueError("A retry policy must be a JSON object.")
+    unknown = [key for key in policy if key not in POLICY_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown retry policy key(s): {', '.join(unknown)}. Valid keys are: {list(POLICY_KEYS)}")
+    if policy.get("strategy", "exponential") not in STRATEGIES:
+        raise ValueError(f"Invalid retry strategy: {policy['strategy']}. Valid strategies are: {list(STRATEGIES)}")
+    if policy.get("jitter", "none") not in JITTERS:
+        raise ValueError(f"Invalid jitter: {policy['jitter']}. Valid values are: {list(JITTERS)}")
+    for key in ("base", "delay", "max_delay"):
+        if key in policy and (not _is_number(policy[key]) or policy[key] < 0):
+            raise ValueError(f"Retry policy '{key}' must be a number >= 0.")
+    rules = policy.get("rules", [])
+    if not isinstance(rules, list):
+        raise ValueError("Retry policy 'rules' must be a list.")
+    for rule in rules:
+        _validate_rule(rule)
+    return policy
+
+def _validate_rule(rule):
+    if not isinstance(rule, dict):
+        raise ValueError("Each retry rule must be a JSON object.")
+    unknown = [key for key in rule if key not in RULE_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown retry rule key(s): {', '.join(unknown)}. Valid keys are: {list(RULE_KEYS)}")
+    if rule.get("action") not in ACTIONS:
+        raise ValueError(f"Each retry rule needs an 'action': one of {list(ACTIONS)}.")
+    if not any(key in rule for key in ("exit_codes", "stderr", "failure_class")):
+        raise ValueError("A retry rule must match on 'exit_codes', 'stderr' or 'failure_class'.")
+    exit_codes = rule.get("exit_codes", [])
+    if not isinstance(exit_codes, list) or not all(isinstance(code, int) and not isinstance(code, bool) for code in exit_codes):
+        raise ValueError("Retry rule 'exit_codes' must be a list of integers.")
+    if "stderr" in rule:
+        if not isinstance(rule["stderr"], str):
+            raise ValueError("Retry rule 'stderr' must be a regular expression string.")
+        try:
+            re.compile(rule["stderr"])
+        except re.error as e:
+            raise ValueError(f"Invalid retry rule 'stderr' pattern: {e}")
+    classes = rule.get("failure_class", [])
+    if not all(isinstance(name, str) for name in (classes if isinstance(classes, list) else [classes])):
+        raise ValueError("Retry rule 'failure_class' must be a string or a list of strings.")
+    multiplier = rule.get("multiplier", 10)
+    if not _is_number(multiplier) or multiplier < 1:
+        raise ValueError("Retry rule 'multiplier' must be a number >= 1.")
+
+def _is_number(value):
+    # JSON true/false arrive as bool, which Python counts as an int
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def resolve_policy(config, job):
+    """
+    The policy for `job`: the defaults, overridden by the config's (already
+    queue-merged) 'retry_policy', overridden by the job's own. A more
+    specific 'rules' list replaces a less specific one.
+    """
+    policy = dict(DEFAULT_POLICY, base=config.get("backoff_base", 3))
+    policy.update(config.get("retry_policy") or {})
+    policy.update(job.get("retry_policy") or {})
+    return policy
+
+def _matches(rule, error_message, exit_code, failure_class):
+    if "exit_codes" in rule and exit_code not in rule["exit_codes"]:
+        return False
+    if "stderr" in rule and not re.search(rule["stderr"], error_message or ""):
+        return False
+    classes = rule.get("failure_class")
+    if classes is not None and failure_class not in (classes if isinstance(classes, list) else [classes]):
+        return False
+    return True
+
+def matching_rule(policy, error_message, exit_code=None, failure_class=None):
+    """The first rule whose conditions all hold for this failure, or None."""
+    for rule in policy.get("rules", []):
+        if _matches(rule, error_message, exit_code, failure_class):
+            return rule
+    return None
+
+def next_delay(policy, attempts, previous_delay=None, rule=None):
+    """
+    Seconds to wait before attempt `attempts` + 1. Full jitter draws from
+    [0, delay]; decorrelated jitter from [delay, 3 * previous delay]; a
+    policy without 'jitter' gets its strategy's DEFAULT_JITTER. The
+    result is capped at 'max_delay'; a 'backoff' rule's multiplier is
+    applied after the cap, so it really does wait longer.
+    """
+    strategy = policy.get("strategy", "exponential")
+    step = policy.get("delay", 1.0)
+    cap = policy.get("max_delay") or float("inf")
+    if strategy == "fixed":
+        delay = step
+    elif strategy == "linear":
+        delay = step * attempts
+    else:
+        try:
+            delay = float(policy.get("base", 3)) ** attempts
+        except OverflowError:
+            delay = cap
+    jitter = policy.get("jitter") or DEFAULT_JITTER.get(strategy, "none")
+    if jitter == "full":
+        delay = random.uniform(0, min(delay, cap))
+    elif jitter == "decorrelated":
+        delay = random.uniform(step, max(step, (previous_delay or step) * 3))
+    delay = min(delay, cap)
+    if rule is not None and rule["action"] == "backoff":
+        delay *= rule.get("multiplier", 10)
+    return round(delay, 3)
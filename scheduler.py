@@ -0,0 +1,146 @@
+# scheduler.py
+import datetime
+import heapq
+import os
+import socket
+import time
+from cron import CronExpression
+from jobs import build_job, DEFAULT_QUEUE, KIND_SHELL
+
+LEADER_LEASE = "scheduler_leader" # Only the holder of this lease enqueues scheduled jobs
+MAX_SLEEP = 1.0 # Longest single sleep, so a stop request is noticed quickly
+
+def new_schedule(name, cron, command, now=None, queue=DEFAULT_QUEUE, priority=0, kind=KIND_SHELL, args=None, limits=None):
+    """A schedule document; its first run is the next cron time after `now`."""
+    if now is None:
+        now = datetime.datetime.utcnow()
+    expression = CronExpression(cron)
+    return {
+        "name": name,
+        "cron": str(expression),
+        "command": command,
+        "queue": queue,
+        "priority": priority,
+        "kind": kind,
+        "args": args,
+        "limits": {key: value for key, value in (limits or {}).items() if value is not None},
+        "created_at": now,
+        "next_run": expression.next_after(now),
+        "last_run": None
+    }
+
+def schedule_job_id(schedule, run):
+    """
+    One id per (schedule, run time), so materializing the same run twice,
+    e.g. after a leader crashed between enqueue and advance, is rejected
+    as a duplicate instead of running the job twice.
+    """
+    return f"{schedule['name']}@{run:%Y%m%dT%H%M}"
+
+def build_schedule_job(schedule, run, config, now=None):
+    job = build_job(schedule_job_id(schedule, run), schedule["command"], config, now=now,
+                    priority=schedule.get("priority", 0), queue=schedule.get("queue") or DEFAULT_QUEUE,
+                    limits=schedule.get("limits"), kind=schedule.get("kind", KIND_SHELL), args=schedule.get("args"))
+    job["schedule"] = schedule["name"]
+    return job
+
+class Scheduler:
+    """
+    Materializes recurring jobs. Any number of schedulers may run; they
+    elect a leader through a store lease (renewed every third of
+    `scheduler_lease_seconds`) and only the leader enqueues. The leader
+    keeps a min-heap of next run times, sleeps until the earliest one and
+    enqueues everything due in one batch. Schedules are re-read every
+    `scheduler_refresh` seconds, so 'schedule add/remove' take effect
+    without a restart.
+
+    Runs missed while no scheduler was leading are not replayed one by
+    one: each schedule fires once, then continues from the current time.
+    """
+
+    def __init__(self, store, config, label="Scheduler"):
+        self.store = store
+        self.config = config
+        self.label = label
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.lease_seconds = config["scheduler_lease_seconds"]
+        self.refresh = config["scheduler_refresh"]
+        self.leader = None
+        self.heap = []
+        self.schedules = {}
+        self._renewed = float("-inf")
+        self._loaded = float("-inf")
+
+    def run(self, should_continue):
+        try:
+            while should_continue():
+                try:
+                    self._keep_lease()
+                    if self.leader:
+                        if time.monotonic() - self._loaded >= self.refresh:
+                            self.reload()
+                        self.fire_due(datetime.datetime.utcnow())
+                except Exception as e:
+                    print(f"{self.label}: ❌ Error: {e}")
+                self._sleep(should_continue)
+        finally:
+            if self.leader:
+                self.store.release_lease(LEADER_LEASE, self.owner)
+
+    def _keep_lease(self):
+        if time.monotonic() - self._renewed < self.lease_seconds / 3:
+            return
+        leader = self.store.acquire_lease(LEADER_LEASE, self.owner, self.lease_seconds)
+        self._renewed = time.monotonic()
+        if leader and not self.leader:
+            print(f"{self.label}: 👑 Leading as {self.owner}.")
+            self._loaded = float("-inf")
+        elif not leader and self.leader is not False:
+            print(f"{self.label}: 💤 Another scheduler is leading. Standing by.")
+            self.heap = []
+        self.leader = leader
+
+    def reload(self):
+        self.schedules = {schedule["name"]: schedule for schedule in self.store.list_schedules()}
+        self.heap = [(schedule["next_run"], name) for name, schedule in self.schedules.items()]
+        heapq.heapify(self.heap)
+        self._loaded = time.monotonic()
+
+    def fire_due(self, now):
+        """Enqueue every schedule due at `now` in one batch. Returns the jobs enqueued."""
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due.append(self.schedules[heapq.heappop(self.heap)[1]])
+        if not due:
+            return 0
+
+        jobs = [build_schedule_job(schedule, schedule["next_run"], self.config, now) for schedule in due]
+        inserted, errors = self.store.enqueue(jobs)
+        for index, duplicate, message in errors:
+            if not duplicate:
+                print(f"{self.label}: ❌ Could not enqueue '{jobs[index]['id']}': {message}")
+
+        for schedule in due:
+            fired_run = schedule["next_run"]
+            next_run = CronExpression(schedule["cron"]).next_after(max(fired_run, now))
+            # Fails if the schedule was removed meanwhile; the next reload drops it
+            if self.store.advance_schedule(schedule["name"], fired_run, next_run, now):
+                schedule["next_run"] = next_run
+                schedule["last_run"] = fired_run
+                heapq.heappush(self.heap, (next_run, schedule["name"]))
+        print(f"{self.label}: ⏰ Enqueued {inserted} scheduled job(s): {', '.join(job['id'] for job in jobs)}")
+        return inserted
+
+    def _seconds_to_wait(self):
+        elapsed = time.monotonic()
+        waits = [self.lease_seconds / 3 - (elapsed - self._renewed)]
+        if self.leader:
+            waits.append(self.refresh - (elapsed - self._loaded))
+            if self.heap:
+                waits.append((self.heap[0][0] - datetime.datetime.utcnow()).total_seconds())
+        return max(min(waits), 0)
+
+    def _sleep(self, should_continue):
+        deadline = time.monotonic() + self._seconds_to_wait()
+        while should_continue() and time.monotonic() < deadline:
+            time.sleep(min(MAX_SLEEP, max(deadline - time.monotonic(), 0)))
@@ -0,0 +1,1481 @@
+# storage.py
+import datetime
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from collections import Counter
+from pymongo import ReturnDocument, UpdateOne, UpdateMany
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from db import get_db, ensure_indexes, CLAIM_SORT, HISTORY_COLLECTION, STATS_COLLECTION, SCHEDULES_COLLECTION
+from config import get_config, BACKENDS
+from jobs import DEFAULT_QUEUE, queue_of, weighted_queue_order
+from limits import FAILURE_DEPENDENCY, FAILURE_LEASE
+from leases import lease_expiry, lease_error, renew_leases, reap_expired_leases, reclaimed_count
+from counters import STATES, bump_counts, bump_queue_counts, bump_counts_for_jobs, read_counts, recount
+from listing import stream_jobs, decode_cursor, DEFAULT_FIELDS
+from throttle import (take_permits, job_throttle, blocked_keys, acquire_permits, release_permits,
+                      reconcile_permits, PERMIT_ATTEMPTS, BLOCKED_CHECK_SECONDS)
+from dead_letter import move_to_dlq, build_replay_query, replay_from_dlq, _reset_for_replay
+from metrics import DLQ_MOVES
+from dedup import is_dedup_conflict, can_answer_from_cache, is_fresh, answer_from_cache, result_entry, cached_results, remember_result
+
+def get_store(config=None):
+    """
+    The job store selected by the 'backend' config key, or None if the
+    database can't be reached. Every process (and every worker) must open
+    its own store: connections are not shared across fork.
+    """
+    config = config or get_config()
+    backend = config.get("backend", "mongo")
+    result_cache_max = config.get("result_cache_max", 10000)
+    if backend == "sqlite":
+        return SQLiteStore(config["sqlite_path"], result_cache_max)
+    if backend != "mongo":
+        raise ValueError(f"Invalid backend: {backend}. Valid backends are: {BACKENDS}")
+    db, _, _ = get_db()
+    return MongoStore(db, result_cache_max) if db is not None else None
+
+def dependency_error(parent_id):
+    return f"Dependency '{parent_id}' failed."
+
+def _parents_by_child(jobs):
+    return {job["id"]: job["deps_pending"] for job in jobs if job.get("deps_pending")}
+
+def _throttled_counts(jobs):
+    """{concurrency_key: (jobs, rate_limit)} for the throttled jobs among `jobs`."""
+    counts = {}
+    for job in jobs:
+        throttle = job_throttle(job)
+        if throttle:
+            count, _ = counts.get(throttle[0], (0, None))
+            counts[throttle[0]] = (count + 1, throttle[2])
+    return counts
+
+CLAIM_PASSES = 3 # Claim queries per queue when throttled keys filled up mid-claim
+
+
+# --- MongoDB ---
+
+class MongoStore:
+    """
+    The job lifecycle on MongoDB: claim, complete, retry, DLQ moves,
+    counts and listing. Everything else (history, supervisor, change
+    streams) talks to `self.db` directly and only exists on this backend.
+    """
+
+    name = "mongo"
+
+    def __init__(self, db, result_cache_max=10000):
+        self.db = db
+        self.jobs = db["jobs"]
+        self.dlq = db["dlq"]
+        self.result_cache_max = result_cache_max
+        self._keys_seen = float("-inf")
+        self._local = threading.local()
+
+    def setup(self):
+        return ensure_indexes()
+
+    def enqueue(self, jobs):
+        """
+        Insert new jobs in one unordered batch. Returns (inserted, errors)
+        where errors is a list of (index, is_duplicate_id, message).
+
+        Jobs with a dedup key that recently succeeded are inserted as
+        'completed' with the cached output. Ones that collide with an
+        active job are not inserted and not errors either: they get
+        'folded_into' set to the active job's id.
+        """
+        self._answer_from_cache(jobs)
+        errors = []
+        try:
+            self.jobs.insert_many(jobs, ordered=False)
+        except BulkWriteError as e:
+            errors = [(error["index"], error.get("code") == 11000, error.get("errmsg"))
+                      for error in e.details.get("writeErrors", [])]
+        errors = self._fold_duplicates(jobs, errors)
+        failed = {index for index, _, _ in errors} | {index for index, job in enumerate(jobs) if "folded_into" in job}
+        inserted = [job for index, job in enumerate(jobs) if index not in failed]
+        for state in ("pending", "waiting", "completed"):
+            bump_counts_for_jobs(self.db, [job for job in inserted if job["state"] == state], **{state: 1})
+        self._settle(inserted)
+        return len(inserted), errors
+
+    # --- Counters ---
+
+    def _bump(self, queue, **deltas):
+        """bump_counts, or add to this thread's open _batched_counts() block."""
+        pending = getattr(self._local, "counts", None)
+        if pending is None:
+            bump_counts(self.db, queue, **deltas)
+        else:
+            pending.setdefault(queue, Counter()).update(deltas)
+
+    @contextmanager
+    def _batched_counts(self):
+        """Collect the counter updates made inside the block into one write at its end."""
+        if getattr(self._local, "counts", None) is not None:
+            yield # Nested: the outer block writes
+            return
+        self._local.counts = {}
+        try:
+            yield
+        finally:
+            pending, self._local.counts = self._local.counts, None
+            bump_queue_counts(self.db, pending)
+
+    # --- Deduplication ---
+
+    def _answer_from_cache(self, jobs):
+        candidates = [job for job in jobs if can_answer_from_cache(job)]
+        if not candidates:
+            return
+        now = datetime.datetime.utcnow()
+        cached = cached_results(self.db, {job["dedup_key"] for job in candidates}, now)
+        for job in candidates:
+            if job["dedup_key"] in cached and is_fresh(cached[job["dedup_key"]], job, now):
+                answer_from_cache(job, cached[job["dedup_key"]], now)
+
+    def _fold_duplicates(self, jobs, errors):
+        """
+        Mark the jobs that failed on the dedup index as folded into the
+        active job holding their key; returns the remaining errors. A
+        duplicate whose twin finished in between stays an error.
+        """
+        conflicts = [index for index, duplicate, message in errors if duplicate and is_dedup_conflict(message)]
+        if not conflicts:
+            return errors
+        keys = list({jobs[index]["dedup_active"] for index in conflicts})
+        active = {job["dedup_active"]: job["id"] for job in self.jobs.find({"dedup_active": {"$in": keys}}, {"id": 1, "dedup_active": 1})}
+        for index in conflicts:
+            if jobs[index]["dedup_active"] in active:
+                jobs[index]["folded_into"] = active[jobs[index]["dedup_active"]]
+        return [(index, duplicate and not is_dedup_conflict(message), message)
+                for index, duplicate, message in errors if "folded_into" not in jobs[index]]
+
+    # --- Dependencies ---
+
+    def job_states(self, job_ids):
+        """{id: state} for the given ids; DLQ jobs are 'dead', missing ids are left out."""
+        states = {}
+        query = {"id": {"$in": list(job_ids)}}
+        for job in self.db[HISTORY_COLLECTION].find(query, {"id": 1}):
+            states[job["id"]] = "completed"
+        for job in self.dlq.find(query, {"id": 1}):
+            states[job["id"]] = "dead"
+        for job in self.jobs.find(query, {"id": 1, "state": 1}):
+            states[job["id"]] = job["state"]
+        return states
+
+    def _settle(self, jobs):
+        """
+        Apply outcomes that happened before `jobs` were inserted: a parent
+        that already completed is crossed off, one that already failed
+        takes the job down with it. Parents finishing meanwhile cross the
+        job off themselves; the 'deps_pending' filter makes that idempotent.
+        """
+        parents_by_child = _parents_by_child(jobs)
+        if not parents_by_child:
+            return
+        states = self.job_states({parent for parents in parents_by_child.values() for parent in parents})
+        for child_id, parents in parents_by_child.items():
+            for parent in parents:
+                if states.get(parent) == "completed":
+                    self._unblock(parent, [child_id])
+                elif states.get(parent) == "dead":
+                    self._cascade(parent, [child_id])
+                    break
+
+    def _unblock_many(self, parent_ids):
+        """_unblock for a batch of finished jobs; jobs nobody waits on cost one shared lookup."""
+        parents = set(parent_ids)
+        waited_on = set()
+        for child in self.jobs.find({"deps_pending": {"$in": parent_ids}}, {"deps_pending": 1}):
+            waited_on.update(parent for parent in child["deps_pending"] if parent in parents)
+        return sum(self._unblock(parent_id) for parent_id in waited_on)
+
+    def _unblock(self, parent_id, child_ids=None):
+        """
+        Cross `parent_id` off its dependents and make the ones with nothing
+        left to wait for 'pending'. Found via the 'deps_pending' index;
+        $pull and $inc happen in one update per job, so each parent is
+        counted exactly once.
+        """
+        query = {"deps_pending": parent_id}
+        if child_ids is not None:
+            query["id"] = {"$in": child_ids}
+        children = [job["id"] for job in self.jobs.find(query, {"id": 1})]
+        if not children:
+            return 0
+        self.jobs.update_many(
+            {"id": {"$in": children}, "deps_pending": parent_id},
+            {"$pull": {"deps_pending": parent_id}, "$inc": {"deps_remaining": -1}}
+        )
+
+        now = datetime.datetime.utcnow()
+        ready = self.jobs.find(
+            {"id": {"$in": children}, "state": "waiting", "deps_remaining": {"$lte": 0}},
+            {"id": 1, "queue": 1, "run_at": 1}
+        )
+        unblocked = 0
+        for job in list(ready):
+            result = self.jobs.update_one(
+                {"_id": job["_id"], "state": "waiting"},
+                # A delayed job still waits for its own run_at
+                {"$set": {"state": "pending", "run_at": max(job["run_at"], now), "updated_at": now}}
+            )
+            if result.modified_count:
+                self._bump(queue_of(job), waiting=-1, pending=1)
+                unblocked += 1
+        return unblocked
+
+    def _cascade(self, parent_id, child_ids=None):
+        """
+        Move every job waiting (directly or not) on a failed `parent_id`
+        into the DLQ, with failure_class 'dependency'.
+        """
+        failed = [(parent_id, child_ids)]
+        buried = 0
+        while failed:
+            parent_id, child_ids = failed.pop()
+            query = {"deps_pending": parent_id, "state": "waiting"}
+            if child_ids is not None:
+                query["id"] = {"$in": child_ids}
+            # Materialised first: the loop deletes what the cursor walks
+            for child in list(self.jobs.find(query)):
+                now = datetime.datetime.utcnow()
+                child.update({
+                    "state": "dead",
+                    "updated_at": now,
+                    "last_error": dependency_error(parent_id),
+                    "failure_class": FAILURE_DEPENDENCY
+                })
+                if move_to_dlq(self.jobs, self.dlq, child, {"state": "waiting"}):
+                    self._bump(queue_of(child), waiting=-1, dead=1)
+                    failed.append((child["id"], None))
+                    buried += 1
+        return buried
+
+    def claim(self, worker_id, limit, queues=None, weights=None, lease_seconds=60):
+        """
+        Claim up to `limit` eligible jobs from `queues`, trying the queues in
+        a weighted random order and topping up from the next queue when one
+        runs dry.
+        """
+        claimed = []
+        for queue in weighted_queue_order(queues or [DEFAULT_QUEUE], weights):
+            claimed.extend(self._claim_from_queue(worker_id, queue, limit - len(claimed), lease_seconds))
+            if len(claimed) >= limit:
+                break
+        return claimed
+
+    def _claim_one(self, worker_id, queue, lease_seconds):
+        """
+        Find the highest-priority, oldest due 'pending' job in `queue`, set
+        its state to 'processing', and return it. Two round trips: read the
+        top candidate, take its permit if it is throttled, then flip it
+        with find_one_and_update. A throttled job whose key is full is
+        skipped before the flip, so it is never claimed and handed back.
+        """
+        try:
+            now = datetime.datetime.utcnow()
+            blocked = self._blocked_keys(now)
+
+            for _ in range(PERMIT_ATTEMPTS):
+                candidate = self.jobs.find_one(
+                    self._claim_query(queue, now, blocked),
+                    {"_id": 1, "concurrency_key": 1, "max_running": 1, "rate_limit": 1},
+                    sort=CLAIM_SORT
+                )
+                if candidate is None:
+                    return None
+                ids, granted = self._take_permits([candidate], blocked, now)
+                if not ids:
+                    continue # Its key is full: _take_permits added it to `blocked`
+                job = self.jobs.find_one_and_update(
+                    {"_id": candidate["_id"], "state": "pending"},
+                    {
+                        "$set": {
+                            "state": "processing",
+                            "updated_at": now,
+                            "worker_id": worker_id,
+                            "lease_expires_at": lease_expiry(lease_seconds, now)
+                        }
+                    },
+                    return_document=ReturnDocument.AFTER
+                )
+                if job is not None:
+                    self._bump(queue, pending=-1, processing=1)
+                    return job
+                # Another worker won it: its permit goes back unused
+                for key, (count, rate) in granted.items():
+                    release_permits(self.db, key, count, tokens=count if rate else 0)
+            return None
+        except Exception as e:
+            print(f"Worker {worker_id}: ❌ Error finding job: {e}")
+            return None
+
+    def _claim_query(self, queue, now, blocked):
+        query = {
+            "queue": queue,
+            "state": "pending",
+            "run_at": {"$lte": now}
+        }
+        if blocked:
+            query["concurrency_key"] = {"$nin": sorted(blocked)}
+        return query
+
+    def _blocked_keys(self, now):
+        """
+        Concurrency keys at their limit, to leave out of the claim query.
+        Only a worker that met a throttled job in the last
+        BLOCKED_CHECK_SECONDS pays for this read; any other worker has its
+        permit refused and skips the key from then on.
+        """
+        if time.monotonic() - self._keys_seen > BLOCKED_CHECK_SECONDS:
+            return set()
+        return blocked_keys(self.db, now)
+
+    def _take_permits(self, candidates, blocked, now):
+        """
+        Ids of the claim candidates that may start: every unthrottled one,
+        plus as many per concurrency key as its limits grant right now.
+        Keys that run out are added to `blocked`. Returns (ids, granted).
+        """
+        ids = []
+        by_key = {}
+        for candidate in candidates:
+            throttle = job_throttle(candidate)
+            if throttle is None:
+                ids.append(candidate["_id"])
+            else:
+                by_key.setdefault(throttle, []).append(candidate["_id"])
+
+        granted = {}
+        for (key, max_running, rate), key_ids in by_key.items():
+            self._keys_seen = time.monotonic()
+            count = acquire_permits(self.db, key, len(key_ids), max_running, rate, now) if key not in blocked else 0
+            granted[key] = (count, rate)
+            ids.extend(key_ids[:count])
+            if count < len(key_ids):
+                blocked.add(key)
+        return ids, granted
+
+    def _claim_from_queue(self, worker_id, queue, limit, lease_seconds):
+        """
+        Claim up to `limit` eligible jobs of one queue in one step and return
+        them in claim order. Uses three round trips no matter how large `limit`
+        is: pick candidate _ids, flip them to 'processing' in a single
+        update_many, then read back the ones this worker actually won.
+        """
+        if limit <= 1:
+            job = self._claim_one(worker_id, queue, lease_seconds)
+            return [job] if job else []
+
+        try:
+            now = datetime.datetime.utcnow()
+            blocked = self._blocked_keys(now)
+            claimed = []
+
+            for _ in range(CLAIM_PASSES):
+                candidates = list(self.jobs.find(
+                    self._claim_query(queue, now, blocked),
+                    {"_id": 1, "concurrency_key": 1, "max_running": 1, "rate_limit": 1}
+                ).sort(CLAIM_SORT).limit(limit - len(claimed)))
+                if not candidates:
+                    break
+                # Permits are taken before the flip, so throttled jobs are skipped, never claimed and requeued
+                ids, granted = self._take_permits(candidates, blocked, now)
+
+                jobs = []
+                if ids:
+                    # The 'state: pending' guard makes each document flip exactly once,
+                    # so racing workers split the candidates between them.
+                    claim_id = uuid.uuid4().hex
+                    self.jobs.update_many(
+                        {"_id": {"$in": ids}, "state": "pending"},
+                        {
+                            "$set": {
+                                "state": "processing",
+                                "updated_at": now,
+                                "worker_id": worker_id,
+                                "claim_id": claim_id,
+                                "lease_expires_at": lease_expiry(lease_seconds, now)
+                            }
+                        }
+                    )
+                    jobs = [job for job in self.jobs.find({"_id": {"$in": ids}, "claim_id": claim_id}).sort(CLAIM_SORT)]
+
+                # Permits for candidates another worker won go back unused
+                won = _throttled_counts(jobs)
+                for key, (count, rate) in granted.items():
+                    unused = count - won.get(key, (0, None))[0]
+                    release_permits(self.db, key, unused, tokens=unused if rate else 0)
+
+                claimed.extend(jobs)
+                if len(claimed) >= limit or len(ids) == len(candidates):
+                    break
+
+            self._bump(queue, pending=-len(claimed), processing=len(claimed))
+            return claimed
+        except Exception as e:
+            print(f"Worker {worker_id}: ❌ Error claiming jobs: {e}")
+            return []
+
+    def release(self, worker_id, jobs):
+        """
+        Hand buffered jobs that were claimed but never started back to
+        'pending'. Attempts are untouched since the jobs never ran.
+        """
+        if not jobs:
+            return 0
+
+        # One write per queue and concurrency key, so counters and permits
+        # follow what actually changed: the reaper may have requeued some already
+        ids_by_group = {}
+        for job in jobs:
+            ids_by_group.setdefault((queue_of(job), job_throttle(job)), []).append(job["_id"])
+
+        released = 0
+        now = datetime.datetime.utcnow()
+        with self._batched_counts():
+            for (queue, throttle), ids in ids_by_group.items():
+                n = self.jobs.update_many(
+                    {
+                        "_id": {"$in": ids},
+                        "state": "processing",
+                        "worker_id": worker_id
+                    },
+                    {
+                        "$set": {
+                            "state": "pending",
+                            "updated_at": now,
+                            "worker_id": None
+                        },
+                        "$unset": {"claim_id": "", "lease_expires_at": ""}
+                    }
+                ).modified_count
+                self._bump(queue, pending=n, processing=-n)
+                if throttle is not None:
+                    release_permits(self.db, throttle[0], n, tokens=n if throttle[2] else 0)
+                released += n
+        return released
+
+    def _release_throttles(self, jobs, started=True):
+        """Give back the permits of finished jobs; jobs that never `started` get their rate tokens back too."""
+        for key, (count, rate) in _throttled_counts(jobs).items():
+            release_permits(self.db, key, count, tokens=count if rate and not started else 0)
+
+    def complete(self, worker_id, job):
+        """
+        Set job state to 'completed'. Returns False if this worker no
+        longer holds the job's lease.
+        """
+        result = self.jobs.update_one(
+            {"id": job["id"], "worker_id": worker_id},
+            {
+                "$set": {
+                    "state": "completed", 
+                    "updated_at": datetime.datetime.utcnow(),
+                    "worker_id": None,
+                    "started_at": job.get("started_at"),
+                    "output": job.get("output")
+                },
+                "$unset": {"lease_expires_at": "", "claim_id": "", "dedup_active": ""}
+            }
+        )
+        if result.matched_count == 0:
+            return False
+        self._after_complete([job])
+        return True
+
+    def complete_many(self, worker_id, jobs, lease_seconds=None):
+        """
+        Mark several jobs 'completed' in one bulk_write, then do the
+        bookkeeping for all of them at once (one counters write, one
+        dependents lookup). With `lease_seconds` the same bulk_write
+        renews this worker's other leases. Returns the jobs this worker
+        still held; the others were reclaimed meanwhile.
+        """
+        now = datetime.datetime.utcnow()
+        ack_id = uuid.uuid4().hex
+        ops = [UpdateOne(
+            {"id": job["id"], "worker_id": worker_id},
+            {
+                "$set": {
+                    "state": "completed",
+                    "updated_at": now,
+                    "worker_id": None,
+                    "started_at": job.get("started_at"),
+                    "output": job.get("output"),
+                    "ack_id": ack_id
+                },
+                "$unset": {"lease_expires_at": "", "claim_id": "", "dedup_active": ""}
+            }
+        ) for job in jobs]
+        if lease_seconds:
+            ops.append(UpdateMany(
+                {"state": "processing", "worker_id": worker_id},
+                {"$set": {"lease_expires_at": lease_expiry(lease_seconds, now)}}
+            ))
+        if not ops:
+            return []
+        result = self.jobs.bulk_write(ops, ordered=False)
+        won = jobs
+        if lease_seconds or result.matched_count < len(jobs):
+            # Matches are only reported in total: ask which completions landed
+            acked = {doc["id"] for doc in self.jobs.find({"ack_id": ack_id}, {"id": 1})}
+            won = [job for job in jobs if job["id"] in acked]
+        self._after_complete(won)
+        return won
+
+    def _after_complete(self, jobs):
+        """Counters, throttle permits, the result cache and dependents of newly completed jobs."""
+        if not jobs:
+            return
+        with self._batched_counts():
+            for job in jobs:
+                self._bump(queue_of(job), processing=-1, completed=1)
+            self._release_throttles(jobs)
+            for job in jobs:
+                remember_result(self.db, job, self.result_cache_max)
+            self._unblock_many([job["id"] for job in jobs])
+
+    def retry(self, worker_id, job, attempts, run_at, error_message, failure_class):
+        """Put a failed job back to 'pending' until `run_at`. False if the lease was lost."""
+        result = self.jobs.update_one(
+            {"id": job["id"], "worker_id": worker_id},
+            {
+                "$set": {
+                    "state": "pending",
+                    "attempts": attempts,
+                    "run_at": run_at,
+                    "updated_at": datetime.datetime.utcnow(),
+                    "last_error": error_message,
+                    "failure_class": failure_class,
+                    "worker_id": None,
+                    "started_at": job.get("started_at"),
+                    "output": job.get("output"),
+                    "exit_code": job.get("exit_code"),
+                    "retry_delay": job.get("retry_delay")
+                },
+                "$unset": {"lease_expires_at": "", "claim_id": ""}
+            }
+        )
+        if result.matched_count == 0:
+            return False
+        self._bump(queue_of(job), processing=-1, pending=1)
+        self._release_throttles([job])
+        return True
+
+    def bury(self, worker_id, job):
+        """Move a (dead) job into the DLQ. False if the lease was lost."""
+        if not move_to_dlq(self.jobs, self.dlq, job, {"worker_id": worker_id}):
+            return False
+        self._bump(queue_of(job), processing=-1, dead=1)
+        self._release_throttles([job])
+        self._cascade(job["id"])
+        return True
+
+    def renew_leases(self, worker_id, lease_seconds):
+        return renew_leases(self.jobs, worker_id, lease_seconds)
+
+    def reap_expired(self):
+        return reap_expired_leases(self.db, on_buried=lambda job: self._cascade(job["id"]))
+
+    def reclaimed(self):
+        return reclaimed_count(self.db)
+
+    def counts(self, exact=False):
+        """
+        Counts by state, plus per queue under "queues" (see counters.py).
+        exact=True also resyncs the running counts of concurrency keys.
+        """
+        if exact:
+            reconcile_permits(self.db)
+        counts = None if exact else read_counts(self.db)
+        return counts if counts is not None else recount(self.db)
+
+    def list_jobs(self, state=None, queue=None, after=None, limit=50, fields=None, error_chars=100):
+        query = {}
+        if state:
+            query["state"] = state
+        if queue:
+            query["queue"] = queue
+        return stream_jobs(self.jobs, query, "created_at", after, limit, fields, error_chars)
+
+    def list_dlq(self, after=None, limit=50, fields=None, error_chars=1000):
+        return stream_jobs(self.dlq, {}, "updated_at", after, limit, fields, error_chars)
+
+    def find(self, job_id):
+        for collection in (self.jobs, self.dlq, self.db[HISTORY_COLLECTION]):
+            job = collection.find_one({"id": job_id})
+            if job:
+                return job
+        return None
+
+    def count_dlq(self, filters):
+        return self.dlq.count_documents(build_replay_query(**filters))
+
+    def replay(self, filters, chunk_size=500, rate=0, on_progress=None, on_conflict=None):
+        """Move matching DLQ jobs back to 'pending'. Returns (moved, skipped)."""
+        return replay_from_dlq(self.db, build_replay_query(**filters), chunk_size, rate, on_progress, on_conflict)
+
+    def watch(self, pipeline):
+        return self.jobs.watch(pipeline, max_await_time_ms=1000)
+
+    # --- Schedules ---
+
+    def add_schedule(self, schedule):
+        """Store a recurring job (see scheduler.py). False if the name is taken."""
+        try:
+            self.db[SCHEDULES_COLLECTION].insert_one(dict(schedule))
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def list_schedules(self):
+        return list(self.db[SCHEDULES_COLLECTION].find({}, {"_id": 0}).sort("name", 1))
+
+    def remove_schedule(self, name):
+        return self.db[SCHEDULES_COLLECTION].delete_one({"name": name}).deleted_count == 1
+
+    def advance_schedule(self, name, fired_run, next_run, fired_at):
+        """
+        Move a schedule on from `fired_run` to `next_run`. Conditional on
+        'next_run' still being `fired_run`, so a stale scheduler can't
+        rewind it. False if it was changed or removed meanwhile.
+        """
+        result = self.db[SCHEDULES_COLLECTION].update_one(
+            {"name": name, "next_run": fired_run},
+            {"$set": {"next_run": next_run, "last_run": fired_run, "last_fired_at": fired_at}}
+        )
+        return result.modified_count == 1
+
+    def acquire_lease(self, name, owner, lease_seconds):
+        """
+        Take or renew the named lease for `owner`. Returns True while
+        `owner` holds it; another owner gets it only once it has expired.
+        """
+        now = datetime.datetime.utcnow()
+        try:
+            self.db[STATS_COLLECTION].update_one(
+                {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + datetime.timedelta(seconds=lease_seconds)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False # Held by someone else: the upsert collided with their document
+        return True
+
+    def release_lease(self, name, owner):
+        self.db[STATS_COLLECTION].delete_one({"_id": name, "owner": owner})
+
+    def seconds_until_next_due(self, queues=None):
+        """Time until the earliest pending job with a future run_at, or None."""
+        now = datetime.datetime.utcnow()
+        query = {"state": "pending", "run_at": {"$gt": now}}
+        if queues:
+            query["queue"] = {"$in": list(queues)}
+        job = self.jobs.find_one(
+            query,
+            {"run_at": 1},
+            sort=[("run_at", 1)]
+        )
+        if job is None:
+            return None
+        return max((job["run_at"] - now).total_seconds(), 0)
+
+
+# --- SQLite ---
+
+# Columns the engine filters or sorts on; everything else about a job
+# lives in the JSON 'doc' column.
+JOB_COLUMNS = ("id", "queue", "state", "priority", "created_at", "updated_at", "run_at",
+               "worker_id", "lease_expires_at", "attempts", "max_retries")
+DLQ_COLUMNS = ("id", "queue", "updated_at", "failure_class", "last_error")
+SCHEDULE_COLUMNS = ("name", "next_run")
+DATETIME_COLUMNS = {"created_at", "updated_at", "run_at", "lease_expires_at", "next_run"}
+SQLITE_CHUNK = 500 # Ids per IN (...) list, well under SQLite's variable limit
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    queue TEXT NOT NULL,
+    state TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    updated_at TEXT,
+    run_at TEXT NOT NULL,
+    worker_id TEXT,
+    lease_expires_at TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_retries INTEGER NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (queue, state, priority DESC, created_at, run_at);
+CREATE INDEX IF NOT EXISTS jobs_state_run_at ON jobs (state, run_at);
+CREATE INDEX IF NOT EXISTS jobs_lease ON jobs (state, lease_expires_at);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+CREATE INDEX IF NOT EXISTS jobs_state_created ON jobs (state, created_at);
+-- At most one active (waiting, pending or processing) job per dedup key
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_dedup_active ON jobs (json_extract(doc, '$.dedup_active'))
+    WHERE json_extract(doc, '$.dedup_active') IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS dlq (
+    id TEXT PRIMARY KEY,
+    queue TEXT NOT NULL,
+    updated_at TEXT,
+    failure_class TEXT,
+    last_error TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dlq_updated ON dlq (updated_at);
+
+-- One row per dependency a waiting job still has (parent not completed yet)
+CREATE TABLE IF NOT EXISTS deps (
+    parent TEXT NOT NULL,
+    child TEXT NOT NULL,
+    PRIMARY KEY (parent, child)
+);
+CREATE INDEX IF NOT EXISTS deps_child ON deps (child);
+
+-- Running jobs and rate tokens per concurrency key (see throttle.py)
+CREATE TABLE IF NOT EXISTS key_limits (
+    key TEXT PRIMARY KEY,
+    running INTEGER NOT NULL DEFAULT 0,
+    max_running INTEGER,
+    rate REAL,
+    tokens REAL,
+    refilled_at TEXT,
+    full INTEGER NOT NULL DEFAULT 0,
+    blocked_until TEXT
+);
+
+-- Outputs of recently succeeded jobs, by dedup key (see dedup.py)
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    completed_at TEXT NOT NULL,
+    expires_at TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_completed ON results (completed_at);
+
+CREATE TABLE IF NOT EXISTS schedules (
+    name TEXT PRIMARY KEY,
+    next_run TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS counts (
+    queue TEXT NOT NULL,
+    state TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (queue, state)
+);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    n INTEGER NOT NULL
+);
+
+-- Live counters, kept exact by the engine in the same transaction as the write
+CREATE TRIGGER IF NOT EXISTS jobs_count_insert AFTER INSERT ON jobs BEGIN
+    INSERT INTO counts VALUES (NEW.queue, NEW.state, 1)
+        ON CONFLICT (queue, state) DO UPDATE SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS jobs_count_delete AFTER DELETE ON jobs BEGIN
+    UPDATE counts SET n = n - 1 WHERE queue = OLD.queue AND state = OLD.state;
+END;
+CREATE TRIGGER IF NOT EXISTS jobs_count_update AFTER UPDATE OF state, queue ON jobs
+WHEN OLD.state IS NOT NEW.state OR OLD.queue IS NOT NEW.queue BEGIN
+    UPDATE counts SET n = n - 1 WHERE queue = OLD.queue AND state = OLD.state;
+    INSERT INTO counts VALUES (NEW.queue, NEW.state, 1)
+        ON CONFLICT (queue, state) DO UPDATE SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS dlq_count_insert AFTER INSERT ON dlq BEGIN
+    INSERT INTO counts VALUES (NEW.queue, 'dead', 1)
+        ON CONFLICT (queue, state) DO UPDATE SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS dlq_count_delete AFTER DELETE ON dlq BEGIN
+    UPDATE counts SET n = n - 1 WHERE queue = OLD.queue AND state = 'dead';
+END;
+"""
+
+def _sql_time(value):
+    # Fixed-width ISO text sorts in time order, so indexes and range queries work
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(timespec="microseconds")
+    return value
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return {"$date": value.isoformat(timespec="microseconds")}
+    return str(value)
+
+def _json_hook(obj):
+    if len(obj) == 1 and "$date" in obj:
+        return datetime.datetime.fromisoformat(obj["$date"])
+    return obj
+
+def _doc_json(job, columns):
+    rest = {key: value for key, value in job.items() if key not in columns and key != "_id"}
+    return json.dumps(rest, default=_json_default)
+
+def _from_row(row, columns):
+    job = json.loads(row["doc"], object_hook=_json_hook)
+    for column in columns:
+        value = row[column]
+        job[column] = datetime.datetime.fromisoformat(value) if column in DATETIME_COLUMNS and value else value
+    job["_id"] = row["rowid"]
+    return job
+
+def _regexp(pattern, value):
+    return value is not None and re.search(pattern, value) is not None
+
+def _chunks(items, size=SQLITE_CHUNK):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+class SQLiteStore:
+    """
+    The job lifecycle in an embedded SQLite database (WAL mode), for
+    single-node deployments, CI and benchmarks with no outside services.
+
+    Indexed columns hold what the claim, reaper and listings filter on;
+    the rest of each job is a JSON document. A claim is one atomic
+    UPDATE ... RETURNING, counts are kept by triggers, and bulk writes
+    (enqueue, release, replay) commit once per batch. Several worker
+    processes can share one file: WAL lets readers run alongside the
+    single writer, and writers wait on busy_timeout instead of failing.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path, result_cache_max=10000):
+        self.path = path
+        self.result_cache_max = result_cache_max
+        self._local = threading.local()
+
+    def _conn(self):
+        # One connection per thread: sqlite3 connections aren't thread-safe
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.create_function("REGEXP", 2, _regexp, deterministic=True)
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def setup(self):
+        """Check the engine version; the schema itself is created with each connection."""
+        if sqlite3.sqlite_version_info < (3, 35, 0):
+            raise Exception(f"The sqlite backend needs SQLite 3.35+ (for UPDATE ... RETURNING); found {sqlite3.sqlite_version}.")
+        self._conn()
+        return True
+
+    def _job_params(self, job):
+        return [_sql_time(job.get(column)) for column in JOB_COLUMNS] + [_doc_json(job, JOB_COLUMNS)]
+
+    def enqueue(self, jobs):
+        """
+        Insert new jobs in one transaction. Returns (inserted, errors) like
+        MongoStore. A job's unmet dependencies become rows in 'deps' rather
+        than part of its document; the document keeps their count.
+        Duplicates are answered from the result cache or folded into the
+        active job with the same dedup key, as in MongoStore.
+        """
+        errors = []
+        inserted = []
+        sql = f"INSERT INTO jobs ({', '.join(JOB_COLUMNS)}, doc) VALUES ({', '.join('?' * (len(JOB_COLUMNS) + 1))})"
+        with self._transaction() as conn:
+            self._answer_from_cache(conn, jobs)
+            for index, job in enumerate(jobs):
+                stored = {key: value for key, value in job.items() if key != "deps_pending"}
+                try:
+                    conn.execute(sql, self._job_params(stored))
+                except sqlite3.IntegrityError as e:
+                    if is_dedup_conflict(str(e)):
+                        row = conn.execute("SELECT id FROM jobs WHERE json_extract(doc, '$.dedup_active') = ?",
+                                           (job["dedup_active"],)).fetchone()
+                        job["folded_into"] = row["id"]
+                    else:
+                        errors.append((index, "UNIQUE" in str(e), str(e)))
+                    continue
+                conn.executemany("INSERT INTO deps (parent, child) VALUES (?, ?)",
+                                 [(parent, job["id"]) for parent in job.get("deps_pending", [])])
+                inserted.append(job)
+            self._settle(conn, inserted)
+        return len(inserted), errors
+
+    # --- Deduplication ---
+
+    def _answer_from_cache(self, conn, jobs):
+        now = datetime.datetime.utcnow()
+        for job in jobs:
+            if not can_answer_from_cache(job):
+                continue
+            row = conn.execute("SELECT doc FROM results WHERE key = ? AND expires_at > ?",
+                               (job["dedup_key"], _sql_time(now))).fetchone()
+            cached = json.loads(row["doc"], object_hook=_json_hook) if row is not None else None
+            if cached is not None and is_fresh(cached, job, now):
+                answer_from_cache(job, cached, now)
+
+    def _remember_result(self, conn, job, now):
+        """Cache a successful job's output; expired and (past result_cache_max) oldest entries are dropped."""
+        entry = result_entry(job, now)
+        if entry is None:
+            return
+        conn.execute("INSERT OR REPLACE INTO results (key, job_id, completed_at, expires_at, doc) VALUES (?, ?, ?, ?, ?)",
+                     (entry["_id"], entry["job_id"], _sql_time(now), _sql_time(entry["expires_at"]), json.dumps(entry, default=_json_default)))
+        conn.execute("DELETE FROM results WHERE expires_at <= ?", (_sql_time(now),))
+        if self.result_cache_max:
+            conn.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY completed_at DESC LIMIT -1 OFFSET ?)",
+                         (self.result_cache_max,))
+
+    # --- Dependencies ---
+
+    def job_states(self, job_ids):
+        """{id: state} for the given ids; DLQ jobs are 'dead', missing ids are left out."""
+        conn = self._conn()
+        states = {}
+        for chunk in _chunks(list(job_ids)):
+            marks = ", ".join("?" * len(chunk))
+            for row in conn.execute(f"SELECT id FROM dlq WHERE id IN ({marks})", chunk):
+                states[row["id"]] = "dead"
+            for row in conn.execute(f"SELECT id, state FROM jobs WHERE id IN ({marks})", chunk):
+                states[row["id"]] = row["state"]
+        return states
+
+    def _settle(self, conn, jobs):
+        """Apply outcomes of parents that finished before `jobs` were inserted."""
+        parents_by_child = _parents_by_child(jobs)
+        if not parents_by_child:
+            return
+        states = self.job_states({parent for parents in parents_by_child.values() for parent in parents})
+        for child_id, parents in parents_by_child.items():
+            for parent in parents:
+                if states.get(parent) == "completed":
+                    self._unblock(conn, parent, [child_id])
+                elif states.get(parent) == "dead":
+                    self._cascade(conn, parent, [child_id])
+                    break
+
+    def _unblock(self, conn, parent_id, child_ids=None):
+        """Drop `parent_id`'s 'deps' rows and make dependents with none left 'pending'."""
+        sql, params = "DELETE FROM deps WHERE parent = ?", [parent_id]
+        if child_ids is not None:
+            sql += f" AND child IN ({', '.join('?' * len(child_ids))})"
+            params += child_ids
+        children = [row["child"] for row in conn.execute(sql + " RETURNING child", params).fetchall()]
+        now = _sql_time(datetime.datetime.utcnow())
+        unblocked = 0
+        for chunk in _chunks(children):
+            conn.execute(
+                f"""UPDATE jobs SET doc = json_set(doc, '$.deps_remaining', (SELECT COUNT(*) FROM deps WHERE deps.child = jobs.id))
+                    WHERE id IN ({', '.join('?' * len(chunk))})""",
+                chunk
+            )
+            # A delayed job still waits for its own run_at
+            unblocked += conn.execute(
+                f"""UPDATE jobs SET state = 'pending', run_at = MAX(run_at, ?), updated_at = ?
+                    WHERE id IN ({', '.join('?' * len(chunk))}) AND state = 'waiting'
+                    AND NOT EXISTS (SELECT 1 FROM deps WHERE deps.child = jobs.id)""",
+                [now, now] + chunk
+            ).rowcount
+        return unblocked
+
+    def _cascade(self, conn, parent_id, child_ids=None):
+        """Move every job waiting (directly or not) on a failed `parent_id` into the DLQ."""
+        failed = [(parent_id, child_ids)]
+        buried = 0
+        while failed:
+            parent_id, child_ids = failed.pop()
+            sql = """SELECT jobs.rowid AS rowid, jobs.* FROM deps JOIN jobs ON jobs.id = deps.child
+                     WHERE deps.parent = ? AND jobs.state = 'waiting'"""
+            params = [parent_id]
+            if child_ids is not None:
+                sql += f" AND deps.child IN ({', '.join('?' * len(child_ids))})"
+                params += child_ids
+            for row in conn.execute(sql, params).fetchall():
+                child = _from_row(row, JOB_COLUMNS)
+                child.update(state="dead", updated_at=datetime.datetime.utcnow(),
+                             last_error=dependency_error(parent_id), failure_class=FAILURE_DEPENDENCY)
+                conn.execute("DELETE FROM jobs WHERE id = ?", (child["id"],))
+                conn.execute("DELETE FROM deps WHERE child = ?", (child["id"],))
+                self._insert_dlq(conn, child)
+                failed.append((child["id"], None))
+                buried += 1
+        return buried
+
+    def claim(self, worker_id, limit, queues=None, weights=None, lease_seconds=60):
+        """
+        Claim up to `limit` due jobs, one transaction per queue. BEGIN
+        IMMEDIATE makes the claim exclusive, so concurrent workers can
+        never claim the same job or overrun a concurrency key: blocked keys
+        are left out of the candidate query, throttled candidates take
+        their permits, and the chosen rows flip with one UPDATE ... RETURNING.
+        """
+        claimed = []
+        for queue in weighted_queue_order(queues or [DEFAULT_QUEUE], weights):
+            now = datetime.datetime.utcnow()
+            try:
+                with self._transaction() as conn:
+                    jobs = self._claim_from_queue(conn, worker_id, queue, limit - len(claimed), lease_seconds, now)
+            except sqlite3.Error as e:
+                print(f"Worker {worker_id}: ❌ Error claiming jobs: {e}")
+                continue
+            claimed.extend(sorted(jobs, key=lambda job: (-job["priority"], job["created_at"])))
+            if len(claimed) >= limit:
+                break
+        return claimed
+
+    def _claim_from_queue(self, conn, worker_id, queue, limit, lease_seconds, now):
+        key_expr = "json_extract(doc, '$.concurrency_key')"
+        blocked = {row["key"] for row in conn.execute(
+            "SELECT key FROM key_limits WHERE full OR blocked_until > ?", (_sql_time(now),))}
+        claimed = []
+        for _ in range(CLAIM_PASSES):
+            sql = f"""SELECT rowid, {key_expr} AS concurrency_key, json_extract(doc, '$.max_running') AS max_running,
+                          json_extract(doc, '$.rate_limit') AS rate_limit
+                      FROM jobs WHERE queue = ? AND state = 'pending' AND run_at <= ?"""
+            params = [queue, _sql_time(now)]
+            if blocked:
+                sql += f" AND ({key_expr} IS NULL OR {key_expr} NOT IN ({', '.join('?' * len(blocked))}))"
+                params += sorted(blocked)
+            sql += " ORDER BY priority DESC, created_at LIMIT ?"
+            candidates = conn.execute(sql, params + [limit - len(claimed)]).fetchall()
+            if not candidates:
+                break
+
+            rowids = []
+            by_key = {}
+            for candidate in candidates:
+                throttle = job_throttle(dict(candidate))
+                if throttle is None:
+                    rowids.append(candidate["rowid"])
+                else:
+                    by_key.setdefault(throttle, []).append(candidate["rowid"])
+            for (key, max_running, rate), key_rowids in by_key.items():
+                count = self._take_permits(conn, key, len(key_rowids), max_running, rate, now)
+                rowids.extend(key_rowids[:count])
+                if count < len(key_rowids):
+                    blocked.add(key)
+
+            for chunk in _chunks(rowids):
+                rows = conn.execute(
+                    f"""UPDATE jobs SET state = 'processing', worker_id = ?, updated_at = ?, lease_expires_at = ?
+                        WHERE rowid IN ({', '.join('?' * len(chunk))}) RETURNING rowid, *""",
+                    [worker_id, _sql_time(now), _sql_time(lease_expiry(lease_seconds, now))] + chunk
+                ).fetchall()
+                claimed.extend(_from_row(row, JOB_COLUMNS) for row in rows)
+            if len(claimed) >= limit or len(rowids) == len(candidates):
+                break
+        return claimed
+
+    def _take_permits(self, conn, key, wanted, max_running, rate, now):
+        """Take up to `wanted` permits for `key` (see throttle.take_permits); the caller holds the write lock."""
+        row = conn.execute("SELECT running, tokens, refilled_at FROM key_limits WHERE key = ?", (key,)).fetchone()
+        state = None
+        if row:
+            refilled_at = datetime.datetime.fromisoformat(row["refilled_at"]) if row["refilled_at"] else None
+            state = {"running": row["running"], "tokens": row["tokens"], "refilled_at": refilled_at}
+        granted, state = take_permits(state, wanted, max_running, rate, now)
+        conn.execute(
+            """INSERT INTO key_limits (key, running, max_running, rate, tokens, refilled_at, full, blocked_until)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (key) DO UPDATE SET running = excluded.running, max_running = excluded.max_running,
+                   rate = excluded.rate, tokens = excluded.tokens, refilled_at = excluded.refilled_at,
+                   full = excluded.full, blocked_until = excluded.blocked_until""",
+            (key, state["running"], state["max_running"], state["rate"], state["tokens"],
+             _sql_time(state["refilled_at"]), int(state["full"]), _sql_time(state["blocked_until"]))
+        )
+        return granted
+
+    def _release_throttles(self, conn, jobs, started=True):
+        """Give back the permits of finished jobs; jobs that never `started` get their rate tokens back too."""
+        for key, (count, rate) in _throttled_counts(jobs).items():
+            refund = count if rate and not started else 0
+            conn.execute(
+                """UPDATE key_limits SET running = MAX(running - ?, 0), full = 0, tokens = tokens + ?,
+                       blocked_until = CASE WHEN ? > 0 THEN NULL ELSE blocked_until END
+                   WHERE key = ?""",
+                (count, refund, refund, key)
+            )
+
+    def release(self, worker_id, jobs):
+        released = set()
+        now = _sql_time(datetime.datetime.utcnow())
+        with self._transaction() as conn:
+            for chunk in _chunks([job["id"] for job in jobs]):
+                released.update(row["id"] for row in conn.execute(
+                    f"""UPDATE jobs SET state = 'pending', worker_id = NULL, lease_expires_at = NULL, updated_at = ?
+                        WHERE id IN ({', '.join('?' * len(chunk))}) AND state = 'processing' AND worker_id = ?
+                        RETURNING id""",
+                    [now] + chunk + [worker_id]
+                ).fetchall())
+            self._release_throttles(conn, [job for job in jobs if job["id"] in released], started=False)
+        return len(released)
+
+    def complete(self, worker_id, job):
+        """Mark the job completed, free its permits, cache its result and release its dependents in one transaction."""
+        with self._transaction() as conn:
+            return self._complete(conn, worker_id, job, datetime.datetime.utcnow())
+
+    def complete_many(self, worker_id, jobs, lease_seconds=None):
+        """
+        complete() for several jobs in one transaction (one commit), plus
+        a lease renewal when `lease_seconds` is given. Returns the jobs
+        this worker still held.
+        """
+        now = datetime.datetime.utcnow()
+        with self._transaction() as conn:
+            won = [job for job in jobs if self._complete(conn, worker_id, job, now)]
+            if lease_seconds:
+                conn.execute("UPDATE jobs SET lease_expires_at = ? WHERE state = 'processing' AND worker_id = ?",
+                             (_sql_time(lease_expiry(lease_seconds, now)), worker_id))
+        return won
+
+    def complete_and_claim(self, worker_id, job, limit, queues=None, weights=None, lease_seconds=60):
+        """
+        complete() and claim() in one transaction: a single commit takes
+        the finished job out and the next one in. Returns (completed, claimed).
+        """
+        now = datetime.datetime.utcnow()
+        claimed = []
+        with self._transaction() as conn:
+            completed = self._complete(conn, worker_id, job, now)
+            for queue in weighted_queue_order(queues or [DEFAULT_QUEUE], weights):
+                jobs = self._claim_from_queue(conn, worker_id, queue, limit - len(claimed), lease_seconds, now)
+                claimed.extend(sorted(jobs, key=lambda job: (-job["priority"], job["created_at"])))
+                if len(claimed) >= limit:
+                    break
+        return completed, claimed
+
+    def _complete(self, conn, worker_id, job, now):
+        job = dict(job, state="completed", updated_at=now, worker_id=None, lease_expires_at=None)
+        job.pop("dedup_active", None)
+        if not self._update_owned(conn, worker_id, job):
+            return False
+        self._release_throttles(conn, [job])
+        self._remember_result(conn, job, now)
+        self._unblock(conn, job["id"])
+        return True
+
+    def retry(self, worker_id, job, attempts, run_at, error_message, failure_class):
+        job = dict(job, state="pending", attempts=attempts, run_at=run_at, updated_at=datetime.datetime.utcnow(),
+                   last_error=error_message, failure_class=failure_class, worker_id=None, lease_expires_at=None)
+        if not job_throttle(job):
+            return self._update_owned(self._conn(), worker_id, job)
+        with self._transaction() as conn:
+            if not self._update_owned(conn, worker_id, job):
+                return False
+            self._release_throttles(conn, [job])
+        return True
+
+    def _update_owned(self, conn, worker_id, job):
+        """Rewrite a job this worker holds. False if the lease was lost."""
+        assignments = ", ".join(f"{column} = ?" for column in JOB_COLUMNS if column != "id")
+        params = [_sql_time(job.get(column)) for column in JOB_COLUMNS if column != "id"]
+        cursor = conn.execute(
+            f"UPDATE jobs SET {assignments}, doc = ? WHERE id = ? AND worker_id = ?",
+            params + [_doc_json(job, JOB_COLUMNS), job["id"], worker_id]
+        )
+        return cursor.rowcount == 1
+
+    def bury(self, worker_id, job):
+        """Delete the job, insert it into the DLQ and fail its dependents in one transaction."""
+        with self._transaction() as conn:
+            if conn.execute("DELETE FROM jobs WHERE id = ? AND worker_id = ?", (job["id"], worker_id)).rowcount == 0:
+                return False
+            self._insert_dlq(conn, job)
+            self._release_throttles(conn, [job])
+            self._cascade(conn, job["id"])
+        return True
+
+    def _insert_dlq(self, conn, job):
+        # A dead job no longer holds its dedup key: an identical job may run again
+        job = {key: value for key, value in job.items() if key != "dedup_active"}
+        values = [job.get("id"), job.get("queue") or DEFAULT_QUEUE, _sql_time(job.get("updated_at")),
+                  job.get("failure_class"), job.get("last_error"), _doc_json(job, DLQ_COLUMNS)]
+        conn.execute(f"INSERT OR REPLACE INTO dlq ({', '.join(DLQ_COLUMNS)}, doc) VALUES (?, ?, ?, ?, ?, ?)", values)
+
+    def renew_leases(self, worker_id, lease_seconds):
+        return self._conn().execute(
+            "UPDATE jobs SET lease_expires_at = ? WHERE state = 'processing' AND worker_id = ?",
+            (_sql_time(lease_expiry(lease_seconds)), worker_id)
+        ).rowcount
+
+    def reap_expired(self):
+        """
+        Return jobs with expired leases to 'pending', counting the lost run
+        as an attempt; jobs that lost their last attempt go to the DLQ.
+        """
+        moment = datetime.datetime.utcnow()
+        now = _sql_time(moment)
+        with self._transaction() as conn:
+            exhausted = conn.execute(
+                """SELECT rowid, * FROM jobs
+                   WHERE state = 'processing' AND lease_expires_at < ? AND attempts + 1 >= max_retries""",
+                (now,)
+            ).fetchall()
+            for row in exhausted:
+                job = _from_row(row, JOB_COLUMNS)
+                job.update(state="dead", attempts=job["attempts"] + 1, updated_at=moment, last_error=lease_error(job["worker_id"]),
+                           failure_class=FAILURE_LEASE, worker_id=None, lease_expires_at=None)
+                conn.execute("DELETE FROM jobs WHERE rowid = ?", (row["rowid"],))
+                self._insert_dlq(conn, job)
+                self._release_throttles(conn, [job])
+                self._cascade(conn, job["id"])
+                DLQ_MOVES.inc(queue=queue_of(job), failure_class=FAILURE_LEASE)
+            rows = conn.execute(
+                """
+                UPDATE jobs SET state = 'pending', attempts = attempts + 1, run_at = ?, updated_at = ?,
+                    doc = json_set(doc, '$.last_error',
+                        'Lease expired: worker ' || coalesce(worker_id, 'unknown') || ' stopped heartbeating.'),
+                    worker_id = NULL, lease_expires_at = NULL
+                WHERE state = 'processing' AND lease_expires_at < ?
+                RETURNING json_extract(doc, '$.concurrency_key') AS concurrency_key
+                """,
+                (now, now, now)
+            ).fetchall()
+            reclaimed = len(rows) + len(exhausted)
+            self._release_throttles(conn, [dict(row) for row in rows])
+            if reclaimed:
+                conn.execute(
+                    "INSERT INTO stats VALUES ('reclaimed', ?) ON CONFLICT (name) DO UPDATE SET n = n + excluded.n",
+                    (reclaimed,)
+                )
+        return reclaimed
+
+    def reclaimed(self):
+        row = self._conn().execute("SELECT n FROM stats WHERE name = 'reclaimed'").fetchone()
+        return row["n"] if row else 0
+
+    def counts(self, exact=False):
+        """
+        Counts from the trigger-maintained table; exact=True rebuilds it
+        (and the running counts of concurrency keys) first.
+        """
+        conn = self._conn()
+        if exact:
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM counts")
+                conn.execute("INSERT INTO counts SELECT queue, state, COUNT(*) FROM jobs GROUP BY queue, state")
+                conn.execute("INSERT INTO counts SELECT queue, 'dead', COUNT(*) FROM dlq GROUP BY queue")
+                conn.execute(
+                    """UPDATE key_limits SET running = (
+                           SELECT COUNT(*) FROM jobs
+                           WHERE state = 'processing' AND json_extract(doc, '$.concurrency_key') = key_limits.key)"""
+                )
+                conn.execute("UPDATE key_limits SET full = coalesce(max_running > 0 AND running >= max_running, 0)")
+        counts = {state: 0 for state in STATES}
+        queues = {}
+        for row in conn.execute("SELECT queue, state, n FROM counts"):
+            if row["state"] in STATES:
+                queues.setdefault(row["queue"], {state: 0 for state in STATES})[row["state"]] = max(row["n"], 0)
+                counts[row["state"]] += max(row["n"], 0)
+        counts["queues"] = queues
+        return counts
+
+    def _page(self, table, columns, sort_field, where, params, after, limit, fields, error_chars):
+        """Keyset page on (sort_field, rowid), newest first, like listing.stream_jobs."""
+        fields = fields or DEFAULT_FIELDS
+        if after:
+            value, rowid = decode_cursor(after)
+            where.append(f"({sort_field} < ? OR ({sort_field} = ? AND rowid < ?))")
+            params += [_sql_time(value), _sql_time(value), rowid]
+        sql = f"SELECT rowid, * FROM {table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {sort_field} DESC, rowid DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        for row in self._conn().execute(sql, params):
+            job = _from_row(row, columns)
+            doc = {field: job[field] for field in fields if field in job}
+            doc[sort_field] = job.get(sort_field)
+            doc["_id"] = job["_id"]
+            if doc.get("last_error"):
+                doc["last_error"] = doc["last_error"][:error_chars]
+            yield doc
+
+    def list_jobs(self, state=None, queue=None, after=None, limit=50, fields=None, error_chars=100):
+        where, params = [], []
+        if state:
+            where.append("state = ?")
+            params.append(state)
+        if queue:
+            where.append("queue = ?")
+            params.append(queue)
+        return self._page("jobs", JOB_COLUMNS, "created_at", where, params, after, limit, fields, error_chars)
+
+    def list_dlq(self, after=None, limit=50, fields=None, error_chars=1000):
+        return self._page("dlq", DLQ_COLUMNS, "updated_at", [], [], after, limit, fields, error_chars)
+
+    def find(self, job_id):
+        conn = self._conn()
+        row = conn.execute("SELECT rowid, * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row:
+            return _from_row(row, JOB_COLUMNS)
+        row = conn.execute("SELECT rowid, * FROM dlq WHERE id = ?", (job_id,)).fetchone()
+        return _from_row(row, DLQ_COLUMNS) if row else None
+
+    def _dlq_where(self, filters):
+        """The 'dlq retry' filters (see dead_letter.build_replay_query) as SQL."""
+        where, params = [], []
+        if filters.get("job_id"):
+            where.append("id = ?")
+            params.append(filters["job_id"])
+        elif filters.get("id_pattern"):
+            where.append("id REGEXP ?")
+            params.append(filters["id_pattern"])
+        if filters.get("error_contains"):
+            where.append("instr(last_error, ?) > 0")
+            params.append(filters["error_contains"])
+        if filters.get("since"):
+            where.append("updated_at >= ?")
+            params.append(_sql_time(filters["since"]))
+        if filters.get("until"):
+            where.append("updated_at <= ?")
+            params.append(_sql_time(filters["until"]))
+        if filters.get("failure_class"):
+            where.append("failure_class = ?")
+            params.append(filters["failure_class"])
+        return where, params
+
+    def count_dlq(self, filters):
+        where, params = self._dlq_where(filters)
+        sql = "SELECT COUNT(*) FROM dlq" + (" WHERE " + " AND ".join(where) if where else "")
+        return self._conn().execute(sql, params).fetchone()[0]
+
+    def replay(self, filters, chunk_size=500, rate=0, on_progress=None, on_conflict=None):
+        """
+        Move matching DLQ jobs back to 'pending' in rowid order, one
+        transaction per chunk. Jobs whose id is taken in 'jobs' stay in the
+        DLQ and go to on_conflict. Returns (moved, skipped).
+        """
+        on_progress = on_progress or (lambda moved, skipped: None)
+        on_conflict = on_conflict or (lambda job_id: None)
+        if rate:
+            chunk_size = max(1, min(chunk_size, int(rate)))
+
+        where, params = self._dlq_where(filters)
+        moved = skipped = 0
+        last_rowid = 0
+        started = time.monotonic()
+        insert = f"INSERT INTO jobs ({', '.join(JOB_COLUMNS)}, doc) VALUES ({', '.join('?' * (len(JOB_COLUMNS) + 1))})"
+
+        while True:
+            sql = "SELECT rowid, * FROM dlq WHERE " + " AND ".join(where + ["rowid > ?"]) + f" ORDER BY rowid LIMIT {int(chunk_size)}"
+            rows = self._conn().execute(sql, params + [last_rowid]).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1]["rowid"]
+
+            now = datetime.datetime.utcnow()
+            with self._transaction() as conn:
+                for row in rows:
+                    job = _reset_for_replay(_from_row(row, DLQ_COLUMNS), now)
+                    job.setdefault("priority", 0)
+                    try:
+                        conn.execute(insert, self._job_params(job))
+                    except sqlite3.IntegrityError:
+                        skipped += 1
+                        on_conflict(job["id"])
+                        continue
+                    conn.execute("DELETE FROM dlq WHERE rowid = ?", (row["rowid"],))
+                    moved += 1
+
+            on_progress(moved, skipped)
+            if rate:
+                ahead = (moved + skipped) / rate - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+        return moved, skipped
+
+    def watch(self, pipeline):
+        # No change feed: idle workers use the adaptive backoff instead
+        return None
+
+    # --- Schedules ---
+
+    def add_schedule(self, schedule):
+        try:
+            self._conn().execute(
+                "INSERT INTO schedules (name, next_run, doc) VALUES (?, ?, ?)",
+                (schedule["name"], _sql_time(schedule["next_run"]), _doc_json(schedule, SCHEDULE_COLUMNS))
+            )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def list_schedules(self):
+        schedules = []
+        for row in self._conn().execute("SELECT rowid, * FROM schedules ORDER BY name"):
+            schedule = _from_row(row, SCHEDULE_COLUMNS)
+            del schedule["_id"]
+            schedules.append(schedule)
+        return schedules
+
+    def remove_schedule(self, name):
+        return self._conn().execute("DELETE FROM schedules WHERE name = ?", (name,)).rowcount == 1
+
+    def advance_schedule(self, name, fired_run, next_run, fired_at):
+        cursor = self._conn().execute(
+            """UPDATE schedules SET next_run = ?,
+                   doc = json_set(doc, '$.last_run', json(?), '$.last_fired_at', json(?))
+               WHERE name = ? AND next_run = ?""",
+            (_sql_time(next_run), json.dumps(fired_run, default=_json_default),
+             json.dumps(fired_at, default=_json_default), name, _sql_time(fired_run))
+        )
+        return cursor.rowcount == 1
+
+    def acquire_lease(self, name, owner, lease_seconds):
+        now = datetime.datetime.utcnow()
+        cursor = self._conn().execute(
+            """INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+               ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+               WHERE leases.owner = excluded.owner OR leases.expires_at < ?""",
+            (name, owner, _sql_time(now + datetime.timedelta(seconds=lease_seconds)), _sql_time(now))
+        )
+        return cursor.rowcount == 1
+
+    def release_lease(self, name, owner):
+        self._conn().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def seconds_until_next_due(self, queues=None):
+        now = datetime.datetime.utcnow()
+        sql = "SELECT MIN(run_at) FROM jobs WHERE state = 'pending' AND run_at > ?"
+        params = [_sql_time(now)]
+        if queues:
+            sql += f" AND queue IN ({', '.join('?' * len(queues))})"
+            params += queues
+        value = self._conn().execute(sql, params).fetchone()[0]
+        if value is None:
+            return None
+        return max((datetime.datetime.fromisoformat(value) - now).total_seconds(), 0)
@@ -0,0 +1,254 @@
+# supervisor.py
+import datetime
+import math
+import os
+import signal
+import sys
+import time
+from multiprocessing import Process
+from db import get_db, ensure_indexes, reset_client, STATS_COLLECTION
+from counters import read_counts
+from jobs import DEFAULT_QUEUE
+from worker import start_worker
+import metrics
+
+SUPERVISOR_STATS_ID = "supervisor"
+MAX_DECISIONS = 20  # Most recent scaling/restart decisions kept for 'status'
+STABLE_SECONDS = 60 # A worker that lived this long resets its crash streak
+
+RUNNING = True
+
+def handle_shutdown(sig, frame):
+    global RUNNING
+    if RUNNING:
+        print("Supervisor: 🛑 Shutdown signal received. Stopping workers...")
+        RUNNING = False
+
+def _run_worker(*args):
+    # Never share the supervisor's MongoClient across fork
+    reset_client()
+    start_worker(*args)
+
+def measure_backlog(db, queues):
+    """
+    Return (pending, oldest_wait_seconds) for the given queues.
+    Pending comes from the live counters (one find_one); the wait is how
+    long the oldest *due* pending job has been ready to run.
+    """
+    counts = read_counts(db)
+    if counts is not None:
+        per_queue = counts.get("queues", {})
+        pending = sum(per_queue.get(queue, {}).get("pending", 0) for queue in queues)
+    else:
+        pending = db["jobs"].count_documents({"state": "pending", "queue": _queues_filter(queues)})
+
+    now = datetime.datetime.utcnow()
+    oldest = db["jobs"].find_one(
+        {"state": "pending", "run_at": {"$lte": now}, "queue": _queues_filter(queues)},
+        {"run_at": 1},
+        sort=[("run_at", 1)]
+    )
+    oldest_wait = (now - oldest["run_at"]).total_seconds() if oldest else 0
+    return pending, max(oldest_wait, 0)
+
+def _queues_filter(queues):
+    if len(queues) == 1:
+        return queues[0]
+    return {"$in": queues}
+
+def desired_workers(current, pending, oldest_wait, config):
+    """
+    Target pool size: enough workers for the backlog at
+    `supervisor_backlog_per_worker` pending jobs each, plus one more
+    whenever the oldest due job has waited past `supervisor_max_wait`,
+    clamped to [supervisor_min_workers, supervisor_max_workers].
+    """
+    low, high = config["supervisor_min_workers"], config["supervisor_max_workers"]
+    target = math.ceil(pending / max(config["supervisor_backlog_per_worker"], 1))
+    if oldest_wait > config["supervisor_max_wait"]:
+        target = max(target, current + 1)
+    return max(low, min(high, target))
+
+def restart_delay(crashes, config):
+    """Exponential crash-loop backoff: base, 2*base, 4*base, ... capped."""
+    return min(config["supervisor_restart_base"] * 2 ** (crashes - 1), config["supervisor_restart_max"])
+
+def record(db, slots, target, pending, oldest_wait, decisions):
+    """Publish the supervisor's state (and any new decisions) for 'status'."""
+    now = datetime.datetime.utcnow()
+    update = {"$set": {
+        "pid": os.getpid(),
+        "workers": [slot["process"].pid for slot in slots if slot["process"] is not None],
+        "target": target,
+        "pending": pending,
+        "oldest_wait": oldest_wait,
+        "restarts_waiting": sum(1 for slot in slots if slot["process"] is None),
+        "updated_at": now
+    }}
+    if decisions:
+        update["$push"] = {"decisions": {
+            "$each": [{"at": now, "message": message} for message in decisions],
+            "$slice": -MAX_DECISIONS
+        }}
+    db[STATS_COLLECTION].update_one({"_id": SUPERVISOR_STATS_ID}, update, upsert=True)
+
+def read_supervisor(db):
+    return db[STATS_COLLECTION].find_one({"_id": SUPERVISOR_STATS_ID})
+
+def run_supervisor(config, queues=None, weights=None, prefetch=1, concurrency=1):
+    """
+    Long-running supervisor. Keeps between supervisor_min_workers and
+    supervisor_max_workers worker processes alive, resizing the pool every
+    supervisor_interval seconds from the pending backlog and the age of
+    the oldest due job. Scaling up is immediate; scaling down waits until
+    the pool has been too big for supervisor_scale_down_after seconds and
+    then drops one worker at a time.
+    Children that die on their own are restarted with exponential backoff,
+    so a worker that crashes on startup can't spin in a tight loop.
+    Every decision is written to the stats collection for 'status', and
+    pool size, restarts and resizes are published as metrics each round.
+    """
+    metrics.reset()
+
+    pid = os.getpid()
+    try:
+        os.makedirs("logs", exist_ok=True)
+        log_file_path = f"logs/supervisor_{pid}.log"
+        print(f"Supervisor {pid} starting. Logging to {log_file_path}")
+        sys.stdout = open(log_file_path, 'a', buffering=1, encoding='utf-8')
+        sys.stderr = sys.stdout
+    except Exception as e:
+        print(f"CRITICAL: Supervisor {pid} failed to open log file. Exiting. Error: {e}")
+        return
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, handle_shutdown)
+
+    queues = queues or [DEFAULT_QUEUE]
+    print(f"--- Supervisor {pid} log started at {datetime.datetime.utcnow()} ---")
+    print(f"Pool size: {config['supervisor_min_workers']}-{config['supervisor_max_workers']} worker(s), serving {', '.join(queues)}")
+
+    reset_client()
+    try:
+        db, _, _ = get_db()
+        if db is None:
+            raise Exception("Database connection failed. get_db() returned None.")
+        ensure_indexes()
+    except Exception as e:
+        print(f"CRITICAL: Supervisor {pid} could not connect to DB. Exiting. Error: {e}")
+        return
+
+    worker_args = (config["backoff_base"], prefetch, concurrency,
+                   (config["idle_backoff_min"], config["idle_backoff_max"]), config, queues, weights)
+
+    # One slot per wanted worker: the live process (None while waiting to
+    # restart), when it started, its crash streak and when it may restart.
+    slots = []
+    stopping = []
+    oversized_since = None
+    target = config["supervisor_min_workers"]
+    pending, oldest_wait = 0, 0
+
+    def spawn(slot):
+        process = Process(target=_run_worker, args=worker_args)
+        process.start()
+        slot.update(process=process, started_at=time.monotonic(), restart_at=None)
+        return process.pid
+
+    while RUNNING:
+        decisions = []
+        now = time.monotonic()
+
+        # --- 1. Self-heal: notice dead children, restart with backoff ---
+        for slot in slots:
+            process = slot["process"]
+            if process is not None and not process.is_alive():
+                process.join()
+                if now - slot["started_at"] >= STABLE_SECONDS:
+                    slot["crashes"] = 0
+                slot["crashes"] += 1
+                delay = restart_delay(slot["crashes"], config)
+                slot.update(process=None, restart_at=now + delay)
+                decisions.append(f"worker {process.pid} exited with code {process.exitcode}; restarting in {delay:g}s (crash #{slot['crashes']})")
+            if slot["process"] is None and slot["restart_at"] <= now:
+                decisions.append(f"restarted worker as PID {spawn(slot)}")
+                metrics.SUPERVISOR_RESTARTS.inc()
+        for process in stopping[:]:
+            if not process.is_alive():
+                process.join()
+                stopping.remove(process)
+
+        # --- 2. Autoscale on backlog and wait time ---
+        try:
+            pending, oldest_wait = measure_backlog(db, queues)
+            target = desired_workers(len(slots), pending, oldest_wait, config)
+        except Exception as e:
+            print(f"Supervisor: ❌ Could not measure backlog: {e}")
+            target = max(len(slots), config["supervisor_min_workers"])
+
+        reason = f"pending {pending}, oldest waiting {oldest_wait:.0f}s"
+        if target > len(slots):
+            oversized_since = None
+            added = target - len(slots)
+            for _ in range(added):
+                slot = {"process": None, "started_at": now, "crashes": 0, "restart_at": None}
+                spawn(slot)
+                slots.append(slot)
+            decisions.append(f"scaled up to {target} worker(s) ({reason})")
+            metrics.SUPERVISOR_SCALING.inc(direction="up")
+        elif target < len(slots):
+            if oversized_since is None:
+                oversized_since = now
+            elif now - oversized_since >= config["supervisor_scale_down_after"]:
+                # Retire the newest worker; it finishes its current jobs first
+                slot = slots.pop()
+                if slot["process"] is not None:
+                    slot["process"].terminate()
+                    stopping.append(slot["process"])
+                oversized_since = now
+                decisions.append(f"scaled down to {len(slots)} worker(s) ({reason})")
+                metrics.SUPERVISOR_SCALING.inc(direction="down")
+        else:
+            oversized_since = None
+
+        for message in decisions:
+            print(f"Supervisor: {message}")
+        try:
+            record(db, slots, target, pending, oldest_wait, decisions)
+        except Exception as e:
+            print(f"Supervisor: ❌ Could not record state: {e}")
+        metrics.SUPERVISOR_WORKERS.set(sum(1 for slot in slots if slot["process"] is not None))
+        metrics.SUPERVISOR_TARGET.set(target)
+        metrics.SUPERVISOR_PENDING.set(pending)
+        try:
+            metrics.write_snapshot(f"supervisor_{pid}")
+        except Exception as e:
+            print(f"Supervisor: ❌ Writing metrics failed: {e}")
+
+        deadline = time.monotonic() + config["supervisor_interval"]
+        while RUNNING and time.monotonic() < deadline:
+            time.sleep(0.2)
+
+    # --- 3. Graceful shutdown: SIGTERM every child, wait for them to drain ---
+    children = [slot["process"] for slot in slots if slot["process"] is not None] + stopping
+    for process in children:
+        if process.is_alive():
+            process.terminate()
+    for process in children:
+        process.join()
+    try:
+        db[STATS_COLLECTION].update_one(
+            {"_id": SUPERVISOR_STATS_ID},
+            {"$set": {"pid": None, "workers": [], "updated_at": datetime.datetime.utcnow()},
+             "$push": {"decisions": {"$each": [{"at": datetime.datetime.utcnow(), "message": "supervisor stopped"}], "$slice": -MAX_DECISIONS}}}
+        )
+    except Exception:
+        pass
+    # A stopped supervisor runs no workers: don't leave its last gauges behind
+    for gauge in (metrics.SUPERVISOR_WORKERS, metrics.SUPERVISOR_TARGET, metrics.SUPERVISOR_PENDING):
+        gauge.set(0)
+    try:
+        metrics.write_snapshot(f"supervisor_{pid}")
+    except Exception:
+        pass
+    print(f"Supervisor {pid}: ✅ All workers stopped. Exiting.")
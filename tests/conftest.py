@@ -0,0 +1,159 @@
+# conftest.py
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+import pytest
+
+# The modules live at the top of the repo, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import dead_letter
+from config import CONFIG_FILE, DEFAULT_CONFIG
+from jobs import build_job
+from storage import MongoStore, SQLiteStore
+
+BACKENDS = ("sqlite", "mongo")
+
+@pytest.fixture
+def config(tmp_path):
+    return dict(DEFAULT_CONFIG, backend="sqlite", sqlite_path=str(tmp_path / "queuectl.db"))
+
+@pytest.fixture
+def sqlite_store(tmp_path, monkeypatch, config):
+    """A fresh SQLite store; the test runs in its own directory so config, logs and spool files stay out of the repo."""
+    monkeypatch.chdir(tmp_path)
+    store = SQLiteStore(config["sqlite_path"], config["result_cache_max"])
+    store.setup()
+    return store
+
+@pytest.fixture
+def mongo_store(tmp_path, monkeypatch, config):
+    """A MongoStore on an in-memory mongomock server, set up like a standalone MongoDB."""
+    mongomock = pytest.importorskip("mongomock")
+    monkeypatch.chdir(tmp_path)
+    client = mongomock.MongoClient()
+    _patch_mongomock(monkeypatch, mongomock)
+    monkeypatch.setattr(db, "_client", client)
+    monkeypatch.setattr(db, "_indexes_ensured", False)
+    monkeypatch.setattr(dead_letter, "_transactions_supported", False)
+    store = MongoStore(client[db.DB_NAME], config["result_cache_max"])
+    store.setup()
+    return store
+
+@pytest.fixture(params=BACKENDS)
+def store(request):
+    """Each test using this runs once per backend."""
+    return request.getfixturevalue(f"{request.param}_store")
+
+@pytest.fixture
+def enqueue(store, config):
+    """enqueue(job_id, command="echo hi", seconds_ago=0, **build_job options) -> the inserted job."""
+    def enqueue(job_id, command="echo hi", seconds_ago=0, **kwargs):
+        now = datetime.datetime.utcnow() - datetime.timedelta(seconds=seconds_ago)
+        job = build_job(job_id, command, config, now=now, **kwargs)
+        assert store.enqueue([job]) == (1, [])
+        return job
+    return enqueue
+
+@pytest.fixture
+def enqueue_many(store, config):
+    """enqueue_many(count, command="echo hi", **build_job options): jobs 'job-0', 'job-1', ... in that FIFO order."""
+    def enqueue_many(count, command="echo hi", **kwargs):
+        now = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        # Milliseconds apart: MongoDB keeps no finer times
+        jobs = [build_job(f"job-{i}", command, config, now=now + datetime.timedelta(milliseconds=i), **kwargs)
+                for i in range(count)]
+        assert store.enqueue(jobs) == (count, [])
+        return jobs
+    return enqueue_many
+
+@pytest.fixture
+def run_cli(store, config):
+    """run_cli(*args, input=None) -> click's Result for one queuectl command on the test store."""
+    from click.testing import CliRunner
+    from queuectl import cli
+    with open(CONFIG_FILE, "w") as f:
+        json.dump(dict(config, backend=store.name), f)
+    runner = CliRunner()
+    def run_cli(*args, input=None):
+        return runner.invoke(cli, list(args), input=input, catch_exceptions=False)
+    return run_cli
+
+@pytest.fixture
+def run_worker(sqlite_store, config, monkeypatch):
+    """
+    run_worker(until, **start_worker options): run a worker in this process
+    on the SQLite test store until `until()` holds (at most `timeout`
+    seconds), then stop it as SIGTERM would. Returns the seconds it ran.
+    """
+    import worker
+    # start_worker sends its output to logs/ and installs signal handlers; undo both afterwards
+    monkeypatch.setattr(sys, "stdout", sys.stdout)
+    monkeypatch.setattr(sys, "stderr", sys.stderr)
+    monkeypatch.setattr(worker.signal, "signal", lambda signum, handler: None)
+
+    def run_worker(until, timeout=10, **options):
+        monkeypatch.setattr(worker, "RUNNING", True)
+        started = time.monotonic()
+        def stop_when_done():
+            while not until() and time.monotonic() - started < timeout:
+                time.sleep(0.02)
+            worker.RUNNING = False
+        watcher = threading.Thread(target=stop_when_done, daemon=True)
+        watcher.start()
+        worker.start_worker(config["backoff_base"], config=config, idle_backoff=(0.02, 0.1), **options)
+        watcher.join()
+        return time.monotonic() - started
+    return run_worker
+
+def _patch_mongomock(monkeypatch, mongomock):
+    """Fill the gaps between mongomock and the pymongo the store is written against."""
+    from mongomock import aggregate, helpers
+    from pymongo import UpdateMany
+    from pymongo.errors import DuplicateKeyError
+    from pymongo.results import BulkWriteResult
+
+    def ensure_uniques(self, new_data):
+        # As on MongoDB, the error names the index: the store tells dedup conflicts from duplicate ids by it
+        for name, index in self._store.indexes.items():
+            if not index.get("unique"):
+                continue
+            values = {}
+            for key, _ in index["key"]:
+                try:
+                    values[key] = helpers.get_value_by_dot(new_data, key)
+                except KeyError:
+                    values[key] = None
+            if index.get("sparse") and set(values.values()) == {None}:
+                continue
+            if len(list(self._iter_documents(values))) > 1:
+                raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.full_name} index: {name} dup key: {values}", 11000)
+
+    def unset_stage(collection, database, fields):
+        fields = [fields] if isinstance(fields, str) else fields
+        return aggregate._handle_project_stage(collection, database, {field: 0 for field in fields})
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        # Only the update operations the store sends; newer pymongo changed the hook mongomock uses
+        matched = modified = 0
+        for request in requests:
+            update = self.update_many if isinstance(request, UpdateMany) else self.update_one
+            result = update(request._filter, request._doc)
+            matched += result.matched_count
+            modified += result.modified_count
+        return BulkWriteResult({"nMatched": matched, "nModified": modified, "nInserted": 0, "nUpserted": 0,
+                                "nRemoved": 0, "upserted": []}, True)
+
+    string_operator = aggregate._Parser._handle_string_operator
+    def handle_string_operator(self, operator, values):
+        # Python strings index by code point, so $substr already behaves like $substrCP
+        return string_operator(self, "$substr" if operator == "$substrCP" else operator, values)
+
+    monkeypatch.setitem(aggregate._PIPELINE_HANDLERS, "$unset", unset_stage)
+    monkeypatch.setattr(aggregate._Parser, "_handle_string_operator", handle_string_operator)
+    monkeypatch.setattr(mongomock.collection.Collection, "bulk_write", bulk_write)
+    monkeypatch.setattr(mongomock.collection.Collection, "_ensure_uniques", ensure_uniques)
@@ -0,0 +1,53 @@
+# test_archive.py
+import datetime
+import time
+import pytest
+from archive import compact, trim_history
+from db import HISTORY_COLLECTION
+
+# The history collection only exists on MongoDB
+pytestmark = pytest.mark.parametrize("store", ["mongo"], indirect=True)
+
+def complete_all(store, count):
+    for job in store.claim("w1", count):
+        assert store.complete("w1", job)
+
+def age(store, job_ids, seconds):
+    past = datetime.datetime.utcnow() - datetime.timedelta(seconds=seconds)
+    store.jobs.update_many({"id": {"$in": job_ids}}, {"$set": {"updated_at": past}})
+
+def test_compact_archives_only_old_completed_jobs(store, enqueue_many, config):
+    enqueue_many(6)
+    complete_all(store, 4)
+    age(store, ["job-0", "job-1", "job-2"], 3600)
+
+    archived, trimmed = compact(store.db, dict(config, archive_after_seconds=600, compact_batch_size=2))
+    assert (archived, trimmed) == (3, 0)
+    history = store.db[HISTORY_COLLECTION]
+    assert sorted(doc["id"] for doc in history.find()) == ["job-0", "job-1", "job-2"]
+    assert all(doc["state"] == "completed" and doc["archived_at"] for doc in history.find())
+    assert store.jobs.count_documents({}) == 3
+    counts = store.counts()
+    assert (counts["completed"], counts["pending"]) == (1, 2)
+
+def test_archived_jobs_stay_visible(store, enqueue, enqueue_many, config):
+    enqueue_many(1)
+    complete_all(store, 1)
+    compact(store.db, dict(config, archive_after_seconds=0))
+
+    assert store.find("job-0")["state"] == "completed"
+    assert store.job_states(["job-0"]) == {"job-0": "completed"}
+    # A job may still depend on an archived one
+    enqueue("child", after=["job-0"])
+    assert store.find("child")["state"] == "pending"
+
+def test_trim_history_drops_the_oldest(store, enqueue_many, config):
+    enqueue_many(5)
+    for _ in range(5):
+        complete_all(store, 1)
+        compact(store.db, dict(config, archive_after_seconds=0, history_max_docs=0))
+        time.sleep(0.002) # Distinct archived_at, even at MongoDB's millisecond precision
+
+    assert trim_history(store.db, 2) == 3
+    assert sorted(doc["id"] for doc in store.db[HISTORY_COLLECTION].find()) == ["job-3", "job-4"]
+    assert trim_history(store.db, 0) == 0
@@ -0,0 +1,34 @@
+# test_bench.py
+import json
+import os
+from bench import percentile, run_bench, summarize, write_report
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert [percentile(values, p) for p in (50, 95, 99, 100)] == [50, 95, 99, 100]
+    assert percentile([7], 99) == 7
+    assert percentile([], 50) is None
+
+def test_summarize_in_milliseconds():
+    assert summarize([0.003, 0.001, 0.002]) == {"p50": 2.0, "p95": 3.0, "p99": 3.0, "min": 1.0, "mean": 2.0, "max": 3.0}
+    assert summarize([]) is None
+
+def test_run_bench_on_a_temporary_sqlite_queue(config, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config.update(idle_backoff_min=0.01, idle_backoff_max=0.05)
+    results = []
+    report = run_bench(config, 20, [1], [2], prefetch=4, warmup=0.2, timeout=30, on_result=results.append)
+
+    scenario, = report["scenarios"]
+    assert results == [scenario]
+    assert (scenario["workers"], scenario["concurrency"], scenario["jobs"]) == (1, 2, 20)
+    assert (scenario["completed"], scenario["timed_out"]) == (20, False)
+    assert scenario["end_to_end_ms"]["p50"] <= scenario["end_to_end_ms"]["max"]
+    assert scenario["db_ops_per_job"] is None
+    assert report["backend"] == "sqlite" and report["command"] == ["true"]
+    # The real queue file is never touched
+    assert not os.path.exists(config["sqlite_path"])
+
+    path = tmp_path / "report.json"
+    write_report(report, path)
+    assert json.loads(path.read_text())["scenarios"][0]["completed"] == 20
@@ -0,0 +1,48 @@
+# test_callables.py
+import pytest
+import callables
+from limits import FAILURE_COMMAND, FAILURE_TIMEOUT
+
+@pytest.fixture
+def call(tmp_path, monkeypatch):
+    """Run a callable job with its spool files under tmp_path; stop the pool afterwards."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "tasks.py").write_text(
+        "import time\n"
+        "def add(a, b=0):\n    print('adding')\n    return a + b\n"
+        "def fail():\n    raise RuntimeError('nope')\n"
+        "def nap(seconds):\n    time.sleep(seconds)\n"
+    )
+    out, err = tmp_path / "job.out", tmp_path / "job.err"
+    def call(command, *args, limits=None, **kwargs):
+        job = {"id": "job", "command": command, "args": list(args), "kwargs": kwargs}
+        return callables.run_callable(job, limits or {}, str(out), str(err))
+    call.out, call.err = out, err
+    yield call
+    callables.shutdown_pool()
+    callables.configure_pool(100)
+
+def test_result_and_output(call):
+    returncode, usage, failure_class, result = call("tasks:add", 2, b=3)
+    assert (returncode, failure_class, result) == (0, None, 5)
+    assert call.out.read_text() == "adding\n"
+    assert usage["cpu_seconds"] is not None
+
+def test_exception_is_a_command_failure(call):
+    returncode, _, failure_class, result = call("tasks:fail")
+    assert (returncode, failure_class, result) == (1, FAILURE_COMMAND, None)
+    assert "RuntimeError: nope" in call.err.read_text()
+
+def test_runner_is_reused_until_max_tasks(call):
+    callables.configure_pool(2)
+    pids = [call("os:getpid")[3] for _ in range(4)]
+    assert pids[0] == pids[1]
+    assert pids[2] == pids[3]
+    assert pids[1] != pids[2]
+
+def test_timeout_kills_the_runner(call):
+    first = call("os:getpid")[3]
+    returncode, _, failure_class, _ = call("tasks:nap", 10, limits={"timeout": 0.2})
+    assert (returncode, failure_class) == (None, FAILURE_TIMEOUT)
+    # The runner that was killed is not handed out again
+    assert call("os:getpid")[3] != first
@@ -0,0 +1,92 @@
+# test_cron.py
+import datetime
+import pytest
+from cron import CronExpression
+from scheduler import LEADER_LEASE, build_schedule_job, new_schedule
+
+T = datetime.datetime(2024, 1, 15, 10, 30, 20) # A Monday
+
+def fires(text, moment=T, count=1):
+    expression = CronExpression(text)
+    runs = []
+    for _ in range(count):
+        moment = expression.next_after(moment)
+        runs.append(moment)
+    return runs if count > 1 else runs[0]
+
+def test_fires_strictly_after_the_moment():
+    assert fires("* * * * *") == datetime.datetime(2024, 1, 15, 10, 31)
+    assert fires("31 * * * *", T.replace(minute=31, second=0)) == datetime.datetime(2024, 1, 15, 11, 31)
+
+def test_macros():
+    assert fires("@hourly") == datetime.datetime(2024, 1, 15, 11, 0)
+    assert fires("@daily") == datetime.datetime(2024, 1, 16, 0, 0)
+    assert fires("@weekly") == datetime.datetime(2024, 1, 21, 0, 0)
+    assert fires("@monthly") == datetime.datetime(2024, 2, 1, 0, 0)
+    assert fires("@YEARLY") == datetime.datetime(2025, 1, 1, 0, 0)
+
+def test_steps_ranges_and_lists():
+    assert fires("*/20 * * * *", count=3) == [datetime.datetime(2024, 1, 15, 10, 40), datetime.datetime(2024, 1, 15, 11, 0),
+                                              datetime.datetime(2024, 1, 15, 11, 20)]
+    assert fires("0 9-17/4 * * *", count=3) == [datetime.datetime(2024, 1, 15, 13, 0), datetime.datetime(2024, 1, 15, 17, 0),
+                                                datetime.datetime(2024, 1, 16, 9, 0)]
+    assert fires("15,45 10 * * *", count=2) == [datetime.datetime(2024, 1, 15, 10, 45), datetime.datetime(2024, 1, 16, 10, 15)]
+    assert fires("50/5 * * * *", count=3) == [datetime.datetime(2024, 1, 15, 10, 50), datetime.datetime(2024, 1, 15, 10, 55),
+                                              datetime.datetime(2024, 1, 15, 11, 50)]
+
+def test_names_and_sunday_as_seven():
+    assert fires("0 0 * feb mon") == datetime.datetime(2024, 2, 5, 0, 0)
+    assert fires("0 0 * * 7") == fires("0 0 * * sun") == datetime.datetime(2024, 1, 21, 0, 0)
+    assert fires("0 0 * * 5-7", count=3) == [datetime.datetime(2024, 1, 19), datetime.datetime(2024, 1, 20),
+                                             datetime.datetime(2024, 1, 21)]
+
+def test_restricted_day_fields_match_either():
+    # The 20th (a Saturday) or any Wednesday
+    assert fires("0 0 20 * wed", count=3) == [datetime.datetime(2024, 1, 17), datetime.datetime(2024, 1, 20),
+                                              datetime.datetime(2024, 1, 24)]
+    # With one day field left as '*', only the other restricts
+    assert fires("0 0 20 * *") == datetime.datetime(2024, 1, 20)
+
+def test_leap_day():
+    assert fires("0 0 29 2 *") == datetime.datetime(2024, 2, 29)
+    assert fires("0 0 29 2 *", datetime.datetime(2024, 3, 1)) == datetime.datetime(2028, 2, 29)
+
+@pytest.mark.parametrize("text", ["* * * *", "* * * * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * 13 *",
+                                  "* * * * 8", "*/0 * * * *", "*/x * * * *", "5-1 * * * *", "foo * * * *", "@sometimes"])
+def test_invalid_expressions(text):
+    with pytest.raises(ValueError):
+        CronExpression(text)
+
+def test_never_fires():
+    with pytest.raises(ValueError):
+        fires("0 0 31 2 *")
+
+def test_schedule_jobs_get_one_id_per_run(config):
+    schedule = new_schedule("nightly", "@daily", "echo hi", now=T)
+    assert schedule["next_run"] == datetime.datetime(2024, 1, 16)
+    job = build_schedule_job(schedule, schedule["next_run"], config)
+    assert (job["id"], job["schedule"]) == ("nightly@20240116T0000", "nightly")
+
+def test_advance_schedule_is_compare_and_set(store):
+    schedule = new_schedule("nightly", "@daily", "echo hi", now=T)
+    assert store.add_schedule(schedule)
+    assert not store.add_schedule(schedule)
+
+    fired, following = schedule["next_run"], schedule["next_run"] + datetime.timedelta(days=1)
+    assert store.advance_schedule("nightly", fired, following, T)
+    assert not store.advance_schedule("nightly", fired, following, T)
+    assert store.list_schedules()[0]["next_run"] == following
+
+def test_leader_lease(store):
+    assert store.acquire_lease(LEADER_LEASE, "a", 30)
+    assert store.acquire_lease(LEADER_LEASE, "a", 30) # Renewal
+    assert not store.acquire_lease(LEADER_LEASE, "b", 30)
+
+    store.release_lease(LEADER_LEASE, "b") # Not the owner: no effect
+    assert not store.acquire_lease(LEADER_LEASE, "b", 30)
+    store.release_lease(LEADER_LEASE, "a")
+    assert store.acquire_lease(LEADER_LEASE, "b", 30)
+
+def test_expired_leader_lease_can_be_taken(store):
+    assert store.acquire_lease(LEADER_LEASE, "a", -1)
+    assert store.acquire_lease(LEADER_LEASE, "b", 30)
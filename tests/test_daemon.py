@@ -0,0 +1,87 @@
+# test_daemon.py
+import multiprocessing
+import os
+import socket
+import time
+import pytest
+import daemon
+from queuectl import cli
+
+@pytest.mark.parametrize("argv", [
+    ["status"],
+    ["list", "--state", "pending"],
+    ["dlq", "list"],
+    ["enqueue", "a", "echo hi"],
+    ["schedule", "list"],
+])
+def test_short_commands_are_forwarded(argv):
+    assert daemon.is_forwardable(argv)
+
+@pytest.mark.parametrize("argv", [
+    [],
+    ["worker", "start"],
+    ["enqueue-batch", "jobs.jsonl"],
+    ["schedule", "run"],
+    ["metrics", "serve"],
+    ["dlq", "retry", "--all"],
+    ["dlq", "retry", "--error-contains", "refused", "--rate", "5"],
+    ["status", "--watch"],
+    ["logs", "a", "--follow"],
+    ["list", "--help"],
+    ["status", "--loop=2"],
+])
+def test_long_or_interactive_commands_run_locally(argv):
+    assert not daemon.is_forwardable(argv)
+
+@pytest.mark.parametrize("store", ["sqlite"], indirect=True)
+def test_run_command_captures_output_and_exit_code(store, run_cli):
+    reply = daemon.run_command(cli, ["enqueue", "a", "echo hi"])
+    assert reply["exit_code"] == 0
+    assert "Job enqueued with ID: a" in reply["stdout"]
+    assert reply["stderr"] == ""
+    assert store.find("a")["state"] == "pending"
+
+    reply = daemon.run_command(cli, ["list", "--state", "bogus"])
+    assert reply["exit_code"] == 2
+    assert "bogus" in reply["stderr"]
+
+def test_forward_falls_back_without_a_daemon(tmp_path, monkeypatch):
+    path = str(tmp_path / "d.sock")
+    assert daemon.forward(["status"], path) is None
+    # A socket file nobody listens on is stale
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(path)
+    assert daemon.forward(["status"], path) is None
+    monkeypatch.setenv(daemon.DISABLE_ENV, "1")
+    assert daemon.forward(["status"], path) is None
+
+class EchoCli:
+    """Stands in for the click group: serve() only calls main()."""
+    def main(self, argv, **kwargs):
+        print(" ".join(argv))
+
+def serve(path):
+    daemon.serve(EchoCli(), path)
+
+def test_silent_client_does_not_block_the_daemon(tmp_path, monkeypatch):
+    monkeypatch.setattr(daemon, "REQUEST_TIMEOUT", 0.2)
+    path = str(tmp_path / "d.sock")
+    server = multiprocessing.get_context("fork").Process(target=serve, args=(path,))
+    server.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not daemon.daemon_status(path):
+            assert time.monotonic() < deadline, "daemon did not start"
+            time.sleep(0.02)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as silent:
+            silent.connect(path) # ... and never sends anything
+            started = time.monotonic()
+            reply = daemon._request({"argv": ["status"]}, path, timeout=5)
+            assert reply == {"stdout": "status\n", "stderr": "", "exit_code": 0}
+            assert time.monotonic() - started < 2
+        assert daemon.daemon_status(path)["served"] == 1
+    finally:
+        daemon.stop_daemon(path)
+        server.join(5)
+    assert not os.path.exists(path)
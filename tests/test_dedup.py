@@ -0,0 +1,73 @@
+# test_dedup.py
+from jobs import build_job, default_dedup_key, KIND_ARGV
+
+def job(config, job_id, command="echo hi", **kwargs):
+    return build_job(job_id, command, config, dedup_key=kwargs.pop("dedup_key", True), **kwargs)
+
+def finish(store, output="hi"):
+    claimed, = store.claim("w1", 1)
+    assert store.complete("w1", dict(claimed, output=output))
+
+def test_default_key_depends_on_the_work_only(config):
+    a = build_job("a", "echo hi", config)
+    b = build_job("b", "echo hi", config, priority=5, queue="other")
+    assert default_dedup_key(a) == default_dedup_key(b)
+    assert default_dedup_key(a) != default_dedup_key(build_job("c", "echo bye", config))
+    assert default_dedup_key(a) != default_dedup_key(build_job("d", "echo hi", config, kind=KIND_ARGV))
+
+def test_duplicate_folds_into_active_job(store, config):
+    assert store.enqueue([job(config, "a")]) == (1, [])
+    duplicate = job(config, "b")
+    assert store.enqueue([duplicate]) == (0, [])
+    assert duplicate["folded_into"] == "a"
+    assert store.find("b") is None
+
+    # Still folded while the first one runs
+    store.claim("w1", 1)
+    again = job(config, "c")
+    store.enqueue([again])
+    assert again["folded_into"] == "a"
+
+def test_explicit_keys(store, config):
+    store.enqueue([job(config, "a", "echo one", dedup_key="nightly-report")])
+    other = job(config, "b", "echo two", dedup_key="nightly-report")
+    store.enqueue([other])
+    assert other["folded_into"] == "a"
+
+def test_duplicate_job_id_is_still_an_error(store, config):
+    store.enqueue([build_job("a", "echo hi", config)])
+    inserted, errors = store.enqueue([build_job("a", "echo bye", config)])
+    assert inserted == 0
+    assert len(errors) == 1 and errors[0][1] # (index, is_duplicate, message)
+
+def test_recent_result_answers_duplicate(store, config):
+    store.enqueue([job(config, "a")])
+    finish(store, output="cached output")
+
+    duplicate = job(config, "b")
+    assert store.enqueue([duplicate]) == (1, [])
+    answered = store.find("b")
+    assert (answered["state"], answered["cached_from"], answered["output"]) == ("completed", "a", "cached output")
+    assert store.claim("w1", 1) == []
+
+def test_window_zero_disables_the_cache(store, config):
+    store.enqueue([job(config, "a", dedup_window=0)])
+    finish(store)
+
+    store.enqueue([job(config, "b", dedup_window=0)])
+    assert store.find("b")["state"] == "pending"
+
+def test_dead_job_frees_its_key(store, config):
+    store.enqueue([job(config, "a")])
+    claimed, = store.claim("w1", 1)
+    store.bury("w1", dict(claimed, state="dead", last_error="boom", failure_class="command"))
+
+    assert store.enqueue([job(config, "b")]) == (1, [])
+    assert store.find("b")["state"] == "pending"
+
+def test_waiting_job_is_not_answered_from_cache(store, config):
+    store.enqueue([job(config, "a")])
+    finish(store)
+
+    store.enqueue([build_job("parent", "echo parent", config), job(config, "b", after=["parent"])])
+    assert store.find("b")["state"] == "waiting"
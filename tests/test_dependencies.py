@@ -0,0 +1,57 @@
+# test_dependencies.py
+import pytest
+from jobs import build_job
+
+def run(store, job_id):
+    """Claim `job_id` (it must be the only claimable job) and return it."""
+    job, = store.claim("w1", 1)
+    assert job["id"] == job_id
+    return job
+
+def test_job_cannot_depend_on_itself(config):
+    with pytest.raises(ValueError):
+        build_job("a", "echo hi", config, after=["a"])
+
+def test_child_waits_for_every_parent(store, enqueue):
+    enqueue("p1")
+    enqueue("p2")
+    enqueue("child", after=["p1", "p2", "p1"])
+    assert store.find("child")["state"] == "waiting"
+    assert store.find("child")["deps_remaining"] == 2
+
+    first, second = store.claim("w1", 2)
+    store.complete("w1", first)
+    assert store.find("child")["state"] == "waiting"
+    store.complete("w1", second)
+    assert store.find("child")["state"] == "pending"
+    run(store, "child")
+
+def test_parent_finished_before_enqueue(store, enqueue):
+    enqueue("parent")
+    store.complete("w1", run(store, "parent"))
+
+    enqueue("child", after=["parent"])
+    assert store.find("child")["state"] == "pending"
+
+def test_failed_parent_cascades_to_dlq(store, enqueue):
+    enqueue("parent")
+    enqueue("child", after=["parent"])
+    enqueue("grandchild", after=["child"])
+
+    parent = run(store, "parent")
+    parent.update(state="dead", last_error="boom", failure_class="command")
+    store.bury("w1", parent)
+
+    for job_id in ("child", "grandchild"):
+        dead = store.find(job_id)
+        assert (dead["state"], dead["failure_class"]) == ("dead", "dependency")
+    assert store.counts() == store.counts(exact=True)
+
+def test_child_of_dead_parent_goes_straight_to_dlq(store, enqueue):
+    enqueue("parent")
+    parent = run(store, "parent")
+    store.bury("w1", dict(parent, state="dead", last_error="boom", failure_class="command"))
+
+    enqueue("child", after=["parent"])
+    assert store.find("child")["state"] == "dead"
+    assert store.job_states(["parent", "child", "missing"]) == {"parent": "dead", "child": "dead"}
@@ -0,0 +1,77 @@
+# test_dlq.py
+import time
+
+import pytest
+
+from limits import FAILURE_CLASSES, FAILURE_LEASE
+from queuectl import dlq
+
+
+@pytest.fixture
+def bury(store, enqueue):
+    """Enqueue, claim and bury a job with the given error and failure class."""
+    def bury(job_id, error="boom", failure_class="command"):
+        enqueue(job_id)
+        job, = store.claim("w1", 1)
+        assert store.bury("w1", dict(job, state="dead", last_error=error, failure_class=failure_class))
+    return bury
+
+
+def test_replay_accepts_every_failure_class():
+    option, = [param for param in dlq.commands["retry"].params if param.name == "failure_class"]
+    assert tuple(option.type.choices) == FAILURE_CLASSES
+    assert FAILURE_LEASE in option.type.choices
+
+
+def test_replay_filters(store, bury):
+    bury("net-1", error="Connection refused")
+    bury("net-2", error="connection refused by peer")
+    bury("oom-1", error="killed", failure_class="memory")
+    bury("other", error="syntax error")
+
+    assert store.count_dlq({"error_contains": "Connection refused"}) == 1
+    assert store.count_dlq({"failure_class": "memory"}) == 1
+    assert store.count_dlq({"id_pattern": "net-*"}) == 2
+
+    assert store.replay({"id_pattern": "net-*"}) == (2, 0)
+    assert store.replay({"failure_class": "memory"}) == (1, 0)
+    assert [job["id"] for job in store.list_dlq()] == ["other"]
+
+    replayed = store.find("net-1")
+    assert replayed["state"] == "pending"
+    assert replayed["attempts"] == 0
+
+
+def test_replay_single_job(store, bury):
+    bury("a")
+    bury("b")
+    assert store.replay({"job_id": "b"}) == (1, 0)
+    assert [job["id"] for job in store.list_dlq()] == ["a"]
+
+
+def test_replay_leaves_conflicts_in_dlq(store, bury, enqueue):
+    bury("a")
+    bury("b")
+    enqueue("a")
+    conflicts = []
+    assert store.replay({}, on_conflict=conflicts.append) == (1, 1)
+    assert conflicts == ["a"]
+    assert [job["id"] for job in store.list_dlq()] == ["a"]
+
+
+def test_replay_chunks(store, bury):
+    for i in range(5):
+        bury(f"job-{i}")
+    progress = []
+    assert store.replay({}, chunk_size=2, on_progress=lambda *done: progress.append(done)) == (5, 0)
+    assert progress == [(2, 0), (4, 0), (5, 0)]
+
+
+def test_replay_rate_caps_chunks_and_pace(store, bury):
+    for i in range(12):
+        bury(f"job-{i:02}")
+    progress = []
+    started = time.monotonic()
+    assert store.replay({}, rate=10, on_progress=lambda *done: progress.append(done)) == (12, 0)
+    assert progress == [(10, 0), (12, 0)]
+    assert time.monotonic() - started >= 1.1
@@ -0,0 +1,29 @@
+# test_enqueue_batch.py
+import json
+
+def test_jsonl_batch_in_chunks(store, run_cli, tmp_path):
+    rows = [{"id": f"job-{i}", "command": f"echo {i}"} for i in range(5)]
+    lines = [json.dumps(row) for row in rows] + ["", "not json", json.dumps({"id": "no-command"}), json.dumps({"command": "echo anon"})]
+    (tmp_path / "jobs.jsonl").write_text("\n".join(lines) + "\n")
+
+    result = run_cli("enqueue-batch", "jobs.jsonl", "--chunk-size", "2", "--queue", "bulk", "--priority", "3")
+    assert "Enqueued 6 job(s)" in result.output
+    assert "Line 7:" in result.output and "Line 8:" in result.output
+    assert "2 invalid row(s)" in result.output
+    job = store.find("job-4")
+    assert (job["command"], job["queue"], job["priority"], job["state"]) == ("echo 4", "bulk", 3, "pending")
+    assert store.counts()["queues"]["bulk"]["pending"] == 6
+
+def test_duplicate_ids_are_skipped(store, run_cli):
+    run_cli("enqueue-batch", input='{"id": "a", "command": "true"}\n')
+    result = run_cli("enqueue-batch", input='{"id": "a", "command": "false"}\n{"id": "b", "command": "true"}\n')
+    assert "Enqueued 1 job(s)" in result.output
+    assert "1 duplicate ID(s)" in result.output
+    assert store.find("a")["command"] == "true"
+
+def test_csv_batch_with_callable_args(store, run_cli, tmp_path):
+    (tmp_path / "jobs.csv").write_text('id,command,args\nc1,callables:echo,"[1, 2]"\nc2,callables:echo,{bad\n')
+    result = run_cli("enqueue-batch", "jobs.csv", "--kind", "callable")
+    assert "Enqueued 1 job(s)" in result.output
+    assert (store.find("c1")["kind"], store.find("c1")["args"]) == ("callable", [1, 2])
+    assert store.find("c2") is None
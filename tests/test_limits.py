@@ -0,0 +1,49 @@
+# test_limits.py
+import signal
+import sys
+from types import SimpleNamespace
+import pytest
+from limits import classify, FAILURE_COMMAND, FAILURE_CPU, FAILURE_MEMORY, FAILURE_TIMEOUT
+from output import run_spooled
+
+def usage(cpu_seconds):
+    return SimpleNamespace(ru_utime=cpu_seconds, ru_stime=0)
+
+def test_classify():
+    assert classify(0, usage(5), {"cpu_seconds": 1}) is None
+    assert classify(1, usage(0.1), {"cpu_seconds": 1}) == FAILURE_COMMAND
+    assert classify(-signal.SIGXCPU, usage(0.9), {"cpu_seconds": 1}) == FAILURE_CPU
+    assert classify(128 + signal.SIGXCPU, usage(0.9), {"cpu_seconds": 1}) == FAILURE_CPU
+    assert classify(-signal.SIGKILL, usage(1.0), {"cpu_seconds": 1}) == FAILURE_CPU
+    # Without a CPU budget a signal is just a failed command
+    assert classify(-signal.SIGXCPU, usage(5), {}) == FAILURE_COMMAND
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    def run(argv, **limits):
+        returncode, _, output, failure_class = run_spooled({"id": "job", "kind": "argv", "argv": argv}, limits, 256, 256)
+        return returncode, failure_class, output["usage"]
+    return run
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="limits are enforced through /proc and rlimits")
+def test_cpu_limit(run):
+    returncode, failure_class, used = run([sys.executable, "-c", "while True: pass"], cpu_seconds=1, timeout=20)
+    assert returncode != 0
+    assert failure_class == FAILURE_CPU
+    assert used["cpu_seconds"] >= 0.9
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="limits are enforced through /proc and rlimits")
+def test_memory_limit(run):
+    script = 'import time; block = b"x" * (200 * 1024 * 1024); time.sleep(20)'
+    returncode, failure_class, _ = run([sys.executable, "-c", script], max_rss=64, timeout=20)
+    assert returncode == -signal.SIGKILL
+    assert failure_class == FAILURE_MEMORY
+
+def test_timeout(run):
+    returncode, failure_class, _ = run(["sleep", "20"], timeout=0.2)
+    assert returncode == -signal.SIGKILL
+    assert failure_class == FAILURE_TIMEOUT
+
+def test_plain_failure(run):
+    assert run(["sh", "-c", "exit 3"], cpu_seconds=5)[:2] == (3, FAILURE_COMMAND)
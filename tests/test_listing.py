@@ -0,0 +1,50 @@
+# test_listing.py
+import datetime
+import pytest
+from jobs import build_job
+from listing import decode_cursor, encode_cursor
+
+def pages(store, limit, **filters):
+    """Every page of list_jobs, following the cursor of each page's last row."""
+    result, after = [], None
+    while True:
+        page = list(store.list_jobs(after=after, limit=limit, **filters))
+        if not page:
+            return result
+        result.append([job["id"] for job in page])
+        after = encode_cursor(page[-1], "created_at")
+
+def test_pages_cover_every_job_once_even_with_equal_times(store, config):
+    now = datetime.datetime(2024, 1, 15, 10, 30)
+    # Four jobs share one created_at: only _id tells them apart
+    times = [now - datetime.timedelta(seconds=n) for n in (0, 0, 0, 0, 1, 2, 3)]
+    store.enqueue([build_job(f"job-{i}", "true", config, now=at) for i, at in enumerate(times)])
+
+    result = pages(store, 3)
+    assert [len(page) for page in result] == [3, 3, 1]
+    ids = [job_id for page in result for job_id in page]
+    assert sorted(ids) == sorted(f"job-{i}" for i in range(7))
+    assert ids[4:] == ["job-4", "job-5", "job-6"] # Newest first
+
+def test_pages_respect_filters(store, enqueue_many):
+    enqueue_many(5, queue="a")
+    store.claim("w1", 2, queues=["a"])
+    assert pages(store, 2, state="pending", queue="a") == [["job-4", "job-3"], ["job-2"]]
+    assert pages(store, 2, queue="b") == []
+
+def test_projection_and_error_truncation(store, enqueue):
+    enqueue("a")
+    job, = store.claim("w1", 1)
+    store.retry("w1", job, 1, datetime.datetime.utcnow() + datetime.timedelta(hours=1), "x" * 500, "command")
+
+    row, = store.list_jobs(fields=["id", "last_error"], error_chars=10)
+    assert row["last_error"] == "x" * 10
+    assert "command" not in row
+    full, = store.list_jobs(limit=0)
+    assert full["command"] == "echo hi"
+
+def test_cursor_round_trip():
+    at = datetime.datetime(2024, 1, 15, 10, 30, 0, 123000)
+    assert decode_cursor(encode_cursor({"_id": 42, "created_at": at}, "created_at")) == (at, 42)
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
@@ -0,0 +1,73 @@
+# test_metrics.py
+import os
+import time
+import pytest
+import metrics
+from metrics import JOBS_COMPLETED, SPAWN_SECONDS, SUPERVISOR_WORKERS
+
+@pytest.fixture(autouse=True)
+def clean(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metrics.reset()
+    yield
+    metrics.reset()
+
+def publish(name, completed, workers):
+    """Write a snapshot as the process `name` would."""
+    metrics.reset()
+    JOBS_COMPLETED.inc(completed, queue="default")
+    SUPERVISOR_WORKERS.set(workers)
+    metrics.write_snapshot(name)
+
+def age(name, seconds):
+    path = os.path.join(metrics.METRICS_DIR, f"{name}.json")
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+def samples(families, metric):
+    return families[metric.name]["samples"]
+
+def test_aggregate_sums_every_process():
+    publish("worker_1", 3, 1)
+    publish("worker_2", 4, 2)
+    families = metrics.aggregate(metrics.METRICS_DIR)
+    assert samples(families, JOBS_COMPLETED) == {("default",): 7}
+    assert samples(families, SUPERVISOR_WORKERS) == {(): 3}
+
+def test_retired_counters_stay_and_gauges_go():
+    publish("worker_1", 3, 1)
+    publish("worker_2", 4, 2)
+    age("worker_1", 600)
+    assert metrics.retire_stale(metrics.METRICS_DIR, stale_seconds=60) == 1
+    assert not os.path.exists(os.path.join(metrics.METRICS_DIR, "worker_1.json"))
+    assert metrics.retire_stale(metrics.METRICS_DIR, stale_seconds=60) == 0
+
+    families = metrics.aggregate(metrics.METRICS_DIR)
+    assert samples(families, JOBS_COMPLETED) == {("default",): 7}
+    assert samples(families, SUPERVISOR_WORKERS) == {(): 2}
+
+    # The replacement worker starts from zero; the pool total still only grows
+    publish("worker_3", 1, 1)
+    assert samples(metrics.aggregate(metrics.METRICS_DIR), JOBS_COMPLETED) == {("default",): 8}
+
+def test_aggregate_retires_with_stale_seconds():
+    publish("worker_1", 3, 5)
+    age("worker_1", 600)
+    families = metrics.aggregate(metrics.METRICS_DIR, stale_seconds=60)
+    assert samples(families, JOBS_COMPLETED) == {("default",): 3}
+    assert SUPERVISOR_WORKERS.name not in families
+
+def test_stale_after_follows_the_slowest_publisher(config):
+    config.update(metrics_interval=5.0, supervisor_interval=10.0)
+    assert metrics.stale_after(config) == metrics.STALE_INTERVALS * 10.0
+
+def test_render_histogram_buckets_are_cumulative():
+    SPAWN_SECONDS.observe(0.002, kind="argv")
+    SPAWN_SECONDS.observe(0.02, kind="argv")
+    SPAWN_SECONDS.observe(1000, kind="argv")
+    metrics.write_snapshot("worker_1")
+    text = metrics.render(metrics.aggregate(metrics.METRICS_DIR))
+    assert 'queuectl_spawn_seconds_bucket{kind="argv",le="0.0025"} 1' in text
+    assert 'queuectl_spawn_seconds_bucket{kind="argv",le="0.025"} 2' in text
+    assert 'queuectl_spawn_seconds_bucket{kind="argv",le="+Inf"} 3' in text
+    assert 'queuectl_spawn_seconds_count{kind="argv"} 3' in text
@@ -0,0 +1,81 @@
+# test_notifier.py
+import threading
+import time
+from pymongo.errors import OperationFailure
+from notifier import JobNotifier
+
+class FakeStream:
+    """A change stream that reports one event once `fire` is set."""
+    def __init__(self, fire):
+        self.fire = fire
+        self.alive = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.alive = False
+
+    def try_next(self):
+        if self.fire.wait(0.01):
+            self.fire.clear()
+            return {"operationType": "insert"}
+        return None
+
+class FakeStore:
+    name = "fake"
+
+    def __init__(self, stream=None, error=None, due_in=None):
+        self.stream = stream
+        self.error = error
+        self.due_in = due_in
+
+    def watch(self, pipeline):
+        if self.error:
+            raise self.error
+        return self.stream
+
+    def seconds_until_next_due(self, queues=None):
+        return self.due_in
+
+def timed_wait(notifier):
+    started = time.monotonic()
+    notifier.wait(lambda: True)
+    return time.monotonic() - started
+
+def test_change_stream_wakes_the_worker_at_once():
+    fire = threading.Event()
+    notifier = JobNotifier(FakeStore(FakeStream(fire)), 5, 5, label="test")
+    notifier.start()
+    try:
+        assert notifier.streaming
+        threading.Timer(0.1, fire.set).start()
+        assert timed_wait(notifier) < 1 # Not the 30 second idle wait
+    finally:
+        notifier.stop()
+
+def test_without_change_streams_idle_waits_back_off():
+    for store in (FakeStore(), FakeStore(error=OperationFailure("not a replica set", 40573))):
+        notifier = JobNotifier(store, 0.05, 0.2, label="test")
+        notifier.start()
+        assert not notifier.streaming
+        waits = [timed_wait(notifier) for _ in range(4)]
+        assert waits[0] < waits[1] < waits[2]
+        assert 0.18 < waits[3] < 0.4 # Capped at max_backoff
+        notifier.reset()
+        assert timed_wait(notifier) < 0.15
+
+def test_wait_ends_when_the_next_job_is_due():
+    notifier = JobNotifier(FakeStore(due_in=0.1), 5, 5, label="test")
+    notifier.start()
+    assert timed_wait(notifier) < 1
+
+def test_notify_and_stop_end_the_wait():
+    notifier = JobNotifier(FakeStore(), 5, 5, label="test")
+    threading.Timer(0.1, notifier.notify).start()
+    assert timed_wait(notifier) < 1
+    stopping = [True]
+    threading.Timer(0.1, stopping.clear).start()
+    started = time.monotonic()
+    notifier.wait(lambda: bool(stopping))
+    assert time.monotonic() - started < 1.5
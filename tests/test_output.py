@@ -0,0 +1,51 @@
+# test_output.py
+import os
+import time
+import pytest
+from output import excerpt, prune_spool, run_spooled, spool_paths
+
+@pytest.fixture(autouse=True)
+def in_tmp(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+def test_excerpt_keeps_head_and_tail(tmp_path):
+    path = tmp_path / "out"
+    path.write_bytes(b"skip" + b"H" * 10 + b"x" * 100 + b"T" * 10)
+    text, size = excerpt(path, 4, 10, 10)
+    assert size == 120
+    assert text.startswith("H" * 10 + "\n... [100 bytes omitted")
+    assert text.endswith("] ...\n" + "T" * 10)
+
+def test_excerpt_returns_short_output_whole(tmp_path):
+    path = tmp_path / "out"
+    path.write_bytes(b"hello")
+    assert excerpt(path, 0, 10, 10) == ("hello", 5)
+
+def test_run_spooled_appends_attempts_and_truncates():
+    job = {"id": "a/b", "command": "seq 1 1000; echo oops >&2", "attempts": 0}
+    returncode, stderr, output, failure_class = run_spooled(job, {}, 16, 16)
+    assert (returncode, failure_class) == (0, None)
+    assert stderr == "oops\n"
+    assert output["stdout"].startswith("1\n2\n3\n")
+    assert output["stdout"].endswith("999\n1000\n")
+    assert "bytes omitted" in output["stdout"]
+    assert output["stdout_path"] == spool_paths("a/b")[0]
+
+    run_spooled(dict(job, attempts=1), {}, 16, 16)
+    with open(output["stdout_path"]) as f:
+        headers = [line for line in f if line.startswith("--- attempt")]
+    assert [header.split()[2] for header in headers] == ["1", "2"]
+
+def test_prune_spool_removes_only_old_files(tmp_path):
+    directory = tmp_path / "spool"
+    directory.mkdir()
+    old, new = directory / "old.out", directory / "new.out"
+    old.write_text("x")
+    new.write_text("y")
+    an_hour_ago = time.time() - 3600
+    os.utime(old, (an_hour_ago, an_hour_ago))
+
+    assert prune_spool(0, str(directory)) == 0
+    assert prune_spool(600, str(directory)) == 1
+    assert sorted(os.listdir(directory)) == ["new.out"]
+    assert prune_spool(600, str(tmp_path / "missing")) == 0
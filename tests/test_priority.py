@@ -0,0 +1,36 @@
+# test_priority.py
+import datetime
+import random
+from db import CLAIM_INDEX, CLAIM_SORT
+
+def test_claim_index_serves_the_claim_sort():
+    # queue and state are equality matches, so the sort must follow them directly
+    assert CLAIM_INDEX[:2] == [("queue", 1), ("state", 1)]
+    assert CLAIM_INDEX[2:2 + len(CLAIM_SORT)] == CLAIM_SORT
+
+def test_claims_follow_priority_across_batches(store, enqueue):
+    random.seed(5)
+    priorities = [random.randint(-3, 3) for _ in range(20)]
+    for i, priority in enumerate(priorities):
+        enqueue(f"job-{i:02}", priority=priority, seconds_ago=100 - i)
+
+    claimed = []
+    while True:
+        batch = store.claim("w1", 3)
+        if not batch:
+            break
+        claimed.extend(job["id"] for job in batch)
+    expected = sorted((f"job-{i:02}" for i in range(20)), key=lambda job_id: (-priorities[int(job_id[4:])], job_id))
+    assert claimed == expected
+
+def test_retried_job_keeps_its_priority(store, enqueue):
+    enqueue("low", priority=-1, seconds_ago=30)
+    enqueue("high", priority=5, seconds_ago=20)
+    high, = store.claim("w1", 1)
+    store.retry("w1", high, 1, datetime.datetime.utcnow(), "boom", "command")
+    assert [job["id"] for job in store.claim("w1", 2)] == ["high", "low"]
+
+def test_enqueue_priority_option(store, run_cli):
+    run_cli("enqueue", "a", "true", "--priority", "-2")
+    run_cli("enqueue", "b", "true", "--priority", "7")
+    assert [job["id"] for job in store.claim("w1", 2)] == ["b", "a"]
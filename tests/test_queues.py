@@ -0,0 +1,25 @@
+# test_queues.py
+import random
+from collections import Counter
+from jobs import weighted_queue_order
+
+def test_single_queue_is_returned_as_is():
+    assert weighted_queue_order(["default"]) == ["default"]
+    assert weighted_queue_order([]) == []
+
+def test_every_queue_is_tried_once():
+    random.seed(1)
+    for _ in range(100):
+        order = weighted_queue_order(["a", "b", "c"], [5, 1, 1])
+        assert sorted(order) == ["a", "b", "c"]
+
+def test_heavier_queue_comes_first_more_often():
+    random.seed(2)
+    firsts = Counter(weighted_queue_order(["heavy", "light"], [3, 1])[0] for _ in range(4000))
+    # With weights 3:1 the heavy queue leads 3/4 of the time
+    assert 0.70 < firsts["heavy"] / 4000 < 0.80
+
+def test_equal_weights_by_default():
+    random.seed(3)
+    firsts = Counter(weighted_queue_order(["a", "b"])[0] for _ in range(4000))
+    assert 0.45 < firsts["a"] / 4000 < 0.55
@@ -0,0 +1,106 @@
+# test_retry.py
+import random
+import pytest
+from retry import DEFAULT_POLICY, matching_rule, next_delay, resolve_policy, validate_policy
+
+def policy(**overrides):
+    return dict(DEFAULT_POLICY, **dict({"base": 2, "jitter": "none"}, **overrides))
+
+@pytest.mark.parametrize("bad", [
+    [],
+    {"strategy": "random"},
+    {"jitter": "some"},
+    {"delay": -1},
+    {"max_delay": "soon"},
+    {"retries": 3},
+    {"rules": {}},
+    {"rules": [{"exit_codes": [1]}]},
+    {"rules": [{"action": "dead"}]},
+    {"rules": [{"exit_codes": ["1"], "action": "dead"}]},
+    {"rules": [{"stderr": "(", "action": "dead"}]},
+    {"rules": [{"exit_codes": [1], "action": "backoff", "multiplier": 0.5}]},
+    {"rules": [{"exit_codes": [1], "action": "dead", "when": "always"}]},
+    {"base": True},
+    {"delay": False},
+    {"rules": [{"exit_codes": 1, "action": "dead"}]},
+    {"rules": [{"exit_codes": [True], "action": "dead"}]},
+    {"rules": [{"stderr": 5, "action": "dead"}]},
+    {"rules": [{"failure_class": 3, "action": "dead"}]},
+    {"rules": [{"exit_codes": [1], "action": "backoff", "multiplier": "x"}]},
+    {"rules": [{"exit_codes": [1], "action": "backoff", "multiplier": True}]},
+])
+def test_validate_policy_rejects(bad):
+    with pytest.raises(ValueError):
+        validate_policy(bad)
+
+def test_validate_policy_returns_valid_policy():
+    valid = {"strategy": "linear", "delay": 2, "jitter": "decorrelated",
+             "rules": [{"stderr": "429", "action": "backoff", "multiplier": 5}]}
+    assert validate_policy(valid) is valid
+
+def test_resolve_policy_layers():
+    config = {"backoff_base": 4, "retry_policy": {"strategy": "linear", "max_delay": 60}}
+    job = {"retry_policy": {"max_delay": 10}}
+    resolved = resolve_policy(config, job)
+    assert (resolved["base"], resolved["strategy"], resolved["max_delay"]) == (4, "linear", 10)
+    assert resolve_policy({}, {})["base"] == 3
+
+def test_first_matching_rule_wins():
+    rules = [
+        {"exit_codes": [2], "stderr": "fatal", "action": "dead"},
+        {"exit_codes": [2], "action": "retry"},
+        {"failure_class": ["timeout", "memory"], "action": "backoff"},
+    ]
+    p = policy(rules=rules)
+    assert matching_rule(p, "fatal: no such file", exit_code=2) is rules[0]
+    assert matching_rule(p, "flaky", exit_code=2) is rules[1]
+    assert matching_rule(p, None, failure_class="memory") is rules[2]
+    assert matching_rule(p, "fatal", exit_code=1, failure_class="command") is None
+    assert matching_rule(policy(), "anything") is None
+
+def test_strategies():
+    assert [next_delay(policy(), n) for n in (1, 2, 3)] == [2, 4, 8]
+    assert [next_delay(policy(strategy="linear", delay=1.5), n) for n in (1, 2, 3)] == [1.5, 3, 4.5]
+    assert [next_delay(policy(strategy="fixed", delay=7), n) for n in (1, 5)] == [7, 7]
+
+def test_max_delay_caps_even_huge_exponents():
+    assert next_delay(policy(max_delay=100), 10) == 100
+    assert next_delay(policy(base=10, max_delay=30), 5000) == 30
+
+def test_backoff_rule_multiplies_after_the_cap():
+    rule = {"exit_codes": [1], "action": "backoff", "multiplier": 3}
+    assert next_delay(policy(max_delay=100), 10, rule=rule) == 300
+    assert next_delay(policy(), 1, rule={"exit_codes": [1], "action": "backoff"}) == 20
+    assert next_delay(policy(), 1, rule={"exit_codes": [1], "action": "retry"}) == 2
+
+def test_default_jitter_depends_on_the_strategy():
+    random.seed(4)
+    fixed = resolve_policy({}, {"retry_policy": {"strategy": "fixed", "delay": 30}})
+    linear = resolve_policy({}, {"retry_policy": {"strategy": "linear", "delay": 2}})
+    assert [next_delay(fixed, n) for n in (1, 2, 3)] == [30, 30, 30]
+    assert [next_delay(linear, n) for n in (1, 2, 3)] == [2, 4, 6]
+    exponential = resolve_policy({"backoff_base": 2}, {})
+    delays = {next_delay(exponential, 5) for _ in range(50)}
+    assert len(delays) > 1 and all(0 <= delay <= 32 for delay in delays)
+    # An explicit jitter still applies to any strategy
+    jittered = resolve_policy({}, {"retry_policy": {"strategy": "fixed", "delay": 30, "jitter": "full"}})
+    assert len({next_delay(jittered, 1) for _ in range(50)}) > 1
+
+def test_full_jitter_stays_within_delay():
+    random.seed(1)
+    delays = [next_delay(policy(jitter="full", max_delay=10), 5) for _ in range(500)]
+    assert all(0 <= delay <= 10 for delay in delays)
+    assert max(delays) - min(delays) > 5
+
+def test_decorrelated_jitter_grows_from_previous_delay():
+    random.seed(2)
+    p = policy(jitter="decorrelated", delay=1, max_delay=50)
+    delays = [next_delay(p, 3, previous_delay=4) for _ in range(500)]
+    assert all(1 <= delay <= 12 for delay in delays)
+    assert all(1 <= next_delay(p, 1) <= 3 for _ in range(100))
+    assert all(next_delay(p, 9, previous_delay=40) <= 50 for _ in range(100))
+
+def test_delays_are_rounded():
+    random.seed(3)
+    delay = next_delay(policy(jitter="full"), 4)
+    assert delay == round(delay, 3)
@@ -0,0 +1,106 @@
+# test_store.py
+import datetime
+
+def ids(jobs):
+    return [job["id"] for job in jobs]
+
+def test_claim_orders_by_priority_then_fifo(store, enqueue):
+    enqueue("old", seconds_ago=30)
+    enqueue("new", seconds_ago=10)
+    enqueue("urgent", seconds_ago=5, priority=10)
+
+    assert ids(store.claim("w1", 3)) == ["urgent", "old", "new"]
+    assert store.claim("w2", 3) == []
+
+def test_claim_marks_jobs_processing(store, enqueue):
+    enqueue("a")
+    job, = store.claim("w1", 1, lease_seconds=30)
+    assert job["state"] == "processing"
+    assert job["worker_id"] == "w1"
+    assert job["lease_expires_at"] > datetime.datetime.utcnow()
+    assert store.find("a")["state"] == "processing"
+
+def test_claim_skips_other_queues_and_future_jobs(store, enqueue):
+    enqueue("emails", queue="emails")
+    enqueue("later", run_at=datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+
+    assert store.claim("w1", 5) == []
+    assert ids(store.claim("w1", 5, queues=["emails"])) == ["emails"]
+    assert 3500 < store.seconds_until_next_due() <= 3600
+
+def test_complete_needs_the_lease(store, enqueue):
+    enqueue("a")
+    job, = store.claim("w1", 1)
+
+    assert not store.complete("w2", job)
+    assert store.complete("w1", job)
+    assert store.find("a")["state"] == "completed"
+    assert store.find("a")["worker_id"] is None
+
+def test_release_returns_jobs_to_pending(store, enqueue):
+    enqueue("a")
+    enqueue("b")
+    claimed = store.claim("w1", 2)
+
+    assert store.release("w2", claimed) == 0
+    assert store.release("w1", claimed) == 2
+    assert ids(store.claim("w3", 2)) == ["a", "b"]
+
+def test_retry_reschedules(store, enqueue):
+    enqueue("a")
+    job, = store.claim("w1", 1)
+    run_at = datetime.datetime.utcnow() + datetime.timedelta(minutes=5)
+
+    assert store.retry("w1", job, 1, run_at, "boom", "command")
+    stored = store.find("a")
+    assert (stored["state"], stored["attempts"], stored["last_error"]) == ("pending", 1, "boom")
+    assert store.claim("w1", 1) == []
+
+def test_bury_moves_job_to_dlq(store, enqueue):
+    enqueue("a")
+    job, = store.claim("w1", 1)
+    job.update(state="dead", last_error="boom", failure_class="command")
+
+    assert store.bury("w1", job)
+    dead = store.find("a")
+    assert (dead["state"], dead["failure_class"]) == ("dead", "command")
+    assert store.counts()["dead"] == 1
+
+def test_counts_match_exact_recount(store, enqueue):
+    for i in range(5):
+        enqueue(f"job-{i}", queue="default" if i % 2 else "emails")
+    first, = store.claim("w1", 1)
+    store.complete("w1", first)
+    store.claim("w1", 1)
+
+    counts = store.counts()
+    assert counts == store.counts(exact=True)
+    assert (counts["pending"], counts["processing"], counts["completed"]) == (3, 1, 1)
+    assert sum(queue["pending"] for queue in counts["queues"].values()) == 3
+
+def test_reaper_requeues_expired_leases(store, enqueue):
+    enqueue("a")
+    store.claim("w1", 1, lease_seconds=-1)
+
+    assert store.reap_expired() == 1
+    stored = store.find("a")
+    assert (stored["state"], stored["attempts"], stored["worker_id"]) == ("pending", 1, None)
+    assert "Lease expired" in stored["last_error"]
+    assert store.reclaimed() == 1
+
+def test_reaper_leaves_live_leases_alone(store, enqueue):
+    enqueue("a")
+    store.claim("w1", 1, lease_seconds=60)
+    assert store.reap_expired() == 0
+    assert store.find("a")["state"] == "processing"
+
+def test_reaper_buries_jobs_out_of_attempts(store, enqueue):
+    enqueue("a")
+    job, = store.claim("w1", 1, lease_seconds=-1)
+    store.retry("w1", job, job["max_retries"] - 1, datetime.datetime.utcnow(), "boom", "command")
+    store.claim("w1", 1, lease_seconds=-1)
+
+    assert store.reap_expired() == 1
+    dead = store.find("a")
+    assert (dead["state"], dead["failure_class"]) == ("dead", "lease")
+    assert store.counts() == store.counts(exact=True)
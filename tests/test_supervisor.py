@@ -0,0 +1,28 @@
+# test_supervisor.py
+import pytest
+from supervisor import desired_workers, measure_backlog, restart_delay
+
+def test_desired_workers_follows_backlog(config):
+    config.update(supervisor_min_workers=1, supervisor_max_workers=8, supervisor_backlog_per_worker=50)
+    assert desired_workers(3, 0, 0, config) == 1
+    assert desired_workers(1, 101, 0, config) == 3
+    assert desired_workers(1, 10_000, 0, config) == 8
+
+def test_desired_workers_adds_one_for_stale_jobs(config):
+    config.update(supervisor_backlog_per_worker=50, supervisor_max_wait=30.0, supervisor_max_workers=8)
+    assert desired_workers(4, 10, 31, config) == 5
+    assert desired_workers(8, 10, 31, config) == 8
+
+def test_restart_delay_backs_off_and_caps(config):
+    config.update(supervisor_restart_base=1.0, supervisor_restart_max=10.0)
+    assert [restart_delay(crashes, config) for crashes in range(1, 6)] == [1, 2, 4, 8, 10]
+
+@pytest.mark.parametrize("store", ["mongo"], indirect=True)
+def test_measure_backlog_counts_due_jobs_per_queue(store, enqueue):
+    enqueue("old", seconds_ago=120)
+    enqueue("new", seconds_ago=5)
+    enqueue("other", seconds_ago=600, queue="reports")
+    pending, oldest_wait = measure_backlog(store.db, ["default"])
+    assert pending == 2
+    assert 119 <= oldest_wait < 130
+    assert measure_backlog(store.db, ["default", "reports"])[0] == 3
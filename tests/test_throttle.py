@@ -0,0 +1,134 @@
+# test_throttle.py
+import datetime
+import pytest
+from jobs import build_job
+from db import KEY_LIMITS_COLLECTION
+from throttle import (RECONCILE_GRACE_SECONDS, acquire_permits, blocked_keys, burst, job_throttle, parse_rate,
+                      reconcile_permits, release_permits, take_permits)
+
+T = datetime.datetime(2024, 1, 15, 10, 30)
+
+def later(seconds):
+    return T + datetime.timedelta(seconds=seconds)
+
+@pytest.mark.parametrize("text, rate", [("10/s", 10), ("600/m", 10), ("36/h", 0.01), ("2.5", 2.5), (" 5/S ", 5), (None, None)])
+def test_parse_rate(text, rate):
+    assert parse_rate(text) == rate
+
+@pytest.mark.parametrize("text", ["", "fast", "10/d", "0/s", "-1/m"])
+def test_parse_rate_rejects(text):
+    with pytest.raises(ValueError):
+        parse_rate(text)
+
+def test_burst_is_at_least_one():
+    assert burst(0.1) == 1
+    assert burst(20) == 20
+
+def test_max_running_caps_grants():
+    granted, state = take_permits(None, 5, 2, None, T)
+    assert (granted, state["running"], state["full"]) == (2, 2, True)
+    granted, state = take_permits(state, 1, 2, None, T)
+    assert (granted, state["running"]) == (0, 2)
+    granted, state = take_permits(dict(state, running=1), 3, 2, None, T)
+    assert (granted, state["running"], state["full"]) == (1, 2, True)
+
+def test_token_bucket_refills_over_time():
+    granted, state = take_permits(None, 10, None, 2, T)
+    assert (granted, state["tokens"]) == (2, 0)
+    assert state["blocked_until"] == later(0.5)
+
+    granted, state = take_permits(state, 10, None, 2, later(0.25))
+    assert granted == 0
+    granted, state = take_permits(state, 10, None, 2, later(0.75))
+    assert granted == 1
+    # A long pause refills no further than the burst
+    granted, state = take_permits(state, 10, None, 2, later(60))
+    assert granted == 2
+
+def test_both_limits_apply():
+    granted, state = take_permits({"running": 1}, 10, 3, 5, T)
+    assert (granted, state["running"], state["tokens"]) == (2, 3, 3)
+    assert state["blocked_until"] is None
+
+def test_job_throttle():
+    assert job_throttle({"id": "a"}) is None
+    assert job_throttle({"concurrency_key": "api", "max_running": 2, "rate_limit": None}) == ("api", 2, None)
+
+def test_limits_need_a_key(config):
+    with pytest.raises(ValueError):
+        build_job("a", "echo hi", config, max_running=2)
+    with pytest.raises(ValueError):
+        build_job("a", "echo hi", config, concurrency_key="api", max_running=0)
+    assert build_job("a", "echo hi", config, concurrency_key="api")["max_running"] == 1
+
+def test_claim_respects_max_running(store, enqueue, enqueue_many):
+    enqueue_many(5, concurrency_key="api", max_running=2)
+    enqueue("free")
+
+    claimed = store.claim("w1", 10)
+    assert sorted(job["id"] for job in claimed) == ["free", "job-0", "job-1"]
+    assert store.claim("w2", 10) == []
+
+    store.complete("w1", next(job for job in claimed if job["id"] != "free"))
+    assert [job["id"] for job in store.claim("w2", 10)] == ["job-2"]
+
+def test_retry_and_reaper_free_permits(store, enqueue_many):
+    enqueue_many(3, concurrency_key="api", max_running=1)
+    job, = store.claim("w1", 10)
+    store.retry("w1", job, 1, datetime.datetime.utcnow() + datetime.timedelta(hours=1), "boom", "command")
+
+    job, = store.claim("w1", 10, lease_seconds=-1)
+    assert store.reap_expired() == 1
+    assert len(store.claim("w1", 10)) == 1
+
+def test_claim_respects_rate(store, enqueue_many):
+    enqueue_many(5, concurrency_key="api", rate=2)
+    claimed = store.claim("w1", 10)
+    assert len(claimed) == 2
+    assert store.claim("w1", 10) == []
+
+    # Released jobs never started, so their tokens come back
+    assert store.release("w1", claimed) == 2
+    assert len(store.claim("w1", 10)) == 2
+
+@pytest.mark.parametrize("store", ["sqlite"], indirect=True)
+def test_exact_counts_resync_running_on_sqlite(store, enqueue_many):
+    enqueue_many(3, concurrency_key="api", max_running=2)
+    store.claim("w1", 10)
+    conn = store._conn()
+    conn.execute("UPDATE key_limits SET running = 0, full = 0 WHERE key = 'api'")
+    store.counts(exact=True)
+    row = conn.execute("SELECT running, full FROM key_limits WHERE key = 'api'").fetchone()
+    assert (row["running"], row["full"]) == (2, 1)
+    assert store.claim("w2", 10) == []
+
+def test_mongo_permits(mongo_store):
+    db = mongo_store.db
+    assert acquire_permits(db, "api", 3, 2, None, T) == 2
+    assert acquire_permits(db, "api", 1, 2, None, T) == 0
+    assert blocked_keys(db, T) == {"api"}
+    release_permits(db, "api", 5) # More than were taken: stops at zero
+    assert db[KEY_LIMITS_COLLECTION].find_one({"_id": "api"})["running"] == 0
+    assert blocked_keys(db, T) == set()
+
+    assert acquire_permits(db, "rated", 5, None, 2, T) == 2
+    assert blocked_keys(db, T) == {"rated"}
+    release_permits(db, "rated", 2, tokens=2) # Never started: the tokens come back
+    assert blocked_keys(db, T) == set()
+    assert acquire_permits(db, "rated", 5, None, 2, T) == 2
+
+@pytest.mark.parametrize("store", ["mongo"], indirect=True)
+def test_mongo_reconcile_permits(store, enqueue_many):
+    enqueue_many(3, concurrency_key="api", max_running=2)
+    store.claim("w1", 10)
+    limits = store.db[KEY_LIMITS_COLLECTION]
+    limits.update_one({"_id": "api"}, {"$set": {"running": 0, "full": False}})
+
+    # A key that changed moments ago may have a claim in flight
+    assert reconcile_permits(store.db) == 0
+    settled = datetime.datetime.utcnow() - datetime.timedelta(seconds=RECONCILE_GRACE_SECONDS + 1)
+    limits.update_one({"_id": "api"}, {"$set": {"changed_at": settled}})
+    store.counts(exact=True)
+    key = limits.find_one({"_id": "api"})
+    assert (key["running"], key["full"]) == (2, True)
+    assert store.claim("w2", 10) == []
@@ -0,0 +1,34 @@
+# test_worker.py
+import pytest
+
+# Workers open their own store from the config, which points at the SQLite test database
+pytestmark = pytest.mark.parametrize("store", ["sqlite"], indirect=True)
+
+def done(store, count):
+    return lambda: store.counts()["completed"] >= count
+
+def test_prefetching_worker_runs_every_job(store, enqueue_many, run_worker):
+    enqueue_many(12, command="true")
+    run_worker(done(store, 12), prefetch=5)
+    counts = store.counts(exact=True)
+    assert (counts["completed"], counts["pending"], counts["processing"]) == (12, 0, 0)
+
+def test_stopping_worker_releases_its_buffer(store, enqueue_many, run_worker):
+    enqueue_many(6, command="sleep 0.2")
+    run_worker(done(store, 1), prefetch=6)
+
+    # The jobs it had claimed but not started are back in 'pending', with no attempt used
+    counts = store.counts(exact=True)
+    assert counts["processing"] == 0
+    assert counts["completed"] + counts["pending"] == 6
+    assert 1 <= counts["completed"] < 6
+    assert all(store.find(f"job-{i}")["attempts"] == 0 for i in range(6))
+
+def test_concurrent_worker_overlaps_jobs(store, enqueue_many, run_worker):
+    enqueue_many(4, command="sleep 0.5")
+    elapsed = run_worker(done(store, 4), concurrency=4)
+
+    assert elapsed < 1.8 # One after another would take 2 seconds
+    starts = sorted(store.find(f"job-{i}")["started_at"] for i in range(4))
+    assert (starts[-1] - starts[0]).total_seconds() < 0.4
+    assert store.counts() == store.counts(exact=True)
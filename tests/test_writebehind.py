@@ -0,0 +1,101 @@
+# test_writebehind.py
+import datetime
+import pytest
+from writebehind import WriteBehind
+
+def test_complete_many_returns_the_jobs_still_held(store, enqueue_many):
+    enqueue_many(3)
+    first, second, third = store.claim("w1", 3)
+    store.release("w1", [second])
+    store.claim("w2", 1)
+
+    won = store.complete_many("w1", [first, second])
+    assert [job["id"] for job in won] == ["job-0"]
+    assert store.find("job-0")["state"] == "completed"
+    assert store.find("job-1")["worker_id"] == "w2"
+    assert store.counts() == store.counts(exact=True)
+
+def test_complete_many_renews_remaining_leases(store, enqueue_many):
+    enqueue_many(2)
+    first, second = store.claim("w1", 2, lease_seconds=1)
+    store.complete_many("w1", [first], lease_seconds=600)
+    assert store.find("job-1")["lease_expires_at"] > datetime.datetime.utcnow() + datetime.timedelta(seconds=500)
+
+@pytest.mark.parametrize("store", ["sqlite"], indirect=True) # Only SQLite combines the two
+def test_complete_and_claim_in_one_transaction(store, enqueue_many):
+    enqueue_many(3)
+    first, = store.claim("w1", 1)
+
+    completed, claimed = store.complete_and_claim("w1", first, 1)
+    assert completed
+    assert [job["id"] for job in claimed] == ["job-1"]
+    assert store.find("job-0")["state"] == "completed"
+
+class Recorder:
+    def __init__(self):
+        self.completed, self.lost = [], []
+
+    def writer(self, store, **kwargs):
+        return WriteBehind(store, "w1", 60, lambda job: self.completed.append(job["id"]),
+                           lambda job: self.lost.append(job["id"]), **kwargs)
+
+def test_flush_reports_each_outcome(store, enqueue_many):
+    enqueue_many(2)
+    first, second = store.claim("w1", 2)
+    store.release("w1", [second])
+    recorder = Recorder()
+    writer = recorder.writer(store)
+
+    writer.complete(first)
+    writer.complete(second)
+    assert store.find("job-0")["state"] == "processing" # Nothing is written before a flush
+    assert writer.flush() == 2
+    assert (recorder.completed, recorder.lost) == (["job-0"], ["job-1"])
+    assert writer.flush() == 0
+
+def test_flush_writes_at_most_one_batch(store, enqueue_many):
+    enqueue_many(5)
+    jobs = store.claim("w1", 5)
+    recorder = Recorder()
+    writer = recorder.writer(store, max_batch=2)
+    for job in jobs:
+        writer.complete(job)
+    assert writer.stop()
+    assert recorder.completed == [job["id"] for job in jobs]
+
+class FailingStore:
+    def __init__(self, store, failures):
+        self.store = store
+        self.failures = failures
+
+    def complete_many(self, worker_id, jobs, lease_seconds=None):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database unavailable")
+        return self.store.complete_many(worker_id, jobs, lease_seconds)
+
+def test_failed_flush_keeps_the_batch(store, enqueue_many):
+    enqueue_many(2)
+    first, second = store.claim("w1", 2)
+    recorder = Recorder()
+    writer = recorder.writer(FailingStore(store, failures=1))
+    writer.complete(first)
+    writer.heartbeat(600)
+
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    writer.complete(second)
+    assert writer.flush() == 2
+    assert recorder.completed == ["job-0", "job-1"]
+
+def test_stop_gives_up_after_retries(store, enqueue_many, monkeypatch):
+    monkeypatch.setattr("writebehind.time.sleep", lambda seconds: None)
+    enqueue_many(1)
+    job, = store.claim("w1", 1)
+    recorder = Recorder()
+    writer = recorder.writer(FailingStore(store, failures=100))
+    writer.complete(job)
+
+    assert not writer.stop()
+    assert recorder.completed == recorder.lost == []
+    assert store.find("job-0")["state"] == "processing"
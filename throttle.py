@@ -0,0 +1,146 @@
+# throttle.py
+import datetime
+from pymongo.errors import DuplicateKeyError
+from db import KEY_LIMITS_COLLECTION
+
+RATE_UNITS = {"s": 1, "m": 60, "h": 3600}
+PERMIT_ATTEMPTS = 5 # Compare-and-set retries before giving up on a busy key
+BLOCKED_CHECK_SECONDS = 60 # How long after seeing a keyed job a worker keeps excluding blocked keys
+RECONCILE_GRACE_SECONDS = 5 # Keys changed this recently may have a claim in flight; reconcile_permits leaves them alone
+
+def parse_rate(text):
+    """'10/s', '600/m' or '100/h' (a bare number is per second) as starts per second."""
+    if text is None:
+        return None
+    amount, _, unit = text.strip().lower().partition("/")
+    try:
+        rate = float(amount) / RATE_UNITS[unit or "s"]
+    except (ValueError, KeyError):
+        raise ValueError(f"Invalid rate '{text}'. Use e.g. 10/s, 600/m or 100/h.")
+    if rate <= 0:
+        raise ValueError("The rate limit must be positive.")
+    return rate
+
+def burst(rate):
+    """Bucket size: one second's worth of starts, and never less than one."""
+    return max(1.0, rate)
+
+def take_permits(state, wanted, max_running, rate, now):
+    """
+    The decision shared by every backend. `state` is a key's current
+    {running, tokens, refilled_at} (None if the key is new). Grants as many
+    of `wanted` starts as the limits allow and returns (granted, new_state);
+    new_state["blocked_until"] says when a rate-limited key can start again.
+    """
+    state = state or {}
+    running = state.get("running") or 0
+    granted = wanted
+    if max_running:
+        granted = min(granted, max(max_running - running, 0))
+
+    tokens = None
+    if rate:
+        tokens = burst(rate)
+        if state.get("tokens") is not None and state.get("refilled_at") is not None:
+            elapsed = max((now - state["refilled_at"]).total_seconds(), 0)
+            tokens = min(burst(rate), state["tokens"] + elapsed * rate)
+        granted = min(granted, int(tokens))
+        tokens -= granted
+
+    blocked_until = None
+    if rate and tokens < 1:
+        blocked_until = now + datetime.timedelta(seconds=(1 - tokens) / rate)
+    return granted, {
+        "running": running + granted,
+        "max_running": max_running,
+        "rate": rate,
+        "tokens": tokens,
+        "refilled_at": now,
+        "full": bool(max_running) and running + granted >= max_running,
+        "blocked_until": blocked_until
+    }
+
+def job_throttle(job):
+    """(key, max_running, rate) of a job, or None if it isn't throttled."""
+    if not job.get("concurrency_key"):
+        return None
+    return job["concurrency_key"], job.get("max_running"), job.get("rate_limit")
+
+
+# --- MongoDB ---
+
+def blocked_keys(db, now=None):
+    """Keys that can't start a job right now: at their running limit or out of tokens."""
+    if now is None:
+        now = datetime.datetime.utcnow()
+    query = {"$or": [{"full": True}, {"blocked_until": {"$gt": now}}]}
+    return {doc["_id"] for doc in db[KEY_LIMITS_COLLECTION].find(query, {"_id": 1})}
+
+def acquire_permits(db, key, wanted, max_running, rate, now=None):
+    """
+    Atomically take up to `wanted` start permits for `key` and return how
+    many were granted. Optimistic: read the key, decide, then write only if
+    its version hasn't moved; a concurrent change means try again.
+    """
+    if now is None:
+        now = datetime.datetime.utcnow()
+    limits = db[KEY_LIMITS_COLLECTION]
+    for _ in range(PERMIT_ATTEMPTS):
+        doc = limits.find_one({"_id": key})
+        granted, state = take_permits(doc, wanted, max_running, rate, now)
+        if doc is None:
+            try:
+                limits.insert_one(dict(state, _id=key, v=1, changed_at=now))
+                return granted
+            except DuplicateKeyError:
+                continue
+        if limits.update_one({"_id": key, "v": doc.get("v", 0)}, {"$set": dict(state, changed_at=now), "$inc": {"v": 1}}).modified_count:
+            return granted
+    return 0
+
+def release_permits(db, key, count=1, tokens=0):
+    """
+    Give back `count` running slots for `key`, e.g. when its jobs finish,
+    and `tokens` rate tokens for permits that were never used to start a job.
+    The running count stops at zero rather than refusing the release, so a
+    key that drifted still frees up (reconcile_permits fixes the rest).
+    """
+    if count <= 0:
+        return
+    changes = {
+        "running": {"$max": [{"$subtract": [{"$ifNull": ["$running", 0]}, count]}, 0]},
+        "full": False,
+        "v": {"$add": [{"$ifNull": ["$v", 0]}, 1]},
+        "changed_at": datetime.datetime.utcnow()
+    }
+    if tokens:
+        changes["tokens"] = {"$add": [{"$ifNull": ["$tokens", 0]}, tokens]}
+        changes["blocked_until"] = None
+    db[KEY_LIMITS_COLLECTION].update_one({"_id": key}, [{"$set": changes}])
+
+def reconcile_permits(db, now=None):
+    """
+    Reset each key's running count to the number of 'processing' jobs that
+    carry it, and return how many keys were off. Permits leak if a worker
+    dies between taking them and flipping its jobs, or between completing
+    a job and releasing it; without this such a key would stay full.
+    Runs with every reap and `status --exact`.
+    """
+    if now is None:
+        now = datetime.datetime.utcnow()
+    running = {row["_id"]: row["n"] for row in db["jobs"].aggregate([
+        {"$match": {"state": "processing", "concurrency_key": {"$type": "string"}}},
+        {"$group": {"_id": "$concurrency_key", "n": {"$sum": 1}}}
+    ])}
+    settled = now - datetime.timedelta(seconds=RECONCILE_GRACE_SECONDS)
+    limits = db[KEY_LIMITS_COLLECTION]
+    fixed = 0
+    for doc in limits.find({"$or": [{"changed_at": {"$lt": settled}}, {"changed_at": None}]}):
+        actual = running.get(doc["_id"], 0)
+        if (doc.get("running") or 0) == actual:
+            continue
+        full = bool(doc.get("max_running")) and actual >= doc["max_running"]
+        # The version check loses to any claim or release since the read
+        if limits.update_one({"_id": doc["_id"], "v": doc.get("v", 0)}, {"$set": {"running": actual, "full": full}, "$inc": {"v": 1}}).modified_count:
+            fixed += 1
+    return fixed
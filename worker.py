@@ -1,16 +1,38 @@
 # worker.py
 import time
-import subprocess
 import datetime
 import os
 import signal
 import sys
-from pymongo import ReturnDocument
-from db import get_db, ensure_indexes # Import the helper functions
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from storage import get_store
+from notifier import JobNotifier
+from archive import start_compactor
+from leases import start_lease_keeper
+from config import get_queue_config, DEFAULT_CONFIG
+from jobs import DEFAULT_QUEUE, queue_of, job_limits
+from output import run_spooled, start_spool_pruner
+from callables import configure_pool, shutdown_pool
+from limits import FAILURE_COMMAND, FAILURE_TIMEOUT, FAILURE_CPU, FAILURE_MEMORY
+from retry import resolve_policy, matching_rule, next_delay
+from writebehind import WriteBehind
+import metrics
 
 # --- Worker-specific globals ---
 WORKER_ID = f"pid_{os.getpid()}" # Initial ID, will be updated
 RUNNING = True # Flag for graceful shutdown
+LEASE_SECONDS = 60 # How long a claim stays valid without a heartbeat
+OUTPUT_HEAD_BYTES = 4096 # Output kept on the job document: this much of the start...
+OUTPUT_TAIL_BYTES = 4096 # ...and this much of the end
+
+LIMIT_MESSAGES = {
+    FAILURE_TIMEOUT: "timed out after {timeout} seconds.",
+    FAILURE_CPU: "exceeded its CPU limit of {cpu_seconds} seconds.",
+    FAILURE_MEMORY: "exceeded its memory limit of {max_rss} MB."
+}
 
 def handle_shutdown(sig, frame):
     """
@@ -19,115 +41,177 @@ def handle_shutdown(sig, frame):
     """
     global RUNNING
     if RUNNING:
-        print(f"Worker {WORKER_ID}: 🛑 Shutdown signal received. Finishing current job...")
+        print(f"Worker {WORKER_ID}: 🛑 Shutdown signal received. Finishing current job(s)...")
         RUNNING = False
     else:
         print(f"Worker {WORKER_ID}: 🛑 Shutdown signal received again. Forcing exit.")
         exit(1)
 
 
-def find_and_lock_job(jobs_collection):
+def execute_job(job, limits=None):
     """
-    Atomically find a 'pending' job, set its state to 'processing',
-    and return it.
+    Execute the job (shell command, argv or Python callable) under its
+    resource `limits`.
+    Output is streamed to the job's spool files; only a bounded head and
+    tail of it is kept, in job["output"] and the returned error.
+    Returns (success, error, failure_class).
     """
-    try:
-        now = datetime.datetime.utcnow()
-        
-        job = jobs_collection.find_one_and_update(
-            {
-                "state": "pending",
-                "run_at": {"$lte": now}
-            },
-            {
-                "$set": {
-                    "state": "processing",
-                    "updated_at": now,
-                    "worker_id": WORKER_ID
-                }
-            },
-            sort=[("created_at", 1)],
-            return_document=ReturnDocument.AFTER
-        )
-        return job
-    except Exception as e:
-        print(f"Worker {WORKER_ID}: ❌ Error finding job: {e}")
-        return None
-
-def execute_job(job):
-    """Execute the job's command using subprocess."""
     print(f"Worker {WORKER_ID}: 🚀 Starting job {job['id']}: {job['command']}")
+    limits = limits or {}
+    job["started_at"] = datetime.datetime.utcnow()
     try:
-        result = subprocess.run(
-            job['command'], 
-            shell=True, 
-            capture_output=True, 
-            text=True, 
-            timeout=300
-        )
+        returncode, stderr, job["output"], failure_class = run_spooled(job, limits, OUTPUT_HEAD_BYTES, OUTPUT_TAIL_BYTES)
+        job["exit_code"] = returncode # Matched by retry policy rules
         
-        if result.returncode == 0:
+        if failure_class is None:
             print(f"Worker {WORKER_ID}: ✅ Finished job {job['id']}")
-            return True, None
-        else:
-            stderr = result.stderr or "No stderr output."
+            return True, None, None
+        elif failure_class == FAILURE_COMMAND:
+            stderr = stderr or "No stderr output."
             print(f"Worker {WORKER_ID}: ❌ Job {job['id']} failed. Stderr: {stderr.strip()}")
-            return False, stderr
+            return False, stderr, failure_class
+        else:
+            reason = LIMIT_MESSAGES[failure_class].format(**limits)
+            print(f"Worker {WORKER_ID}: ❌ Job {job['id']} {reason}")
+            return False, f"Job {reason}\n{stderr}".strip(), failure_class
             
     except Exception as e:
         print(f"Worker {WORKER_ID}: ❌ Job {job['id']} execution error: {e}")
-        return False, str(e)
+        return False, str(e), FAILURE_COMMAND
+
+def report_lost_lease(job):
+    print(f"Worker {WORKER_ID}: ⚠️ Lease on job {job['id']} expired and was reclaimed. Discarding this result.")
+    metrics.LEASES_LOST.inc(queue=queue_of(job))
 
-def handle_job_success(jobs_collection, job):
-    """Set job state to 'completed'."""
-    jobs_collection.update_one(
-        {"id": job["id"]},
-        {"$set": {
-            "state": "completed", 
-            "updated_at": datetime.datetime.utcnow(),
-            "worker_id": None
-        }}
-    )
+def report_completed(job):
+    metrics.JOBS_COMPLETED.inc(queue=queue_of(job))
+
+def handle_job_success(store, job, finish=None):
+    """
+    Set job state to 'completed'.
+    Only applies while this worker still holds the job's lease.
+    `finish(job)` replaces the plain store.complete(): it either hands the
+    job to the write-behind buffer (and returns None: the outcome is
+    reported when the buffer flushes) or completes it and claims the
+    next job in one go (and returns whether the completion landed).
+    """
+    if finish is not None:
+        completed = finish(job)
+        if completed is None:
+            return
+    else:
+        with metrics.DB_WRITE_SECONDS.time(operation="complete"):
+            completed = store.complete(WORKER_ID, job)
+    if completed:
+        report_completed(job)
+    else:
+        report_lost_lease(job)
 
-def handle_job_failure(jobs_collection, dlq_collection, job, error_message, base):
-    """Handle retries with exponential backoff or move to DLQ."""
+def handle_job_failure(store, job, error_message, policy, failure_class=FAILURE_COMMAND):
+    """
+    Retry the job after the delay its retry `policy` gives (see retry.py),
+    or move it to the DLQ when it is out of attempts or a policy rule says
+    the error is not worth retrying.
+    `failure_class` (command, timeout, cpu or memory) is recorded with the error.
+    """
     new_attempts = job.get("attempts", 0) + 1
+    rule = matching_rule(policy, error_message, job.get("exit_code"), failure_class)
     
-    if new_attempts >= job["max_retries"]:
-        print(f"Worker {WORKER_ID}: 💀 Job {job['id']} failed max retries. Moving to DLQ.")
+    if new_attempts >= job["max_retries"] or (rule is not None and rule["action"] == "dead"):
+        if new_attempts >= job["max_retries"]:
+            print(f"Worker {WORKER_ID}: 💀 Job {job['id']} failed max retries. Moving to DLQ.")
+        else:
+            print(f"Worker {WORKER_ID}: 💀 Job {job['id']} failed with a non-retryable error. Moving to DLQ.")
         job["state"] = "dead"
         job["updated_at"] = datetime.datetime.utcnow()
         job["last_error"] = error_message
+        job["failure_class"] = failure_class
         job["worker_id"] = None
+        job.pop("lease_expires_at", None)
+        job.pop("claim_id", None)
         
-        dlq_collection.insert_one(job)
-        jobs_collection.delete_one({"id": job["id"]})
+        with metrics.DB_WRITE_SECONDS.time(operation="bury"):
+            buried = store.bury(WORKER_ID, job)
+        if buried:
+            metrics.DLQ_MOVES.inc(queue=queue_of(job), failure_class=failure_class)
+        else:
+            # Someone reclaimed the job meanwhile: it is not ours to bury
+            report_lost_lease(job)
         
     else:
-        delay_seconds = base ** new_attempts
+        delay_seconds = next_delay(policy, new_attempts, job.get("retry_delay"), rule)
+        job["retry_delay"] = delay_seconds # Decorrelated jitter grows from the last delay
         run_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=delay_seconds)
         
         print(f"Worker {WORKER_ID}: 🔁 Job {job['id']} retrying ({new_attempts}/{job['max_retries']}). Next run in {delay_seconds}s.")
         
-        jobs_collection.update_one(
-            {"id": job["id"]},
-            {"$set": {
-                "state": "pending",
-                "attempts": new_attempts,
-                "run_at": run_at,
-                "updated_at": datetime.datetime.utcnow(),
-                "last_error": error_message,
-                "worker_id": None
-            }}
-        )
+        with metrics.DB_WRITE_SECONDS.time(operation="retry"):
+            retried = store.retry(WORKER_ID, job, new_attempts, run_at, error_message, failure_class)
+        if retried:
+            metrics.RETRIES.inc(queue=queue_of(job), failure_class=failure_class)
+        else:
+            report_lost_lease(job)
+
+def process_job(store, job, backoff_base, config=None, finish=None):
+    """
+    Run one claimed job and record the outcome.
+    Safe to call from pool threads: both stores are thread-safe.
+    The retry policy comes from the job, then its queue, then the global
+    config; a per-queue 'backoff_base' in `config` overrides the worker default.
+    Resource limits come from the job, then its queue, then the global config.
+    `finish` is passed on to handle_job_success.
+    """
+    try:
+        started = time.perf_counter()
+        success, error, failure_class = execute_job(job, job_limits(job, config if config is not None else DEFAULT_CONFIG))
+        metrics.EXECUTION_SECONDS.observe(time.perf_counter() - started, queue=queue_of(job), outcome=failure_class or "success")
+        
+        if success:
+            handle_job_success(store, job, finish)
+        else:
+            queue_config = get_queue_config(config, queue_of(job)) if config is not None else {"backoff_base": backoff_base}
+            handle_job_failure(store, job, error, resolve_policy(queue_config, job), failure_class)
+    except Exception as e:
+        print(f"Worker {WORKER_ID}: ❌ Error recording outcome of job {job['id']}: {e}")
 
-def start_worker(backoff_base):
-    """Main worker loop."""
-    global WORKER_ID, RUNNING
+def start_worker(backoff_base, prefetch=1, concurrency=1, idle_backoff=(0.05, 5.0), config=None, queues=None, weights=None):
+    """
+    Main worker loop.
+    With prefetch > 1 the worker claims up to that many jobs at once and
+    works through them from a local buffer before claiming again.
+    With concurrency > 1 up to that many jobs run at the same time on a
+    bounded thread pool that shares this process's job store.
+    When idle, the worker sleeps until a change stream reports a new job
+    (or, without change streams, for an exponentially growing interval
+    bounded by idle_backoff = (min, max) seconds).
+    If `config` is given, it also picks the storage backend, and (on
+    MongoDB) a background compactor archives completed jobs into the
+    history collection on the configured schedule.
+    Every claim carries a lease that a background heartbeat keeps
+    extending; the same thread returns other workers' expired leases to
+    'pending', so jobs of crashed workers are never stuck.
+    The worker only serves `queues` (default: just the default queue),
+    picking between them in proportion to `weights`.
+    Timings and outcomes are published every `metrics_interval` seconds
+    to METRICS_DIR (see metrics.py).
+    With concurrency > 1, completions and lease heartbeats are written
+    behind, in one bulk write every `write_behind_ms` (see writebehind.py).
+    A single-slot SQLite worker instead completes each job and claims the
+    next in one transaction (complete_and_claim).
+    """
+    global WORKER_ID, RUNNING, LEASE_SECONDS, OUTPUT_HEAD_BYTES, OUTPUT_TAIL_BYTES
+    metrics.reset() # Don't republish whatever a parent process recorded
     
     # --- 1. SET UP LOGGING (THIS MUST BE FIRST) ---
     pid = os.getpid()
-    WORKER_ID = f"pid_{pid}" # Set the global worker ID
+    # The random suffix keeps IDs unique even if the OS reuses a PID,
+    # so a new worker can never heartbeat a dead worker's leases.
+    WORKER_ID = f"pid_{pid}_{uuid.uuid4().hex[:8]}" # Set the global worker ID
+    if config is not None:
+        LEASE_SECONDS = config["lease_seconds"]
+        OUTPUT_HEAD_BYTES = config["output_head_bytes"]
+        OUTPUT_TAIL_BYTES = config["output_tail_bytes"]
+        configure_pool(config["callable_max_tasks"])
     
     try:
         os.makedirs("logs", exist_ok=True)
@@ -149,43 +233,137 @@ def start_worker(backoff_base):
     
     print(f"--- Worker {WORKER_ID} log started at {datetime.datetime.utcnow()} ---")
     print(f"Using backoff base: {backoff_base}")
+    print(f"Using prefetch limit: {prefetch}")
+    print(f"Using concurrency: {concurrency}")
+    queues = queues or [DEFAULT_QUEUE]
+    print(f"Serving queues: {', '.join(queues)}" + (f" (weights {weights})" if weights else ""))
     
     # --- 3. CONNECT TO DATABASE ---
-    db, jobs_collection, dlq_collection = None, None, None
+    store = None
     try:
-        db, jobs_collection, dlq_collection = get_db()
-        if db is None:
-            raise Exception("Database connection failed. get_db() returned None.")
+        store = get_store(config)
+        if store is None:
+            raise Exception("Database connection failed. get_store() returned None.")
         
-        # Ensure indexes are created by the worker
-        if not ensure_indexes():
+        # Ensure indexes (or the SQLite schema) are created by the worker
+        if not store.setup():
              raise Exception("Failed to create database indexes.")
              
-        print("MongoDB connection successful and indexes ensured.")
+        print(f"Storage backend '{store.name}' connected and indexes ensured.")
         
     except Exception as e:
         print(f"CRITICAL: Worker {WORKER_ID} exiting. DB setup failed: {e}")
         RUNNING = False # Stop the worker loop
     
     # --- 4. START THE MAIN LOOP ---
+    buffer = deque()
+    in_flight = set()
+    notifier = None
+    writer = None
+    finish = None
+    drained = threading.Event()
+
+    def record_claim(jobs, started):
+        metrics.CLAIM_SECONDS.observe(time.perf_counter() - started, outcome="claimed" if jobs else "empty")
+        for job in jobs:
+            wait_seconds = (job["updated_at"] - job["run_at"]).total_seconds()
+            metrics.QUEUE_WAIT_SECONDS.observe(max(wait_seconds, 0), queue=queue_of(job))
+        if jobs:
+            notifier.reset()
+
+    def complete_and_claim(job):
+        # Nothing buffered: take the next job(s) with the same store call
+        if buffer or not RUNNING:
+            with metrics.DB_WRITE_SECONDS.time(operation="complete"):
+                return store.complete(WORKER_ID, job)
+        started = time.perf_counter()
+        try:
+            completed, claimed = store.complete_and_claim(WORKER_ID, job, prefetch, queues, weights, LEASE_SECONDS)
+        except Exception as e:
+            print(f"Worker {WORKER_ID}: ❌ Complete-and-claim failed, completing on its own: {e}")
+            return store.complete(WORKER_ID, job)
+        buffer.extend(claimed)
+        record_claim(claimed, started)
+        return completed
+
+    if RUNNING:
+        notifier = JobNotifier(store, *idle_backoff, label=f"Worker {WORKER_ID}", queues=queues)
+        notifier.start()
+        if config is not None and store.name == "mongo":
+            start_compactor(store.db, config, lambda: RUNNING, label=f"Worker {WORKER_ID}")
+        if config is not None:
+            start_spool_pruner(config, lambda: RUNNING, label=f"Worker {WORKER_ID}")
+        write_behind_ms = (config or DEFAULT_CONFIG)["write_behind_ms"]
+        if concurrency > 1 and write_behind_ms > 0:
+            writer = WriteBehind(store, WORKER_ID, write_behind_ms / 1000, report_completed, report_lost_lease, label=f"Worker {WORKER_ID}").start()
+            finish = writer.complete
+        elif concurrency == 1 and store.name == "sqlite":
+            # MongoDB has no single round trip for both: it would just be complete() then claim()
+            finish = complete_and_claim
+        # Leases must keep renewing while running jobs drain after shutdown
+        start_lease_keeper(store, WORKER_ID, LEASE_SECONDS, lambda: not drained.is_set(), label=f"Worker {WORKER_ID}",
+                           renew=writer.heartbeat if writer else None)
+        metrics_interval = (config or DEFAULT_CONFIG)["metrics_interval"]
+        metrics.start_metrics_writer(f"worker_{WORKER_ID}", metrics_interval, lambda: not drained.is_set(), label=f"Worker {WORKER_ID}")
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="job")
     while RUNNING:
         try:
-            job = find_and_lock_job(jobs_collection)
+            free_slots = concurrency - len(in_flight)
+            
+            if free_slots > 0 and not buffer:
+                started = time.perf_counter()
+                buffer.extend(store.claim(WORKER_ID, max(prefetch, free_slots), queues, weights, LEASE_SECONDS))
+                record_claim(buffer, started)
+            
+            while free_slots > 0 and buffer and RUNNING:
+                job = buffer.popleft()
+                in_flight.add(executor.submit(process_job, store, job, backoff_base, config, finish))
+                free_slots -= 1
             
-            if job:
-                success, error = execute_job(job)
-                
-                if success:
-                    handle_job_success(jobs_collection, job)
-                else:
-                    handle_job_failure(jobs_collection, dlq_collection, job, error, backoff_base)
-            else:
-                if RUNNING:
-                    time.sleep(1) # Sleep to avoid busy-waiting
+            if in_flight:
+                # Wake up as soon as any slot frees; the timeout keeps the
+                # loop responsive to the shutdown flag.
+                done, in_flight = wait(in_flight, timeout=1, return_when=FIRST_COMPLETED)
+            elif RUNNING:
+                # Nothing to do: sleep until a job shows up or becomes due
+                notifier.wait(lambda: RUNNING)
                     
         except Exception as e:
             # Catch-all for safety in the loop
             print(f"CRITICAL: Unhandled error in worker loop: {e}")
             time.sleep(5)
     
+    if notifier:
+        notifier.stop()
+    
+    # --- 5. RELEASE UNSTARTED BUFFERED JOBS ---
+    def release_buffer():
+        unstarted = []
+        while buffer:
+            unstarted.append(buffer.popleft())
+        if unstarted:
+            try:
+                released = store.release(WORKER_ID, unstarted)
+                print(f"Worker {WORKER_ID}: ↩️ Released {released} buffered job(s) back to 'pending'.")
+            except Exception as e:
+                print(f"Worker {WORKER_ID}: ❌ Error releasing buffered jobs: {e}")
+    release_buffer()
+    
+    # --- 6. DRAIN RUNNING JOBS ---
+    if in_flight:
+        print(f"Worker {WORKER_ID}: ⏳ Waiting for {len(in_flight)} running job(s) to finish...")
+    executor.shutdown(wait=True)
+    shutdown_pool()
+    # A job that finished just as we stopped may have claimed the next one with complete_and_claim
+    release_buffer()
+    # --- 7. WRITE WHAT THE WRITE-BEHIND BUFFER STILL HOLDS ---
+    if writer is not None:
+        writer.stop()
+    drained.set()
+    if store is not None:
+        try:
+            metrics.write_snapshot(f"worker_{WORKER_ID}")
+        except Exception as e:
+            print(f"Worker {WORKER_ID}: ❌ Writing metrics failed: {e}")
+    
     print(f"Worker {WORKER_ID}: Gracefully shutting down.")
\ No newline at end of file
@@ -3,28 +3,39 @@ import os
 import signal
 from multiprocessing import Process
 from worker import start_worker
+from supervisor import run_supervisor
 from config import get_config
 
 PID_FILE = ".queuectl.pids"
+SUPERVISOR_PID_FILE = ".queuectl.supervisor.pid"
 
-def start_workers(count):
-    if os.path.exists(PID_FILE):
-        return False, "❌ Workers are already running. Use 'worker stop' first."
+def start_workers(count, prefetch=None, concurrency=1, queues=None, weights=None, add=False):
+    """
+    Start `count` background workers serving `queues` (default: the
+    default queue). With add=True the new pool joins workers that are
+    already running, e.g. to give another queue its own pool.
+    """
+    adding = os.path.exists(PID_FILE)
+    if adding and not add:
+        return False, "❌ Workers are already running. Use 'worker stop' first, or '--add' to start another pool."
 
     config = get_config()
     backoff_base = config["backoff_base"]
+    if prefetch is None:
+        prefetch = config["prefetch"]
+    idle_backoff = (config["idle_backoff_min"], config["idle_backoff_max"])
     pids = []
     messages = []
 
     for _ in range(count):
-        p = Process(target=start_worker, args=(backoff_base,))
+        p = Process(target=start_worker, args=(backoff_base, prefetch, concurrency, idle_backoff, config, queues, weights))
         p.start()
         pids.append(p.pid)
         messages.append(f"   Started worker with PID: {p.pid}")
         
     try:
-        with open(PID_FILE, 'w') as f:
-            f.write("\n".join(map(str, pids)))
+        with open(PID_FILE, 'a' if adding else 'w') as f:
+            f.write(("\n" if adding else "") + "\n".join(map(str, pids)))
         messages.append(f"✅ All workers running. PID data stored in {PID_FILE}.")
         return True, "\n".join(messages)
     except Exception as e:
@@ -57,4 +68,46 @@ def stop_workers():
         messages.append(f"✅ All workers stopped. Removed {PID_FILE}.")
         return True, "\n".join(messages)
     except Exception as e:
-        return False, f"❌ Error stopping workers: {e}"
\ No newline at end of file
+        return False, f"❌ Error stopping workers: {e}"
+
+def start_supervisor(prefetch=None, concurrency=1, queues=None, weights=None):
+    """Start the autoscaling supervisor, which owns its own worker pool."""
+    if os.path.exists(SUPERVISOR_PID_FILE):
+        return False, "❌ A supervisor is already running. Use 'supervisor stop' first."
+
+    config = get_config()
+    if prefetch is None:
+        prefetch = config["prefetch"]
+    if config["backend"] != "mongo":
+        return False, f"❌ The supervisor needs the mongo backend (current backend: {config['backend']})."
+    if config["supervisor_min_workers"] > config["supervisor_max_workers"]:
+        return False, "❌ supervisor_min_workers is larger than supervisor_max_workers."
+
+    p = Process(target=run_supervisor, args=(config, queues, weights, prefetch, concurrency))
+    p.start()
+    try:
+        with open(SUPERVISOR_PID_FILE, 'w') as f:
+            f.write(str(p.pid))
+        return True, f"✅ Supervisor running with PID {p.pid} ({config['supervisor_min_workers']}-{config['supervisor_max_workers']} workers)."
+    except Exception as e:
+        try: os.kill(p.pid, signal.SIGTERM)
+        except: pass
+        return False, f"❌ Error writing PID file: {e}"
+
+def stop_supervisor():
+    """SIGTERM the supervisor; it stops its workers gracefully before exiting."""
+    if not os.path.exists(SUPERVISOR_PID_FILE):
+        return True, "🤔 No supervisor seems to be running (PID file not found)."
+
+    try:
+        with open(SUPERVISOR_PID_FILE, 'r') as f:
+            pid = int(f.read().strip())
+        try:
+            os.kill(pid, signal.SIGTERM)
+            message = f"✅ Sent SIGTERM to supervisor {pid}. It will stop its workers once their current jobs finish."
+        except ProcessLookupError:
+            message = f"   Supervisor {pid} was already stopped."
+        os.remove(SUPERVISOR_PID_FILE)
+        return True, message
+    except Exception as e:
+        return False, f"❌ Error stopping supervisor: {e}"
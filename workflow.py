@@ -0,0 +1,91 @@
+# workflow.py
+import json
+from collections import deque
+from jobs import build_job, validate_queue_name, DEFAULT_QUEUE, KIND_SHELL, LIMIT_KEYS
+from throttle import parse_rate
+
+def load_workflow(source):
+    """
+    Read job specs from a workflow file: a JSON list of jobs, or an object
+    with a "jobs" list. Each job has an 'id' and a 'command', and may have
+    'after' (ids it waits for), 'queue', 'priority', 'kind', 'args',
+    'concurrency_key', 'max_running', 'rate', 'retry_policy' and the
+    limits in LIMIT_KEYS, as on 'enqueue'.
+    """
+    data = json.load(source)
+    specs = data.get("jobs") if isinstance(data, dict) else data
+    if not isinstance(specs, list) or not specs:
+        raise ValueError('A workflow file must hold a list of jobs, or {"jobs": [...]}.')
+    for number, spec in enumerate(specs, start=1):
+        if not isinstance(spec, dict) or not spec.get("id") or not spec.get("command"):
+            raise ValueError(f"Job #{number} needs an 'id' and a 'command'.")
+        spec["id"] = str(spec["id"])
+        after = spec.get("after") or []
+        spec["after"] = [str(parent) for parent in ([after] if isinstance(after, str) else after)]
+    return specs
+
+def topological_order(specs):
+    """
+    Order specs so every job comes after the jobs it waits for (Kahn's
+    algorithm, file order among equals). Ids in 'after' that aren't in
+    the file are external: they must already exist in the queue.
+    Returns (ordered_specs, external_ids); raises ValueError on a
+    duplicate id or a cycle.
+    """
+    by_id = {}
+    for spec in specs:
+        if spec["id"] in by_id:
+            raise ValueError(f"Duplicate job ID in workflow: '{spec['id']}'.")
+        by_id[spec["id"]] = spec
+
+    remaining = {job_id: 0 for job_id in by_id}
+    children = {job_id: [] for job_id in by_id}
+    for spec in specs:
+        for parent in set(spec["after"]):
+            if parent in by_id:
+                remaining[spec["id"]] += 1
+                children[parent].append(spec["id"])
+
+    ready = deque(job_id for job_id in by_id if remaining[job_id] == 0)
+    ordered = []
+    while ready:
+        job_id = ready.popleft()
+        ordered.append(by_id[job_id])
+        for child in children[job_id]:
+            remaining[child] -= 1
+            if remaining[child] == 0:
+                ready.append(child)
+
+    if len(ordered) < len(specs):
+        stuck = [job_id for job_id in by_id if remaining[job_id] > 0]
+        raise ValueError(f"Workflow has a dependency cycle among: {', '.join(stuck)}")
+
+    external = sorted({parent for spec in specs for parent in spec["after"] if parent not in by_id})
+    return ordered, external
+
+def build_workflow_jobs(specs, config, id_prefix="", queue=DEFAULT_QUEUE, now=None):
+    """
+    Job documents for a workflow, parents first. `id_prefix` is added to
+    every id defined in the file (and to references to them), so the same
+    file can be submitted again as a new run. Returns (jobs, external_ids).
+    """
+    ordered, external = topological_order(specs)
+    defined = {spec["id"] for spec in specs}
+
+    def full_id(job_id):
+        return f"{id_prefix}{job_id}" if job_id in defined else job_id
+
+    jobs = []
+    for spec in ordered:
+        job_queue = validate_queue_name(spec.get("queue") or queue)
+        limits = {key: spec.get(key) for key in LIMIT_KEYS}
+        jobs.append(build_job(
+            full_id(spec["id"]), spec["command"], config, now=now,
+            priority=spec.get("priority", 0), queue=job_queue, limits=limits,
+            kind=spec.get("kind", KIND_SHELL), args=spec.get("args"),
+            after=[full_id(parent) for parent in spec["after"]],
+            concurrency_key=spec.get("concurrency_key"), max_running=spec.get("max_running"),
+            rate=parse_rate(str(spec["rate"])) if spec.get("rate") is not None else None,
+            retry_policy=spec.get("retry_policy")
+        ))
+    return jobs, external
@@ -0,0 +1,110 @@
+# writebehind.py
+import threading
+import time
+import metrics
+
+FLUSH_RETRIES = 5 # Attempts stop() makes to write what is left before giving up
+
+class WriteBehind:
+    """
+    Buffers a worker's job completions (and lease heartbeats) and writes
+    them with store.complete_many() every `interval` seconds, so a busy
+    worker pays one bulk write for many jobs instead of one write each.
+
+    Job threads never wait for the database: the outcome of each job is
+    reported later through `on_completed` / `on_lost`. stop() flushes
+    whatever is left before the worker exits. A completion that still
+    can't be written keeps its lease and runs again once the lease
+    expires, as it would if the worker had crashed.
+    """
+
+    def __init__(self, store, worker_id, interval, on_completed, on_lost, label="Worker", max_batch=500):
+        self.store = store
+        self.worker_id = worker_id
+        self.interval = interval
+        self.on_completed = on_completed
+        self.on_lost = on_lost
+        self.label = label
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending = []
+        self._heartbeat = None # lease_seconds to renew with at the next flush
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def complete(self, job):
+        with self._lock:
+            self._pending.append(job)
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self._wake.set()
+
+    def heartbeat(self, lease_seconds):
+        """Renew this worker's leases with the next flush (used by the lease keeper)."""
+        with self._lock:
+            self._heartbeat = lease_seconds
+        self._wake.set()
+
+    def flush(self):
+        """
+        Write one batch. Returns how many completions it carried. On a
+        database error the batch goes back to the front of the buffer
+        and the error is raised.
+        """
+        with self._lock:
+            jobs = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            lease_seconds, self._heartbeat = self._heartbeat, None
+        if not jobs and not lease_seconds:
+            return 0
+        try:
+            with metrics.DB_WRITE_SECONDS.time(operation="complete_many"):
+                won = self.store.complete_many(self.worker_id, jobs, lease_seconds)
+        except Exception:
+            with self._lock:
+                self._pending[:0] = jobs
+                if self._heartbeat is None:
+                    self._heartbeat = lease_seconds
+            raise
+        won_ids = {job["id"] for job in won}
+        for job in jobs:
+            (self.on_completed if job["id"] in won_ids else self.on_lost)(job)
+        return len(jobs)
+
+    def _flush_all(self):
+        while self.flush() >= self.max_batch:
+            pass
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self._flush_all()
+            except Exception as e:
+                print(f"{self.label}: ❌ Write-behind flush failed: {e}")
+                time.sleep(min(1, self.interval * 10))
+
+    def stop(self):
+        """Stop the flush thread and write everything still buffered."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        for attempt in range(FLUSH_RETRIES):
+            try:
+                self._flush_all()
+                return True
+            except Exception as e:
+                print(f"{self.label}: ❌ Final write-behind flush failed (attempt {attempt + 1}/{FLUSH_RETRIES}): {e}")
+                time.sleep(2 ** attempt * 0.1)
+        with self._lock:
+            left = len(self._pending)
+        print(f"{self.label}: ⚠️ {left} completion(s) could not be written; those jobs will run again after their leases expire.")
+        return False